@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The swath backends: rasterizing every fix in the bundled Pacific file with
+# each backend, and checks that every backend gives the same frequency grids
+# and storm grids. The 'numba' backend is skipped if numba isn't installed.
+
+# The checks (check_*) are plain tests, so they can be run on their own with
+#   python -m pytest bench_backends.py -k check --benchmark-disable
+
+import pytest
+import numpy as np
+from src.d03_processing import frequency as fq
+from src.d03_processing import grids as grd
+from src.d03_processing import swath as sw
+from src.d07_visualization import storm_tracks as trk
+
+
+BACKENDS = ['numpy', 'python', 'numba']
+
+GRIDS = {'global_1': grd.GLOBAL,
+         'global_0.5': grd.GridSpec(0.5, -90, 90, -180, 180),
+         'pacific_0.25': grd.regional(0, 40, -140, -90, 0.25)}
+
+# The numpy backend can put a few cells on the other side of a cell edge on
+# grids this fine (see swath), so here only the backends using the C math
+# library are held to the reference.
+FINE_GRID = grd.regional(0, 40, -140, -90, 0.1)
+
+
+def _backend(name):
+    if name == 'numba':
+        pytest.importorskip("numba")
+    return name
+
+
+# Every drawable fix of the Pacific file, as for tropical storm winds.
+@pytest.fixture(scope = "module")
+def fixes(pacific):
+    positions_df, storms_df = pacific
+    table, value = fq._swath_table(positions_df)
+    return table[table[:, 6] == 1]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def bench_swath_cells(fixes, measure, backend):
+    backend = _backend(backend)
+    # The first call compiles the numba kernels.
+    sw.swath_cells(fixes[:1, 0], fixes[:1, 1], fixes[:1, 2:6], backend = backend)
+    measure(sw.swath_cells, fixes[:, 0], fixes[:, 1], fixes[:, 2:6], backend = backend, rounds = 3)
+
+
+@pytest.mark.parametrize("grid", GRIDS)
+@pytest.mark.parametrize("hu_only", [False, True])
+@pytest.mark.parametrize("backend", ['python', 'numba'])
+def check_wind_frequency(pacific, backend, hu_only, grid):
+    backend = _backend(backend)
+    positions_df, storms_df = pacific
+    stormlist = storms_df['stormID'][storms_df['year'] >= 2004]
+
+    expected = fq.wind_frequency(stormlist, positions_df = positions_df, hu_only = hu_only, grid = GRIDS[grid])
+    result = fq.wind_frequency(stormlist, positions_df = positions_df, hu_only = hu_only, grid = GRIDS[grid], backend = backend)
+
+    assert np.array_equal(result, expected)
+
+
+def check_fine_grid(fixes):
+    _backend('numba')
+
+    expected = sw.swath_cells(fixes[:, 0], fixes[:, 1], fixes[:, 2:6], FINE_GRID, backend = 'python')
+    result = sw.swath_cells(fixes[:, 0], fixes[:, 1], fixes[:, 2:6], FINE_GRID, backend = 'numba')
+
+    for expected_cells, cells in zip(expected, result):
+        assert np.array_equal(cells, expected_cells)
+
+
+@pytest.mark.parametrize("backend", ['python', 'numba'])
+def check_storm_grid(pacific, backend):
+    backend = _backend(backend)
+    positions_df, storms_df = pacific
+
+    for stormID in storms_df['stormID'][storms_df['year'] >= 2015][:20]:
+        winds = trk.winds(stormID, positions_df)
+        args = (trk.track_lat(stormID, positions_df), trk.track_lon(stormID, positions_df),
+                winds[0], list(zip(*winds[1:5])), list(zip(*winds[5:9])))
+
+        assert np.array_equal(sw.storm_grid(*args, backend = backend), sw.storm_grid(*args))
+
+
+# Footprints cached by the numpy backend aren't handed to the others, which
+# put a few cells elsewhere on FINE_GRID.
+def check_cache_by_math(pacific):
+    from src.d03_processing import swath_cache as swc
+
+    positions_df, storms_df = pacific
+    stormlist = storms_df['stormID'][storms_df['year'] >= 2004]
+    swc._MEMORY.clear()
+
+    swc.cached_frequency(stormlist, positions_df, disk = False, grid = FINE_GRID)
+    result = swc.cached_frequency(stormlist, positions_df, disk = False, grid = FINE_GRID, backend = 'python')
+
+    assert np.array_equal(result, fq.wind_frequency(stormlist, positions_df = positions_df, grid = FINE_GRID, backend = 'python'))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Conditional downloads of HURDAT files, against a local HTTP server standing
+# in for the NHC site: the first download, 304 responses to the ETag and
+# Last-Modified of the last one, servers that ignore them, failed downloads
+# and failed updates of the partitioned tables.
+
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from src.d01_data import data_download as ddln
+from src.d02_intermediate import hurdat_cache as hc
+from synthetic_hurdat import write_synthetic_hurdat
+
+
+INDEX_PAGE = f"<html><body><span>{ddln.HURDAT_LABELS['Pacific']}</span> <a href=\"hurdat.txt\">hurdat.txt</a></body></html>"
+
+
+# Serves the index page and server.body as hurdat.txt, answering conditional
+# requests with 304 unless server.conditional is False, and cutting the body
+# short if server.truncate is set. The headers of every request for the file
+# are kept in server.requests.
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+
+        if self.path.endswith("/hurdat.txt"):
+            server.requests.append(dict(self.headers))
+            etag, last_modified = f"\"{server.version}\"", f"Mon, 0{server.version} Jun 2026 00:00:00 GMT"
+
+            if server.conditional and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(server.body)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            self.wfile.write(server.body[:len(server.body) // 2] if server.truncate else server.body)
+            if server.truncate:
+                self.close_connection = True
+            return
+
+        body = INDEX_PAGE.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(workspace):
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests, httpd.conditional, httpd.truncate = [], True, False
+    httpd.index_url = f"http://127.0.0.1:{httpd.server_port}/data/"
+
+    # Each release of the file is a synthetic HURDAT file with one more
+    # storm than the last.
+    def release(version):
+        path = workspace / "data" / "01_raw" / "release.txt"
+        write_synthetic_hurdat(path, 20 + version, seed = 11)
+        httpd.version, httpd.body = version, path.read_bytes()
+        os.remove(path)
+    httpd.release = release
+    release(1)
+
+    thread = threading.Thread(target = httpd.serve_forever, daemon = True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _download(server, dest_filename, partition = False):
+    return ddln.download_hurdat_raw("Pacific", dest_filename, index_url = server.index_url, partition = partition)
+
+
+def check_conditional_download(server, workspace):
+    dest_path = "../data/01_raw/Served.csv"
+    url = ddln.find_hurdat_url(ddln.HURDAT_LABELS['Pacific'], server.index_url)
+
+    # First download: the whole file, with the headers to ask about it next
+    # time recorded.
+    assert ddln.fetch(url, dest_path)
+    metadata = ddln._read_metadata(dest_path)
+    assert metadata['etag'] == "\"1\"" and metadata['last_modified'].startswith("Mon, 01 Jun")
+    assert not server.requests[-1].get('If-None-Match')
+
+    # Unchanged: the server answers 304.
+    assert not ddln.fetch(url, dest_path)
+    assert server.requests[-1]['If-None-Match'] == "\"1\""
+    assert server.requests[-1]['If-Modified-Since'] == metadata['last_modified']
+
+    # A server ignoring the headers sends the file again, which is then
+    # recognised by its checksum.
+    server.conditional = False
+    assert not ddln.fetch(url, dest_path)
+
+    # A new release is downloaded and recorded.
+    server.release(2)
+    assert ddln.fetch(url, dest_path)
+    assert ddln._read_metadata(dest_path)['etag'] == "\"2\""
+    assert ddln.is_current(dest_path)
+
+    # Editing the file locally means it's downloaded again, unconditionally.
+    with open(dest_path, "ab") as f:
+        f.write(b"\n")
+    assert ddln.fetch(url, dest_path)
+    assert not server.requests[-1].get('If-None-Match')
+
+
+def check_failed_download(server, workspace):
+    dest_path = "../data/01_raw/Broken.csv"
+    url = ddln.find_hurdat_url(ddln.HURDAT_LABELS['Pacific'], server.index_url)
+
+    server.truncate = True
+    with pytest.raises(Exception):
+        ddln.fetch(url, dest_path)
+
+    assert not os.path.exists(dest_path + ".part")
+    assert not os.path.exists(dest_path) and not ddln._read_metadata(dest_path)
+
+
+# An update of the tables that fails is retried by the next download rather
+# than the file being taken as up to date.
+def check_failed_update(server, workspace, monkeypatch):
+    from src.d02_intermediate import update_hurdat as uph
+
+    _download(server, "Refreshed", partition = True)
+    assert len(hc.load_storms("Refreshed")) == 21
+
+    server.release(2)
+    update_hurdat = uph.update_hurdat
+
+    def fail(fn, write = True):
+        raise RuntimeError("update failed")
+    monkeypatch.setattr(uph, "update_hurdat", fail)
+    with pytest.raises(RuntimeError):
+        _download(server, "Refreshed", partition = True)
+    assert len(hc.load_storms("Refreshed")) == 21
+
+    monkeypatch.setattr(uph, "update_hurdat", update_hurdat)
+    _download(server, "Refreshed", partition = True)
+    assert len(hc.load_storms("Refreshed")) == 22
+
+    # Now that it succeeded, the file is up to date.
+    requests = len(server.requests)
+    _download(server, "Refreshed", partition = True)
+    assert server.requests[requests]['If-None-Match'] == "\"2\""
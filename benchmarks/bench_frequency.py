@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# wind_frequency for tropical storm and hurricane (hu_only) winds, across
+# numbers of storms (from the synthetic dataset) and grid resolutions, plus
+# every storm in the bundled Pacific file since 2004 on the default grid.
+
+import pytest
+from src.d03_processing import frequency as fq
+from src.d03_processing import grids as grd
+
+
+MODES = {'ts': False, 'hu': True}
+
+
+@pytest.mark.parametrize("hu", MODES)
+def bench_wind_frequency_pacific(pacific, measure, hu):
+    positions_df, storms_df = pacific
+    stormlist = storms_df['stormID'][storms_df['year'] >= 2004]
+    measure(fq.wind_frequency, stormlist, positions_df = positions_df, hu_only = MODES[hu])
+
+
+@pytest.mark.parametrize("resolution", [1, 0.5, 0.25])
+@pytest.mark.parametrize("num_storms", [100, 1000])
+@pytest.mark.parametrize("hu", MODES)
+def bench_wind_frequency(synthetic, measure, hu, num_storms, resolution):
+    positions_df, storms_df = synthetic
+    stormlist = storms_df['stormID'][:num_storms]
+    grid = grd.GridSpec(resolution, -90, 90, -180, 180)
+    measure(fq.wind_frequency, stormlist, positions_df = positions_df, hu_only = MODES[hu], grid = grid, sparse = True)
+
+
+# The return period quantiles of each cell come from the right draws whatever
+# quantiles are asked for (here not symmetric about the median): each lies
+# between the two draws' return periods it interpolates between, and they
+# rise with the quantile.
+def check_return_period_quantiles(pacific):
+    import numpy as np
+    from src.d03_processing import frequency_cube as fcb
+    from src.d03_processing import return_periods as rtp
+
+    positions_df, storms_df = pacific
+    cube = fcb.frequency_cube(storms_df, positions_df)
+    quantiles = (0.1, 0.5)
+
+    result = rtp.bootstrap_return_periods(cube, num_draws = 200, quantiles = quantiles, seed = 3)
+
+    cells = rtp.season_cells(cube)
+    counts = rtp.season_counts(cube, cells)
+    weights = rtp.draw_weights(len(cube.labels), 200, seed = 3)
+    exceeds = weights @ (counts >= 1).astype(np.float64) / len(cube.labels)
+    with np.errstate(divide = 'ignore'):
+        return_periods = 1 / exceeds
+    lower = np.quantile(return_periods, quantiles, axis = 0, method = 'lower')
+    higher = np.quantile(return_periods, quantiles, axis = 0, method = 'higher')
+
+    rows, cols = np.unravel_index(cells, cube.grid.shape)
+    values = result.return_period_quantiles[:, rows, cols]
+    assert (values >= lower).all() and (values <= higher).all()
+    assert (values[0] <= values[1]).all()
+
+
+# Recording the stages of wind_frequency with memory = True inside code that
+# is already tracing memory (like measure) leaves that tracing alone.
+def check_recording_memory(pacific):
+    import tracemalloc
+    import numpy as np
+    from src.d00_utils import instrument as ins
+    from src.d07_visualization import storm_tracks as trk
+
+    positions_df, storms_df = pacific
+    stormlist = storms_df['stormID'][storms_df['year'] >= 2004]
+
+    tracemalloc.start()
+    try:
+        block = np.ones(2**22)
+        del block
+        with ins.recording(memory = True) as events:
+            fq.wind_frequency(stormlist, positions_df = positions_df)
+
+        assert tracemalloc.is_tracing()
+        assert tracemalloc.get_traced_memory()[1] >= 2**25
+    finally:
+        tracemalloc.stop()
+
+    assert events and not any('peak_mb' in event for event in events)
+    # Fixes missing their extents are counted apart from fixes left out by
+    # their status.
+    counters = next(event for event in events if event['stage'] == 'accumulate.gather')['counters']
+    table, value = fq._swath_table(positions_df)
+    gathered = np.concatenate([table[trk.storm_rows(stormID, positions_df)] for stormID in stormlist])
+    assert counters['missing_extent_fixes'] == (gathered[:, 2] == -999).sum()
+    assert 0 < counters['missing_extent_fixes'] < counters['undrawn_fixes']
+
+    with ins.recording(memory = True) as events:
+        fq.wind_frequency(stormlist, positions_df = positions_df)
+    assert all('peak_mb' in event for event in events) and not tracemalloc.is_tracing()
+
+
+# Return periods from a cube on disk, read a block and a chunk at a time
+# (and spread over processes), are the same as from the cube in memory, and
+# finding the cells storms reached doesn't load the cube.
+def check_return_periods_from_disk(pacific, tmp_path):
+    import tracemalloc
+    import numpy as np
+    from src.d03_processing import frequency_cube as fcb
+    from src.d03_processing import return_periods as rtp
+
+    positions_df, storms_df = pacific
+    grid = grd.GridSpec(0.25, -90, 90, -180, 180)
+    in_memory = fcb.frequency_cube(storms_df, positions_df, grid = grid)
+    on_disk = fcb.frequency_cube(storms_df, positions_df, grid = grid, dest_dir = str(tmp_path / "cube"))
+
+    tracemalloc.start()
+    try:
+        cells = rtp.season_cells(on_disk, block_bytes = 2**20)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert np.array_equal(cells, np.flatnonzero(np.asarray(in_memory.counts).any(axis = 0)))
+    assert peak < on_disk.counts.nbytes / 4
+
+    expected = rtp.bootstrap_return_periods(in_memory, num_draws = 100, quantiles = (0.1, 0.5))
+    result = rtp.bootstrap_return_periods(on_disk, num_draws = 100, quantiles = (0.1, 0.5), chunk_bytes = 2**20, workers = 2)
+    for field in ['rate', 'rate_quantiles', 'exceedance', 'exceedance_quantiles', 'return_period', 'return_period_quantiles']:
+        assert np.array_equal(getattr(result, field), getattr(expected, field))
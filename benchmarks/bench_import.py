@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Importing the processing modules in a fresh interpreter, which shouldn't
+# load the plotting libraries (cartopy and matplotlib are only imported when
+# something is drawn) or any data.
+
+import sys
+import json
+import subprocess
+
+import pytest
+from conftest import root_dir
+
+
+MODULES = ['src.d03_processing.frequency', 'src.d07_visualization.storm_tracks', 'src.d07_visualization.wind_history']
+
+# Imports module and prints which of the heavy libraries and tables were
+# loaded.
+SCRIPT = """
+import sys, json
+sys.path.insert(0, {root!r})
+import {module}
+from src.d02_intermediate import hurdat_cache as hc
+print(json.dumps(sorted(name for name in ['cartopy', 'matplotlib', 'matplotlib.pyplot', 'bs4', 'requests'] if name in sys.modules) + sorted(hc._LOADED)))
+"""
+
+
+def _import(module):
+    result = subprocess.run([sys.executable, "-c", SCRIPT.format(root = root_dir, module = module)],
+                            capture_output = True, text = True, check = True)
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize("module", MODULES)
+def bench_import(workspace, measure, module):
+    measure(_import, module, rounds = 5)
+
+
+@pytest.mark.parametrize("module", MODULES)
+def check_import(workspace, module):
+    assert _import(module) == []
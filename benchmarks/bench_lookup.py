@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Per-storm lookups in storm_tracks, for a single storm and for every storm
+# in a season (as the season summaries and wind histories do them).
+
+import pytest
+from src.d07_visualization import storm_tracks as trk
+
+
+LOOKUPS = {'track_lat': trk.track_lat, 'track_lon': trk.track_lon, 'winds': trk.winds}
+
+
+def _season(storms_df, year = 2015):
+    return storms_df['stormID'][storms_df['year'] == year].astype('str').tolist()
+
+def _lookup_all(lookup, stormIDs, positions_df):
+    return [lookup(stormID, positions_df) for stormID in stormIDs]
+
+
+@pytest.mark.parametrize("lookup", LOOKUPS)
+def bench_lookup_storm(pacific, measure, lookup):
+    positions_df, storms_df = pacific
+    measure(LOOKUPS[lookup], _season(storms_df)[0], positions_df)
+
+@pytest.mark.parametrize("lookup", LOOKUPS)
+def bench_lookup_season(pacific, measure, lookup):
+    positions_df, storms_df = pacific
+    measure(_lookup_all, LOOKUPS[lookup], _season(storms_df), positions_df)
+
+# Building the index of each storm's rows, which the first lookup on a new
+# DataFrame pays for.
+def bench_storm_index(pacific, measure):
+    positions_df, storms_df = pacific
+
+    def build():
+        trk._STORM_INDICES.pop(id(positions_df), None)
+        return trk.storm_index(positions_df)
+
+    measure(build)
+
+
+# Fixes off the synoptic hours keep their minutes: AGATHA's landfall fix at
+# 2230 on 29 May 2010.
+def check_query_times(pacific):
+    import pandas as pd
+    from src.d03_processing import track_index as tix
+
+    positions_df, storms_df = pacific
+    landfall = pd.Timestamp("2010-05-29 22:30")
+
+    for hits in [tix.point_query(14.4, -92.1, positions_df = positions_df),
+                 tix.box_query(14, 15, -93, -92, positions_df = positions_df)]:
+        times = hits['time'][hits['stormID'] == 'EP012010']
+        assert landfall in set(times)
+        assert (times.dt.minute.isin([0, 30])).all()
+
+
+# A track store answers the queries, and gives the same footprints and
+# frequency table, as the DataFrame it was built from.
+def check_store_queries(pacific):
+    import numpy as np
+    from src.d02_intermediate import track_store as tst
+    from src.d03_processing import frequency as fq
+    from src.d03_processing import swath_cache as swc
+    from src.d03_processing import track_index as tix
+
+    positions_df, storms_df = pacific
+    store = tst.track_store(positions_df)
+
+    assert np.array_equal(tst.missing(store), tst.missing(positions_df))
+
+    for query, args in [(tix.point_query, (14.4, -92.1)), (tix.box_query, (14, 15, -93, -92))]:
+        expected = query(*args, positions_df = positions_df)
+        result = query(*args, positions_df = store)
+        assert len(result) and result.astype(str).equals(expected.astype(str))
+
+    assert tix.track_index(store) is tix.track_index(store)
+
+    for hu_only in [False, True]:
+        assert np.array_equal(fq._swath_table(store, hu_only)[0], fq._swath_table(positions_df, hu_only)[0])
+    assert np.array_equal(swc.footprint_table(store), swc.footprint_table(positions_df))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Splitting raw HURDAT2 files into the positions and storms tables (including
+# writing the CSVs and the typed cache), and loading the tables back.
+
+import pytest
+from src.d02_intermediate import clean_hurdat as clh
+from src.d02_intermediate import hurdat_cache as hc
+from synthetic_hurdat import write_synthetic_hurdat
+
+
+def bench_partition_pacific(workspace, measure):
+    measure(clh.partition_hurdat, "Pacific.csv", rounds = 3)
+
+
+@pytest.fixture(params = [250, 1000, 4000], ids = lambda num_storms: f"{num_storms}storms")
+def synthetic_file(workspace, request):
+    fn = f"Synthetic{request.param}.csv"
+    write_synthetic_hurdat(workspace / "data" / "01_raw" / fn, request.param, seed = request.param)
+    return fn
+
+def bench_partition_synthetic(synthetic_file, measure):
+    measure(clh.partition_hurdat, synthetic_file, rounds = 3)
+
+
+# Loading the partitioned tables from the typed cache, leaving out the copy
+# kept in memory after the first load.
+def _load_uncached(table):
+    hc._LOADED.pop(table, None)
+    return hc.load_table(table)
+
+@pytest.mark.parametrize("table", ["Pacific_positions", "Pacific_storms"])
+def bench_load_table(pacific, measure, table):
+    measure(_load_uncached, table)
+
+
+# Updating the tables of a file from a new release of it (with storms added
+# to the end) gives the same tables as partitioning the new release afresh.
+def check_update_hurdat(workspace):
+    from src.d02_intermediate import update_hurdat as uph
+
+    raw_dir = workspace / "data" / "01_raw"
+    write_synthetic_hurdat(raw_dir / "Release.csv", 200, seed = 7)
+    clh.partition_hurdat("Release.csv")
+
+    write_synthetic_hurdat(raw_dir / "Release.csv", 230, seed = 7)
+    write_synthetic_hurdat(raw_dir / "Fresh.csv", 230, seed = 7)
+    clh.partition_hurdat("Fresh.csv")
+
+    update = uph.update_hurdat("Release.csv")
+
+    assert len(update.added) == 30 and not update.revised and not update.removed
+    for table in ["positions", "storms"]:
+        updated = hc.load_table(f"Release_{table}").astype(object)
+        fresh = hc.load_table(f"Fresh_{table}").astype(object)
+        assert updated.equals(fresh)
+
+
+# The cached columns, memory-mapped, hold the same values as the table
+# loaded from the cache.
+def check_load_columns(pacific):
+    import numpy as np
+
+    positions_df, storms_df = pacific
+    columns = hc.load_columns("Pacific_positions", mmap_mode = 'r')
+
+    assert isinstance(columns['lat'], np.memmap) and isinstance(columns['stormID.codes'], np.memmap)
+    assert np.array_equal(columns['lat'], positions_df['lat'].to_numpy())
+    assert np.array_equal(columns['extNE34'], positions_df['extNE34'].to_numpy())
+    assert (columns['stormID.categories'][columns['stormID.codes']] == positions_df['stormID'].astype('str').to_numpy()).all()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Drawing and exporting frequency heatmaps, one at a time and as a batch of
+# frames. Needs cartopy (and its Natural Earth coastlines).
+
+import pytest
+
+pytest.importorskip("cartopy")
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from src.d03_processing import frequency as fq
+from src.d07_visualization import wind_history as wh
+
+
+@pytest.fixture(scope = "module")
+def frequencies(pacific):
+    positions_df, storms_df = pacific
+    return [fq.wind_frequency(storms_df['stormID'][storms_df['year'] == year], positions_df = positions_df) for year in range(2010, 2015)]
+
+
+def _heatmap(freq_array):
+    wh.heatmap(freq_array, export = True, dest_fn = "bench_heatmap", subtitle = "Benchmark")
+    plt.close("all")
+
+def bench_heatmap(frequencies, measure):
+    measure(_heatmap, frequencies[0], rounds = 3)
+
+def bench_render_heatmaps(frequencies, measure):
+    dest_fns = [f"bench_frame{i}" for i in range(len(frequencies))]
+    measure(wh.render_heatmaps, frequencies, dest_fns, rounds = 3)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The tile and query service, started on a free port over the bundled
+# Pacific file: a tile, the point, box and frequency queries, and bad
+# requests.
+
+import json
+import asyncio
+import urllib.request
+import urllib.error
+
+from src.d03_processing import frequency as fq
+from src.d03_processing import track_index as tix
+from src.d07_visualization import tile_server as tls
+
+
+# Status and body of a GET of path from the server on port.
+def _get(port, path):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout = 120) as r:
+            return r.status, r.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read()
+
+
+# Start the service, make the requests in paths (from a thread, as a client
+# would) and stop it again. Returns the status and body of each request.
+def _serve(paths):
+
+    async def main():
+        server, state = await tls.start(port = 0, workers = 1)
+        port = server.sockets[0].getsockname()[1]
+        loop = asyncio.get_running_loop()
+        try:
+            async with server:
+                return [await loop.run_in_executor(None, _get, port, path) for path in paths]
+        finally:
+            tls.close_service(state)
+
+    return asyncio.run(main())
+
+
+def check_tile_server(pacific):
+    positions_df, storms_df = pacific
+
+    responses = _serve(["/tiles/2/0/1.png?basin=Pacific&first=2004",
+                        "/frequency?lat=15&lon=-105&basin=Pacific",
+                        "/point?lat=20&lon=-110&buffer=50&basin=Pacific&first=2015&last=2015",
+                        "/box?lat_min=10&lat_max=20&lon_min=-120&lon_max=-100&basin=Pacific&first=2015&last=2015&hu_only=1",
+                        "/point?lat=north&lon=-110",
+                        "/box?lat_min=10&lat_max=20&lon_min=-120&lon_max=-100&basin=Indian",
+                        "/tiles/2/9/0.png"])
+
+    # The tile and the frequency are drawn from the same grid wind_frequency
+    # gives for those storms.
+    freq_array = fq.wind_frequency(storms_df['stormID'][storms_df['year'] >= 2004], positions_df = positions_df)
+    assert responses[0] == (200, tls.render_tile(freq_array, freq_array.max(), 2, 0, 1))
+    assert json.loads(responses[1][1])['frequency'] == freq_array[90 + 15, 180 - 105]
+
+    # The queries find the storms of that season that track_index does.
+    years = dict(zip(storms_df['stormID'].astype('str'), storms_df['year']))
+
+    hits = tix.point_query(20, -110, 50, positions_df = positions_df)
+    expected = {stormID for stormID in hits['stormID'] if years[stormID] == 2015}
+    point = json.loads(responses[2][1])
+    assert responses[2][0] == 200 and expected
+    assert {storm['stormID'] for storm in point['storms']} == expected
+
+    hits = tix.box_query(10, 20, -120, -100, positions_df = positions_df)
+    expected = {stormID for stormID, category in zip(hits['stormID'], hits['category']) if years[stormID] == 2015 and category == 'HU'}
+    box = json.loads(responses[3][1])
+    assert responses[3][0] == 200 and expected
+    assert {storm['stormID'] for storm in box['storms']} == expected
+    assert all(storm['category'] == 'HU' for storm in box['storms'])
+
+    # Bad values, basins and tiles are turned away.
+    assert [status for status, body in responses[4:]] == [400, 400, 400]
+    assert "lat" in json.loads(responses[4][1])['error']
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Shared setup for the pytest-benchmark suite in this directory. Run it from
+# here with, e.g.
+#   python -m pytest --benchmark-autosave
+# and compare a later run against the saved baseline with
+#   python -m pytest --benchmark-compare --benchmark-compare-fail=mean:10%
+
+# The modules read and write ../data relative to the working directory, so
+# every benchmark runs in a scratch copy of the project layout (data/01_raw,
+# data/02_intermediate, data/03_processed, results/images and a notebooks
+# directory to run from) rather than touching the repository's data. The
+# bundled data/01_raw/Pacific.csv is copied in and a synthetic HURDAT2 file
+# (see synthetic_hurdat) is generated alongside it.
+
+# Besides the timings, each benchmark records the peak memory allocated by
+# one call of the code being timed (measured with tracemalloc, which numpy
+# reports its arrays to) as peak_memory_mb in the benchmark's extra_info.
+
+import os, sys
+import shutil
+import tracemalloc
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.join(bench_dir, '..')
+sys.path.insert(0, root_dir)
+sys.path.insert(0, bench_dir)
+
+import pytest
+from synthetic_hurdat import write_synthetic_hurdat
+
+
+# Storms in the synthetic dataset, which the frequency benchmarks take
+# subsets of.
+SYNTHETIC_STORMS = 1000
+
+
+@pytest.fixture(scope = "session")
+def workspace(tmp_path_factory):
+
+    base = tmp_path_factory.mktemp("workspace")
+    for directory in ["data/01_raw", "data/02_intermediate", "data/03_processed", "results/images", "notebooks"]:
+        os.makedirs(base / directory)
+
+    shutil.copy(os.path.join(root_dir, "data", "01_raw", "Pacific.csv"), base / "data" / "01_raw" / "Pacific.csv")
+    write_synthetic_hurdat(base / "data" / "01_raw" / "Synthetic.csv", SYNTHETIC_STORMS)
+
+    cwd = os.getcwd()
+    os.chdir(base / "notebooks")
+    yield base
+    os.chdir(cwd)
+
+
+# Partitioned tables (positions, storms) of the bundled Pacific file and of
+# the synthetic file.
+def _partitioned(basin):
+    from src.d02_intermediate import clean_hurdat as clh
+    from src.d02_intermediate import hurdat_cache as hc
+
+    clh.partition_hurdat(f"{basin}.csv")
+    return hc.load_positions(basin), hc.load_storms(basin)
+
+@pytest.fixture(scope = "session")
+def pacific(workspace):
+    return _partitioned("Pacific")
+
+@pytest.fixture(scope = "session")
+def synthetic(workspace):
+    return _partitioned("Synthetic")
+
+
+# Peak memory of each benchmark run in this session, by name.
+PEAKS = {}
+
+# Peak memory (in MB) allocated during one call of function.
+def peak_memory(function, *args, **kwargs):
+
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return peak / 2**20
+
+
+# measure(function, *args, **kwargs) records the peak memory of one call and
+# then times function with pytest-benchmark. Slow code (like rendering) can
+# be given a fixed number of rounds instead of pytest-benchmark's
+# calibration.
+@pytest.fixture
+def measure(benchmark, request):
+
+    def run(function, *args, rounds = None, **kwargs):
+        peak = round(peak_memory(function, *args, **kwargs), 2)
+        benchmark.extra_info['peak_memory_mb'] = peak
+        PEAKS[request.node.name] = peak
+        if rounds is not None:
+            return benchmark.pedantic(function, args = args, kwargs = kwargs, rounds = rounds, iterations = 1)
+        return benchmark(function, *args, **kwargs)
+
+    return run
+
+
+# List the peak memory of each benchmark after pytest-benchmark's timings.
+def pytest_terminal_summary(terminalreporter):
+    if not PEAKS:
+        return
+
+    width = max(len(name) for name in PEAKS)
+    terminalreporter.section("peak memory (MB)")
+    for name in sorted(PEAKS):
+        terminalreporter.write_line(f"{name:<{width}} {PEAKS[name]:>10.2f}")
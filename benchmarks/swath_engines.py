@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Compare the two swath engines used by frequency.wind_frequency: the
+# original 'columns' engine (swath), which samples the 6-hourly fixes along
+# 31 bearings per quadrant, and the 'interpolated' engine (swath_interp),
+# which fills the area swept out between fixes.
+
+# For each grid resolution this reports how long each engine takes and how
+# well each covers the winds, measured against a reference made by filling
+# the wind polygons at many points in time between every pair of fixes
+# (every 15 minutes by default). "missed" is the share of the reference's
+# cells an engine leaves out and "extra" the share of an engine's cells that
+# the reference doesn't have; the agreement between the two engines is given
+# as the intersection over union of their cells.
+
+# Run from this directory (so that ../data is the data directory), e.g.
+#   python swath_engines.py --min-year 2015 --resolutions 1 0.5 0.25 0.1
+
+import os, sys
+import time
+import argparse
+
+root_dir = os.path.join(os.getcwd(), '..')
+sys.path.append(root_dir)
+
+import numpy as np
+from src.d02_intermediate import hurdat_cache as hc
+from src.d03_processing import frequency as fq
+from src.d03_processing import grids as grd
+from src.d03_processing import swath as sw
+from src.d03_processing import swath_interp as swi
+from src.d07_visualization import storm_tracks as trk
+
+
+# Cells (flat indices into grid) covered by each storm, as a set of
+# (storm, cell) pairs packed into one integer each.
+def _storm_cell_pairs(cells, owner, grid):
+    return np.unique(owner.astype(np.int64) * grid.size + cells)
+
+
+# Rasterize with one of the engines, returning the (storm, cell) pairs.
+def engine_cells(table, storm_rows, grid, engine):
+
+    pieces = [table[rows] for rows in storm_rows]
+    positions = np.concatenate(pieces)
+    owner = np.repeat(np.arange(len(pieces)), [len(piece) for piece in pieces])
+    draw = positions[:, 6] == 1
+
+    if engine == 'interpolated':
+        rows, cols, position = swi.swath_cells(positions[:, 0], positions[:, 1], positions[:, 2:6], draw, owner, grid)
+    else:
+        positions, owner = positions[draw], owner[draw]
+        rows, cols, position = sw.swath_cells(positions[:, 0], positions[:, 1], positions[:, 2:6], grid)
+
+    return _storm_cell_pairs(sw.flat_cells(rows, cols, grid), owner[position], grid)
+
+
+# Reference coverage: the wind polygons filled at steps + 1 evenly spaced
+# times from each drawn fix to the next drawn fix of the same storm, plus
+# every drawn fix on its own (which covers fixes with no drawn neighbour).
+def reference_cells(table, storm_rows, grid, steps = 24):
+
+    pieces = [table[rows] for rows in storm_rows]
+    positions = np.concatenate(pieces)
+    owner = np.repeat(np.arange(len(pieces)), [len(piece) for piece in pieces])
+    draw = positions[:, 6] == 1
+
+    lats, lons, extents = positions[:, 0], positions[:, 1], positions[:, 2:6]
+    starts = np.flatnonzero(draw[:-1] & draw[1:] & (owner[:-1] == owner[1:]))
+
+    # Interpolated positions, with the second fix's longitude unwrapped to
+    # be within 180 degrees of the first.
+    t = np.linspace(0, 1, steps + 1)[None, :]
+    next_lons = lons[starts] + ((lons[starts + 1] - lons[starts] + 180) % 360 - 180)
+    sample_lats = (lats[starts, None] * (1 - t) + lats[starts + 1, None] * t).ravel()
+    sample_lons = (lons[starts, None] * (1 - t) + next_lons[:, None] * t).ravel()
+    sample_ext = (extents[starts, None, :] * (1 - t[..., None]) + extents[starts + 1, None, :] * t[..., None]).reshape(-1, 4)
+    sample_owner = np.repeat(owner[starts], steps + 1)
+
+    alone = np.flatnonzero(draw)
+    sample_lats = np.r_[sample_lats, lats[alone]]
+    sample_lons = np.r_[sample_lons, lons[alone]]
+    sample_ext = np.r_[sample_ext, extents[alone]]
+    sample_owner = np.r_[sample_owner, owner[alone]]
+
+    pairs = []
+    # Go a block of samples at a time to keep the memory use down.
+    for block in range(0, len(sample_lats), 20000):
+        part = slice(block, block + 20000)
+        ys, xs = swi.wind_polygons(sample_lats[part], sample_lons[part], sample_ext[part])
+        shape = np.repeat(np.arange(len(ys)), ys.shape[1])
+        rows, cols, filled = swi.fill_outlines(*[edges.ravel() for edges in swi._polygon_edges(ys, xs)], shape, len(ys), grid)
+        rows, cols, filled = swi._on_grid(rows, cols, filled, grid)
+        pairs.append(_storm_cell_pairs(sw.flat_cells(rows, cols, grid), sample_owner[part][filled], grid))
+
+    return np.unique(np.concatenate(pairs))
+
+
+def _share(part, whole):
+    return len(part) / len(whole) if len(whole) else 0.0
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Compare the 'columns' and 'interpolated' swath engines.")
+    parser.add_argument("--basin", default = hc.DEFAULT_BASIN)
+    parser.add_argument("--min-year", type = int, default = 2004)
+    parser.add_argument("--resolutions", type = float, nargs = "+", default = [1, 0.5, 0.25, 0.1])
+    parser.add_argument("--region", type = float, nargs = 4, metavar = ("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"),
+                        help = "bounds of the grid (default: around every storm drawn)")
+    parser.add_argument("--steps", type = int, default = 24, help = "time steps between fixes for the reference")
+    parser.add_argument("--repeat", type = int, default = 3, help = "timing runs per engine (the best is reported)")
+    args = parser.parse_args()
+
+    positions_df = hc.load_positions(args.basin)
+    storms_df = hc.load_storms(args.basin)
+    stormlist = storms_df['stormID'][storms_df['year'] >= args.min_year].astype('str')
+
+    table, value = fq._swath_table(positions_df)
+    storm_rows = [trk.storm_rows(storm, positions_df) for storm in stormlist]
+
+    if args.region:
+        bounds = args.region
+    else:
+        drawn = np.concatenate([table[rows] for rows in storm_rows])
+        drawn = drawn[drawn[:, 6] == 1]
+        bounds = [max(-90, np.floor(drawn[:, 0].min()) - 10), min(90, np.ceil(drawn[:, 0].max()) + 10),
+                  np.floor(drawn[:, 1].min()) - 10, np.ceil(drawn[:, 1].max()) + 10]
+        if bounds[3] - bounds[2] >= 360:
+            bounds[2:] = [-180, 180]
+        bounds = [float(bound) for bound in bounds]
+
+    print(f"{len(stormlist)} storms from {args.basin} since {args.min_year}, region {bounds}\n")
+    print(f"{'resolution':>10} {'engine':>13} {'seconds':>8} {'cells':>10} {'missed':>7} {'extra':>7}")
+
+    for resolution in args.resolutions:
+        grid = grd.regional(*bounds, resolution = resolution)
+        reference = reference_cells(table, storm_rows, grid, args.steps)
+
+        found = {}
+        for engine in ['columns', 'interpolated']:
+            times = []
+            for i in range(args.repeat):
+                start = time.perf_counter()
+                fq.wind_frequency(stormlist, positions_df = positions_df, grid = grid, sparse = True, engine = engine)
+                times.append(time.perf_counter() - start)
+
+            found[engine] = engine_cells(table, storm_rows, grid, engine)
+            missed = _share(np.setdiff1d(reference, found[engine]), reference)
+            extra = _share(np.setdiff1d(found[engine], reference), found[engine])
+
+            print(f"{resolution:>10g} {engine:>13} {min(times):>8.3f} {len(found[engine]):>10} {missed:>7.1%} {extra:>7.1%}")
+
+        both = np.intersect1d(found['columns'], found['interpolated'])
+        either = np.union1d(found['columns'], found['interpolated'])
+        print(f"{'':>10} {'agreement':>13} {_share(both, either):>8.1%}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Synthetic HURDAT2 files for the benchmarks, so that the partitioning and
+# frequency code can be timed on datasets of any size. Each storm is a random
+# walk heading west and curving north, with a status and wind extents that
+# grow and decay over its life. Fixes before the storm reaches tropical
+# storm strength (and now and then one in the middle) have -999 extents,
+# like the real files, so the rasterizer's skipping is exercised too.
+
+import numpy as np
+
+
+EXTENT_FIELDS = 12
+
+
+def _latitude(lat):
+    return f"{abs(lat):.1f}{'N' if lat >= 0 else 'S'}"
+
+def _longitude(lon):
+    return f"{abs(lon):.1f}{'E' if lon >= 0 else 'W'}"
+
+
+# Lines of one storm: its header row followed by its fixes.
+def _storm_lines(stormID, name, num_fixes, year, rng):
+
+    lines = [f"{stormID}, {name:>18}, {num_fixes:>6},,,,,,,,,,,,,,,,,"]
+
+    lat = rng.uniform(8, 20)
+    lon = rng.uniform(-100, -20)
+    heading = rng.uniform(-10, 10)
+    day = np.datetime64(f"{year}-06-01") + rng.integers(0, 150)
+
+    # Intensity rises to a peak partway through the storm's life and falls
+    # off again.
+    peak = rng.uniform(40, 150)
+    life = np.sin(np.linspace(0.2, np.pi - 0.2, num_fixes))
+
+    for i in range(num_fixes):
+        wind = 20 + peak * life[i]
+        status = "HU" if wind >= 64 else "TS" if wind >= 34 else "TD"
+
+        if status == "TD" or rng.random() < 0.05:
+            extents = [-999.0] * EXTENT_FIELDS
+        else:
+            ts = rng.uniform(40, 200, 4) * life[i]
+            ts50 = ts * 0.5 if wind >= 50 else np.zeros(4)
+            hu = ts * 0.3 if status == "HU" else np.zeros(4)
+            extents = [round(float(extent)) for extent in np.r_[ts, ts50, hu]]
+
+        date = (day + (i * 6) // 24).astype(object).strftime("%Y%m%d")
+        time = f"{(i * 6) % 24:02d}00"
+        fields = [date, f" {time}", "  ", f" {status}", f" {_latitude(lat)}", f" {_longitude(lon)}",
+                  f"{wind:.1f}", f"{1010 - wind * 0.8:.1f}"] + [f"{extent:.1f}" for extent in extents]
+        lines.append(",".join(fields))
+
+        # Drift west and gradually turn north.
+        heading += rng.normal(2, 3)
+        lat += 0.3 + 0.6 * np.sin(np.radians(heading)) + rng.normal(0, 0.1)
+        lon -= 0.8 * np.cos(np.radians(heading)) + rng.normal(0, 0.1)
+        lat = min(lat, 70)
+
+    return lines
+
+
+# Write a HURDAT2 file of num_storms storms (with 10 to 2 * mean_fixes
+# fixes each) to path, spread over seasons from first_year at
+# storms_per_year a season. Returns the number of fixes written.
+def write_synthetic_hurdat(path, num_storms, mean_fixes = 30, basin = "AL", first_year = 2004, storms_per_year = 30, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    lines = []
+    fixes = 0
+
+    for i in range(num_storms):
+        year = first_year + i // storms_per_year
+        number = i % storms_per_year + 1
+        num_fixes = int(rng.integers(10, 2 * mean_fixes))
+
+        lines.extend(_storm_lines(f"{basin}{number:02d}{year}", f"STORM{i}", num_fixes, year, rng))
+        fixes += num_fixes
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    return fixes
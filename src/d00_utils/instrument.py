@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import instrument as ins
+
+# Purpose of module: opt-in timing of the stages of the processing pipeline
+# (loading, splitting, lookups, rasterizing, plotting...), so a slow run can
+# be pinned on a stage.
+
+# Code being measured marks the end of each stage with a lap:
+#
+#     lap = ins.laps("partition")
+#     ...read the file...
+#     lap("read_csv", rows = len(hurdat))
+#     ...split it...
+#     lap("split_headers")
+#
+# Each lap reports one event: a dictionary with the stage name
+# ("partition.read_csv"), the seconds since the previous lap (or since laps
+# was called), any counters passed in, and the process's memory high-water
+# mark. With enable(memory = True) the peak memory traced by tracemalloc
+# during the stage is reported too (a stage's peak leaves out any stages
+# lapped inside it). Measuring it means resetting tracemalloc's peak, so
+# this is left out if something else had already started tracemalloc.
+# Events go to every callback registered with enable, and to a JSON lines
+# log if one is given.
+
+# While nothing is enabled, laps hands back a function that does nothing,
+# so the cost of instrumented code is one extra call per stage. Counters
+# that take work to compute should be computed under `if ins.ENABLED:`.
+
+import os, sys
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Whether any callback is listening.
+ENABLED = False
+
+# The callbacks events are sent to.
+_CALLBACKS = []
+
+# Whether peak memory is traced for each stage, which is only done if enable
+# started tracemalloc itself.
+_TRACE_MEMORY = False
+
+
+def _no_lap(name, **counters):
+    return
+
+
+# The process's memory high-water mark so far, in MB (ru_maxrss is in
+# kilobytes on Linux and bytes on macOS).
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+# A function to call at the end of each stage of prefix (see above).
+def laps(prefix):
+    if not ENABLED:
+        return _no_lap
+
+    start = [time.perf_counter()]
+    if _TRACE_MEMORY:
+        tracemalloc.reset_peak()
+
+    def lap(name, **counters):
+        now = time.perf_counter()
+
+        event = {'stage': f"{prefix}.{name}", 'seconds': now - start[0], 'counters': counters, 'max_rss_mb': _max_rss_mb()}
+        if _TRACE_MEMORY and tracemalloc.is_tracing():
+            event['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.reset_peak()
+
+        emit(event)
+        start[0] = time.perf_counter()
+
+    return lap
+
+
+# Send an event to every callback.
+def emit(event):
+    for callback in _CALLBACKS:
+        callback(event)
+
+
+# A callback appending each event to log_path as a line of JSON.
+def json_log(log_path):
+
+    directory = os.path.dirname(log_path)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+
+    def write(event):
+        with open(log_path, "a") as f:
+            f.write(json.dumps(dict(event, time = time.time())) + "\n")
+
+    return write
+
+
+# Start sending events to callback and/or the JSON lines file log_path.
+# With memory = True, tracemalloc is started to measure the peak memory of
+# each stage (which slows down code that allocates a lot), unless it's
+# already running.
+def enable(callback = None, log_path = None, memory = False):
+    global ENABLED, _TRACE_MEMORY
+
+    if callback is not None:
+        _CALLBACKS.append(callback)
+    if log_path is not None:
+        _CALLBACKS.append(json_log(log_path))
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _TRACE_MEMORY = True
+
+    ENABLED = len(_CALLBACKS) > 0
+
+
+# Stop sending events (to every callback), and stop tracemalloc if enable
+# started it.
+def disable():
+    global ENABLED, _TRACE_MEMORY
+
+    _CALLBACKS.clear()
+    if _TRACE_MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _TRACE_MEMORY = False
+    ENABLED = False
+
+
+# Collect the events of a block of code into a list, e.g.
+#
+#     with ins.recording() as events:
+#         fq.wind_frequency()
+#     ins.summary(events)
+@contextmanager
+def recording(log_path = None, memory = False):
+
+    events = []
+    enable(events.append, log_path = log_path, memory = memory)
+    try:
+        yield events
+    finally:
+        disable()
+
+
+# Total seconds, number of laps and summed counters of each stage in events,
+# as a DataFrame ordered by the time spent, along with the largest memory
+# figures seen for the stage.
+def summary(events):
+    import pandas as pd
+
+    rows = []
+    for event in events:
+        row = {'stage': event['stage'], 'seconds': event['seconds'], 'laps': 1, 'max_rss_mb': event.get('max_rss_mb')}
+        if 'peak_mb' in event:
+            row['peak_mb'] = event['peak_mb']
+        row.update(event['counters'])
+        rows.append(row)
+
+    if not rows:
+        return pd.DataFrame(columns = ['seconds', 'laps'])
+
+    df = pd.DataFrame(rows)
+    maxima = [column for column in ['max_rss_mb', 'peak_mb'] if column in df.columns]
+    totals = df.drop(columns = maxima).groupby('stage', sort = False).sum(min_count = 1)
+    totals[maxima] = df.groupby('stage', sort = False)[maxima].max()
+
+    return totals.sort_values('seconds', ascending = False)
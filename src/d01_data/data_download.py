@@ -8,56 +8,233 @@
 # import data_download as ddln
 
 import os
+import json
+import hashlib
+from functools import lru_cache
+from urllib.parse import urljoin
+
 import pandas as pd
 
 import requests
 from bs4 import BeautifulSoup
 
 
-# function to download atlantic hurdat data
-def download_atlantic_hurdat_raw(dest_filename = "Atlantic"):
-    
-    URL = "https://www.nhc.noaa.gov/data/"
-    r = requests.get(URL)
+# Page on the NHC site linking to the current HURDAT2 files.
+INDEX_URL = "https://www.nhc.noaa.gov/data/"
 
-    soup = BeautifulSoup(r.content, 'html5lib')
+# Text of the entry on the index page for each basin's HURDAT2 file.
+HURDAT_LABELS = {'Atlantic': "Atlantic hurricane database (HURDAT2)",
+                 'Pacific': "Northeast and North Central Pacific hurricane database (HURDAT2)"}
 
-    for element in soup.find_all('span'):
-        if "Atlantic hurricane database (HURDAT2)" in element.text:
-            target = element
-    
-    source = ("https://www.nhc.noaa.gov") + (target.next_sibling.next_sibling.attrs['href'])
+# Size of the pieces the download is written to disk in.
+CHUNK_SIZE = 1 << 16
 
-    download_dataset = pd.read_csv(source, header = None, names = list(range(0, 20)))
 
-    download_dataset.to_csv(f"../data/01_raw/{dest_filename}.csv", 
-                            header = False, index = False)
+# One session shared by every download, so connections to the server are
+# pooled and reused between the index page and the data files.
+@lru_cache(maxsize = None)
+def session():
 
-    print(f"Downloaded data to /data/01_raw/{dest_filename}.csv")
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections = 4, pool_maxsize = 4, max_retries = 3)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
 
-    # Show the newly downloaded dataset
-    return download_dataset.head()
+    return s
 
-# function to download pacific hurdat data
-# default values download dataset current as of 2020.08.13
-def download_pacific_hurdat_raw(dest_filename = "Pacific"):
-    
-    URL = "https://www.nhc.noaa.gov/data/"
-    r = requests.get(URL)
+
+# What we know about the last download to dest_path: the URL, the ETag and
+# Last-Modified headers the server sent with it and checksums of the data
+# downloaded and of the file written. Kept next to the file as
+# {dest_path}.download.json.
+def _metadata_path(dest_path):
+    return dest_path + ".download.json"
+
+def _read_metadata(dest_path):
+
+    path = _metadata_path(dest_path)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+def _write_metadata(dest_path, metadata):
+    with open(_metadata_path(dest_path), "w") as f:
+        json.dump(metadata, f, indent = 1)
+
+def _file_sha256(path):
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Whether the file at dest_path is still the one written by the last download
+# (and hasn't been edited or removed since).
+def is_current(dest_path):
+
+    metadata = _read_metadata(dest_path)
+    if not os.path.exists(dest_path) or 'file_sha256' not in metadata:
+        return False
+
+    return _file_sha256(dest_path) == metadata['file_sha256']
+
+
+# Find the link to the HURDAT2 file labelled label on the NHC index page.
+def find_hurdat_url(label, index_url = INDEX_URL):
+
+    r = session().get(index_url, timeout = 30)
+    r.raise_for_status()
 
     soup = BeautifulSoup(r.content, 'html5lib')
 
+    target = None
     for element in soup.find_all('span'):
-        if "Northeast and North Central Pacific hurricane database (HURDAT2)" in element.text:
+        if label in element.text:
             target = element
-    
-    source = ("https://www.nhc.noaa.gov") + (target.next_sibling.next_sibling.attrs['href'])
 
-    download_dataset = pd.read_csv(source, header = None, names = list(range(0, 20)))
+    if target is None:
+        raise ValueError(f"No link to the {label} found on {index_url}")
+
+    return urljoin(index_url, target.next_sibling.next_sibling.attrs['href'])
+
+
+# Download url to dest_path, unless the copy there is already current.
+# The request is conditional on the ETag and Last-Modified of the previous
+# download, and the body is streamed to disk in chunks (checksumming it as it
+# goes) rather than read into memory. convert, if given, is called with the
+# path of the downloaded data and dest_path to write the final file;
+# otherwise the data is moved into place as is. after, if given, is called
+# with dest_path once the new file is in place, and the download is only
+# recorded once it returns, so if it fails the next call downloads the file
+# and runs it again. Returns True if dest_path was (re)written and False if
+# it was already current.
+def fetch(url, dest_path, convert = None, after = None):
+
+    metadata = _read_metadata(dest_path)
+
+    # Only ask the server whether the file has changed if we still have the
+    # file written last time; otherwise download it regardless.
+    headers = {}
+    if metadata.get('url') == url and is_current(dest_path):
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
 
-    download_dataset.to_csv(f"../data/01_raw/{dest_filename}.csv",
-                            header = False, index = False)
+    part_path = dest_path + ".part"
 
-    print(f"Downloaded data to /data/01_raw/{dest_filename}.csv")
+    # The partial download is removed however this ends, including when the
+    # connection drops partway through.
+    try:
+        with session().get(url, headers = headers, stream = True, timeout = 30) as r:
+            if r.status_code == 304:
+                return False
+            r.raise_for_status()
 
-    return download_dataset.head()
+            digest = hashlib.sha256()
+            with open(part_path, "wb") as part:
+                for chunk in r.iter_content(chunk_size = CHUNK_SIZE):
+                    digest.update(chunk)
+                    part.write(chunk)
+
+            new_metadata = {'url': url,
+                            'etag': r.headers.get('ETag'),
+                            'last_modified': r.headers.get('Last-Modified'),
+                            'sha256': digest.hexdigest()}
+
+        # Servers that don't support conditional requests send the whole file
+        # every time, so compare checksums before replacing anything.
+        if new_metadata['sha256'] == metadata.get('sha256') and is_current(dest_path):
+            _write_metadata(dest_path, {**metadata, **new_metadata})
+            return False
+
+        if convert is None:
+            os.replace(part_path, dest_path)
+        else:
+            convert(part_path, dest_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    if after is not None:
+        after(dest_path)
+
+    new_metadata['file_sha256'] = _file_sha256(dest_path)
+    _write_metadata(dest_path, new_metadata)
+
+    return True
+
+
+# The raw HURDAT2 files are padded out to 20 columns as a CSV, the layout
+# partition_hurdat expects.
+def _hurdat_to_csv(source_path, dest_path):
+
+    download_dataset = pd.read_csv(source_path, header = None, names = list(range(0, 20)))
+
+    download_dataset.to_csv(dest_path, header = False, index = False)
+
+
+# Whether the HURDAT file {dest_filename}.csv has been partitioned.
+def _partitioned(dest_filename):
+    from src.d02_intermediate import hurdat_cache as hc
+
+    return os.path.exists(hc.csv_path(f"{dest_filename}_positions")) or hc.cache_is_current(f"{dest_filename}_positions")
+
+
+# Download the HURDAT2 file for basin ("Atlantic" or "Pacific") to
+# /data/01_raw/{dest_filename}.csv if it has changed since the last download.
+# With partition = True the partitioned tables are then brought up to date
+# too: updated in place if they already exist (see update_hurdat), created
+# with partition_hurdat if not, and left alone if nothing was downloaded.
+# Returns the first rows of the dataset.
+def download_hurdat_raw(basin, dest_filename = None, index_url = INDEX_URL, partition = False):
+
+    if dest_filename is None:
+        dest_filename = basin
+
+    dest_path = f"../data/01_raw/{dest_filename}.csv"
+
+    # The tables are brought up to date before the download is recorded (see
+    # fetch), so a failed update is retried on the next call rather than the
+    # file being taken as up to date.
+    def refresh(path):
+        from src.d02_intermediate import clean_hurdat as clh
+        from src.d02_intermediate import update_hurdat as uph
+
+        if _partitioned(dest_filename):
+            uph.update_hurdat(f"{dest_filename}.csv")
+        else:
+            clh.partition_hurdat(f"{dest_filename}.csv")
+
+    changed = fetch(find_hurdat_url(HURDAT_LABELS[basin], index_url), dest_path, convert = _hurdat_to_csv, after = refresh if partition else None)
+
+    if changed:
+        print(f"Downloaded data to /data/01_raw/{dest_filename}.csv")
+    else:
+        print(f"/data/01_raw/{dest_filename}.csv is already up to date")
+
+    if partition and not changed and not _partitioned(dest_filename):
+        refresh(dest_path)
+
+    # Show the newly downloaded dataset
+    return pd.read_csv(dest_path, header = None, names = list(range(0, 20)), nrows = 5)
+
+# function to download atlantic hurdat data
+def download_atlantic_hurdat_raw(dest_filename = "Atlantic", index_url = INDEX_URL, partition = False):
+    return download_hurdat_raw("Atlantic", dest_filename, index_url = index_url, partition = partition)
+
+# function to download pacific hurdat data
+def download_pacific_hurdat_raw(dest_filename = "Pacific", index_url = INDEX_URL, partition = False):
+    return download_hurdat_raw("Pacific", dest_filename, index_url = index_url, partition = partition)
+
+# Download (and, with partition = True, partition) the HURDAT2 files of
+# several basins, sharing one session, so they can then be loaded together
+# with hurdat_cache.load_basins. Returns the first rows of each dataset by
+# basin.
+def download_basins(basins = tuple(HURDAT_LABELS), index_url = INDEX_URL, partition = False):
+    return {basin: download_hurdat_raw(basin, index_url = index_url, partition = partition) for basin in basins}
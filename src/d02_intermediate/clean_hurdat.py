@@ -15,7 +15,11 @@ Created on Thu Aug 13 18:59:47 2020
 def partition_hurdat(fn):
     
     import os
+    import numpy as np
     import pandas as pd
+    from src.d00_utils import instrument as ins
+    
+    lap = ins.laps("partition")
 
     # These steps will apply both to Atlantic and Pacific datasets, so when
     # we ultimately convert these steps into a function we'll allow the
@@ -34,27 +38,19 @@ def partition_hurdat(fn):
 
     # Import data from raw data folder using our column names.
     hurdat = pd.read_csv(f'../data/01_raw/{fn}', names = header)
+    lap("read_csv", rows = len(hurdat))
         
 
-    # We need to determine which rows go in which new DataFrame, so create
-    # a list that can be turned into a series and added as a new column.
-    header = []
-   
-    # If there are only numeric characters in the date column, this is
-    # a position row. Otherwise, flag the row as being a header row.
-    for entry in hurdat['date']:
-        if entry.isnumeric():
-            header.append(False)
-        else:
-            header.append(True)
-   
-    # Cast the list as a pandas series and add it as a column of DataFrame.
-    hurdat['header'] = pd.Series(header) 
+    # We need to determine which rows go in which new DataFrame. If there
+    # are only numeric characters in the date column, this is a position
+    # row. Otherwise, flag the row as being a header row.
+    hurdat['header'] = ~hurdat['date'].astype('str').str.isnumeric()
     
     # Create DataFrames of only header rows and only position data so we 
     # can prepare each appropriately.
-    storms = hurdat[hurdat['header'] == True].copy() # All header columns of atl copied into new dataframe storms.
-    positions = hurdat[hurdat['header'] == False].copy() # All data columns of atl copied into new dataframe positions.
+    storms = hurdat[hurdat['header']].copy() # All header columns of atl copied into new dataframe storms.
+    positions = hurdat[~hurdat['header']].copy() # All data columns of atl copied into new dataframe positions.
+    lap("split_headers", storms = len(storms), fixes = len(positions))
     
 
     # Storms DataFrame:
@@ -66,108 +62,88 @@ def partition_hurdat(fn):
     storms.reset_index(drop=True, inplace=True)
 
     # We're going to want storms to easily be subsettable by years, so we'll
-    # create a new numeric column for it and fill the entries by parsing 
-    # the entries of the stormID column.
-    stormYears = []
-    
-    # We can pull out the year easily since all the stormIDs share the same
-    # format. Note that this year corresponds to the storm season, but
-    # that it is possible under rare circumstances for storms to
+    # create a new numeric column for it by parsing the entries of the
+    # stormID column. We can pull out the year easily since all the stormIDs
+    # share the same format. Note that this year corresponds to the storm
+    # season, but that it is possible under rare circumstances for storms to
     # persist into the following year so the dates on position entries may
     # not always show the year presented here.
-    for stormID in storms['stormID']:
-        stormYears.append(stormID[4:9]) 
-        
-    # Assign new year column integer dtype.
-    storms['year'] = pd.Series(stormYears).astype('int') 
+    storms['year'] = storms['stormID'].str[4:9].astype('int') 
     # Reassign number of positions integer dtype.
     storms['numPositions'] = storms['numPositions'].astype('int')
     # Strip whitespace from name and stormID values.
     storms['name'] = storms['name'].astype('str').str.strip() 
     storms['stormID'] = storms['stormID'].astype('str').str.strip()
+    lap("storms")
 
 
     # Positions DataFrame:
     # Reset the index.
     positions.reset_index(drop=True, inplace=True)
     
-    # Create lists to be used as new series for latitude and longitude. 
-    numLat = [] 
-    numLon = []
+    # For latitudes of degrees North, strip the whitespace and N. For 
+    # latitudes of degrees South, strip the whitespace and S and make the
+    # value negative.
+    numLat = positions['lat'].str.strip(" NS").astype('float')
+    numLat = np.where(positions['lat'].str.contains('N', regex = False), numLat, -numLat)
     
-    for cardLat in positions['lat']:
-        if cardLat.find('N') != -1: 
-            # For latitudes of degrees North, strip the whitespace and N.
-            numLat.append(cardLat.strip(" N"))
-        else: 
-            # For latitudes of degrees South, strip the whitespace and S 
-            # and make the value negative.
-            numLat.append('-'+cardLat.strip(" S"))
-    
-    for cardLon in positions['lon']:
-        if cardLon.find('E') != -1: 
-            # For longitudes of degrees East, strip the whitespace and E.
-            numLon.append(cardLon.strip(" E"))
-        else: 
-            # For longitudes of degrees West, strip the whitespace and W 
-            # and make the value negative.
-            numLon.append('-'+cardLon.strip(" W"))
+    # Likewise for longitudes, which are negative for degrees West.
+    numLon = positions['lon'].str.strip(" EW").astype('float')
+    numLon = np.where(positions['lon'].str.contains('E', regex = False), numLon, -numLon)
      
     # Replace the existing longitude and latitude columns with the new ones.
-    positions['lat'] = pd.Series(numLat).astype('float')
-    positions['lon'] = pd.Series(numLon).astype('float')
+    positions['lat'] = numLat
+    positions['lon'] = numLon
     
     
     # Add storm names and stormIDs to positions DataFrame:
-    # Create a list to be used as the names column in this DataFrame
-    stormNames = [] 
-        
-    # For each storm in the storms DataFrame...
-    for i in range(len(storms)): 
-        # For the number of rows indicated, add the storm name to the list.
-        for j in range(storms['numPositions'][i]): 
-            stormNames.append(storms['name'][i])
-               
-    # And create the new column using the list.      
-    positions['name'] = pd.Series(stormNames)
-                
-    # Repeat the process for storm IDs
-    stormIDs = []
-                
-    for i in range(len(storms)):
-        for j in range(storms['numPositions'][i]):
-            stormIDs.append(storms['stormID'][i])
-              
-    positions['stormID'] = pd.Series(stormIDs)
+    # Each storm's header row is followed by numPositions position rows, so
+    # repeating each name and stormID that many times lines them up with the
+    # position rows.
+    positions['name'] = pd.Series(np.repeat(storms['name'].to_numpy(), storms['numPositions']))
+    positions['stormID'] = pd.Series(np.repeat(storms['stormID'].to_numpy(), storms['numPositions']))
 
     # Remove the unnecessary header indicator column.
     positions.drop(columns="header", inplace = True)
     
-    # Create a column in the storms dataset with the month formed
-    month_formed = []
-
+    # Create a column in the storms dataset with the month formed, taken
+    # from the first position of each storm.
     positions["date"] = pd.to_datetime(positions["date"], format = "%Y%m%d")
 
-    for stormID in storms["stormID"]:
-        
-        months = positions[positions["stormID"] == stormID]["date"].dt.month
-        monthslist = months.tolist()
-        month_formed.append(monthslist[0])
-
-    storms["month_formed"] = pd.Series(month_formed)
+    first_dates = positions.groupby("stormID", sort = False)["date"].first()
+    storms["month_formed"] = storms["stormID"].map(first_dates.dt.month)
+    lap("positions")
     
 
     # Export to files and notify the user:
     # We'll use the filename we stored after removing the extension earlier
     # to create the child files in the new directory.
+    positions_fn, storms_fn = write_partition(positions, storms, fn_no_ext)
+    lap("write")
+
+    # Verify for the user which files were created.
+    print(f"Partitioned {fn} into:\n /data/02_intermediate/{positions_fn}\n /data/02_intermediate/{storms_fn}")
+    
+    return
+
+
+# Write partitioned positions and storms DataFrames to
+# {fn_no_ext}_positions.csv and {fn_no_ext}_storms.csv in the intermediate
+# data directory, along with their typed binary caches. Returns the names of
+# the two CSV files.
+def write_partition(positions, storms, fn_no_ext):
+
+    from src.d02_intermediate import hurdat_cache as hc
+
     positions_fn = ( fn_no_ext + "_positions.csv" )
     positions.to_csv(f"../data/02_intermediate/{positions_fn}", index = False)
 
     storms_fn = ( fn_no_ext + "_storms.csv" )
     storms.to_csv(f"../data/02_intermediate/{storms_fn}", index = False)
 
-    # Verify for the user which files were created.
-    print(f"Partitioned {fn} into:\n /data/02_intermediate/{positions_fn}\n /data/02_intermediate/{storms_fn}")
-    
-    return
+    # Also write the typed binary cache, which the modules load in place of
+    # the CSVs when it's up to date.
+    hc.write_cache(positions, fn_no_ext + "_positions")
+    hc.write_cache(storms, fn_no_ext + "_storms")
 
+    return positions_fn, storms_fn
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import hurdat_cache as hc
+
+# Purpose of module: to keep a typed, binary copy of the partitioned positions
+# and storms tables next to the CSVs, to load the tables from whichever is
+# current, and to merge the tables of several basins into one.
+
+# Each table is cached as a directory of .npy files, one per column, e.g.
+# /data/02_intermediate/Atlantic_positions/lat.npy. Categorical columns
+# (status, stormID, name) are stored as integer codes plus their categories,
+# wind extents and intensities as float32 and dates as datetime64. Loading a
+# column is then just reading (or memory-mapping) an array, with no parsing
+# or dtype inference.
+
+import os
+import numpy as np
+import pandas as pd
+
+
+INTERMEDIATE_DIR = '../data/02_intermediate'
+
+# Columns stored as categoricals.
+CATEGORICAL_COLUMNS = ['status', 'stormID', 'name', 'basin']
+
+# Columns stored as float32. Latitude and longitude stay float64 so that the
+# rasterized wind extents land in exactly the same cells.
+FLOAT32_COLUMNS = ['maxSustWind', 'minPressure', 'extNE34', 'extSE34', 'extSW34', 'extNW34', 'extNE50', 'extSE50', 'extSW50', 'extNW50', 'extNE64', 'extSE64', 'extSW64', 'extNW64']
+
+# Columns kept as the padded strings they are in the raw file.
+STRING_COLUMNS = ['time', 'recordID']
+
+# Basin whose tables are used when a function isn't given a DataFrame. This
+# can also be a list of basins, to work with all of them merged together.
+DEFAULT_BASIN = 'Atlantic'
+
+# Basins with partitioned HURDAT files, and the basin each prefix of a
+# stormID belongs to (the Pacific file has both Eastern and Central Pacific
+# storms).
+BASINS = ['Atlantic', 'Pacific']
+BASIN_PREFIXES = {'AL': 'Atlantic', 'EP': 'Pacific', 'CP': 'Pacific'}
+
+# Tables already loaded in this process, keyed by file name, along with the
+# modification time of the file they were loaded from.
+_LOADED = {}
+
+# Merged tables already built in this process, keyed by the tuple of basins,
+# along with the tables they were built from.
+_MERGED = {}
+
+
+# Path of the CSV file and the cache directory for table (e.g.
+# "Atlantic_positions").
+def csv_path(table):
+    return os.path.join(INTERMEDIATE_DIR, f"{table}.csv")
+
+def cache_path(table):
+    return os.path.join(INTERMEDIATE_DIR, table)
+
+
+# Give a positions or storms table the dtypes used in the cache.
+def typed(df):
+
+    df = df.copy()
+
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype('str').astype('category')
+        elif column in FLOAT32_COLUMNS:
+            df[column] = df[column].astype('float32')
+        elif column in STRING_COLUMNS:
+            df[column] = df[column].astype('str')
+        elif column == 'date':
+            df[column] = pd.to_datetime(df[column])
+
+    return df
+
+
+# Write df (a positions or storms table) to the cache directory for table.
+def write_cache(df, table):
+
+    path = cache_path(table)
+    os.makedirs(path, exist_ok = True)
+
+    df = typed(df)
+
+    for column in df.columns:
+        values = df[column]
+
+        if column in CATEGORICAL_COLUMNS:
+            np.save(os.path.join(path, f"{column}.codes.npy"), values.cat.codes.to_numpy())
+            np.save(os.path.join(path, f"{column}.categories.npy"), values.cat.categories.to_numpy().astype('str'))
+        elif values.dtype == object:
+            np.save(os.path.join(path, f"{column}.npy"), values.to_numpy().astype('str'))
+        else:
+            np.save(os.path.join(path, f"{column}.npy"), values.to_numpy())
+
+    # The column list is written last, so its modification time marks when
+    # the cache was completed.
+    np.save(os.path.join(path, "columns.npy"), np.array(df.columns, dtype = 'str'))
+
+
+# Modification time of the cache for table, or None if it doesn't exist.
+def _cache_mtime(table):
+
+    marker = os.path.join(cache_path(table), "columns.npy")
+    if os.path.exists(marker):
+        return os.path.getmtime(marker)
+    return None
+
+# Whether the cache for table exists and is at least as new as its CSV.
+def cache_is_current(table):
+
+    cached = _cache_mtime(table)
+    if cached is None:
+        return False
+    if not os.path.exists(csv_path(table)):
+        return True
+    return cached >= os.path.getmtime(csv_path(table))
+
+
+# Load the columns of the cache for table as a dictionary of numpy arrays.
+# With mmap_mode = 'r' the arrays are memory-mapped rather than read, so a
+# few columns of a large table can be used without reading the rest.
+# Categorical columns are returned as codes under "{column}.codes" with
+# their categories under "{column}.categories".
+def load_columns(table, mmap_mode = None):
+
+    path = cache_path(table)
+    columns = {}
+
+    for column in np.load(os.path.join(path, "columns.npy")).tolist():
+        if column in CATEGORICAL_COLUMNS:
+            columns[f"{column}.codes"] = np.load(os.path.join(path, f"{column}.codes.npy"), mmap_mode = mmap_mode)
+            columns[f"{column}.categories"] = np.load(os.path.join(path, f"{column}.categories.npy"))
+        else:
+            columns[column] = np.load(os.path.join(path, f"{column}.npy"), mmap_mode = mmap_mode)
+
+    return columns
+
+
+# Rebuild a DataFrame from the cache for table.
+def read_cache(table):
+
+    columns = load_columns(table)
+    df = {}
+
+    for column in np.load(os.path.join(cache_path(table), "columns.npy")).tolist():
+        if column in CATEGORICAL_COLUMNS:
+            df[column] = pd.Categorical.from_codes(columns[f"{column}.codes"], columns[f"{column}.categories"].astype(object))
+        elif column in STRING_COLUMNS:
+            df[column] = columns[column].astype(object)
+        else:
+            df[column] = columns[column]
+
+    return pd.DataFrame(df)
+
+
+# Load table, from the cache if it is current and from the CSV otherwise.
+# Either way the columns have the cached dtypes. Tables are only loaded once
+# per process (unless the file they came from changes), so every module
+# asking for the same table gets the same DataFrame.
+def load_table(table):
+
+    if cache_is_current(table):
+        source, mtime = "cache", _cache_mtime(table)
+    else:
+        source, mtime = "csv", os.path.getmtime(csv_path(table))
+
+    if table in _LOADED and _LOADED[table][:2] == (source, mtime):
+        return _LOADED[table][2]
+
+    if source == "cache":
+        df = read_cache(table)
+    else:
+        df = typed(pd.read_csv(csv_path(table), dtype = {column: 'str' for column in STRING_COLUMNS}))
+
+    _LOADED[table] = (source, mtime, df)
+
+    return df
+
+
+# Load the positions and storms tables for a partitioned HURDAT file, e.g.
+# load_positions("Atlantic").
+def load_positions(basin):
+    return load_table(f"{basin}_positions")
+
+def load_storms(basin):
+    return load_table(f"{basin}_storms")
+
+
+# Stack the tables of several basins into one, with a basin column saying
+# which basin each row came from. stormIDs are already unique across basins
+# (they start with AL, EP or CP), so the merged tables work anywhere a single
+# basin's tables do. Categorical columns keep the union of their categories.
+def _merge(tables, basins):
+
+    merged = {}
+    for column in tables[0].columns:
+        if column in CATEGORICAL_COLUMNS:
+            merged[column] = pd.api.types.union_categoricals([table[column] for table in tables])
+        else:
+            merged[column] = np.concatenate([table[column].to_numpy() for table in tables])
+
+    lengths = [len(table) for table in tables]
+    merged['basin'] = pd.Categorical.from_codes(np.repeat(np.arange(len(basins)), lengths), list(basins))
+
+    return pd.DataFrame(merged)
+
+
+# Load the positions and storms tables of several basins, merged (see
+# _merge). Like single tables, merged tables are only built once per process
+# unless one of the files they come from changes.
+def load_basins(basins = BASINS):
+
+    basins = tuple(basins)
+    positions_tables = [load_positions(basin) for basin in basins]
+    storms_tables = [load_storms(basin) for basin in basins]
+    tables = positions_tables + storms_tables
+
+    if basins in _MERGED:
+        sources, merged = _MERGED[basins]
+        if all(source is table for source, table in zip(sources, tables)):
+            return merged
+
+    merged = (_merge(positions_tables, basins), _merge(storms_tables, basins))
+    _MERGED[basins] = (tables, merged)
+
+    return merged
+
+
+# The basin of each stormID, from its prefix.
+def basin_of(stormIDs):
+    return [BASIN_PREFIXES.get(str(stormID).strip()[:2], "") for stormID in stormIDs]
+
+
+# The default positions and storms tables, or those of basins (one basin's
+# name or a list of basins to merge) if given. These are loaded the first
+# time they're asked for rather than when a module is imported.
+def positions(basins = None):
+    if basins is None:
+        basins = DEFAULT_BASIN
+    if isinstance(basins, str):
+        return load_positions(basins)
+    return load_basins(basins)[0]
+
+def storms(basins = None):
+    if basins is None:
+        basins = DEFAULT_BASIN
+    if isinstance(basins, str):
+        return load_storms(basins)
+    return load_basins(basins)[1]
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import stream_hurdat as sth
+
+# Purpose of module: to read raw HURDAT files one storm at a time instead of
+# loading the whole file with pandas. Only the storm being parsed (or the
+# chunk of storms being assembled) is held in memory, so files larger than
+# memory, or several basins' files concatenated together, can be processed
+# directly without first writing the intermediate CSVs.
+
+# The storms and positions produced here have the same columns and values as
+# the files written by clean_hurdat.partition_hurdat.
+
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+
+# Columns of the position rows, in the order they appear in the raw file.
+POSITION_COLUMNS = ['date', 'time', 'recordID', 'status', 'lat', 'lon', 'maxSustWind', 'minPressure', 'extNE34', 'extSE34', 'extSW34', 'extNW34', 'extNE50', 'extSE50', 'extSW50', 'extNW50', 'extNE64', 'extSE64', 'extSW64', 'extNW64']
+
+# Position columns that hold plain numbers.
+NUMERIC_COLUMNS = POSITION_COLUMNS[6:]
+
+# Columns of the storms table written by partition_hurdat.
+STORM_COLUMNS = ['stormID', 'name', 'numPositions', 'year', 'month_formed']
+
+# One storm from a HURDAT file. positions is a dictionary of numpy arrays, one
+# per entry of POSITION_COLUMNS.
+StormRecord = namedtuple('StormRecord', STORM_COLUMNS + ['positions'])
+
+
+# Convert a coordinate such as ' 28.0N' or ' 94.8W' to signed degrees, with
+# degrees South and West negative.
+def _coordinate(entry, positive):
+
+    entry = entry.strip()
+    value = float(entry[:-1])
+
+    if entry[-1] == positive:
+        return value
+    return -value
+
+
+# Turn the raw position lines for a storm into a dictionary of typed columns.
+def _parse_positions(lines):
+
+    # Older downloads are padded to 20 fields and newer HURDAT releases add
+    # fields at the end, so only the first 20 fields are kept.
+    fields = [line.rstrip('\r\n').split(',')[:len(POSITION_COLUMNS)] for line in lines]
+    columns = dict(zip(POSITION_COLUMNS, zip(*fields)))
+
+    positions = {}
+    positions['date'] = pd.to_datetime(np.array(columns['date']), format = "%Y%m%d").to_numpy()
+    positions['time'] = np.array(columns['time'], dtype = object)
+    positions['recordID'] = np.array(columns['recordID'], dtype = object)
+    positions['status'] = np.array(columns['status'], dtype = object)
+    positions['lat'] = np.array([_coordinate(entry, 'N') for entry in columns['lat']])
+    positions['lon'] = np.array([_coordinate(entry, 'E') for entry in columns['lon']])
+
+    for column in NUMERIC_COLUMNS:
+        positions[column] = np.array(columns[column], dtype = float)
+
+    return positions
+
+
+# Generator yielding a StormRecord for each storm in the raw HURDAT file
+# {fn}, reading the file line by line. Like partition_hurdat, the file is
+# looked for in the raw data directory.
+def iter_storms(fn):
+
+    with open(f'../data/01_raw/{fn}') as raw:
+        for header in raw:
+
+            # Skip blank lines, which can appear where files were joined.
+            if header.strip() == "":
+                continue
+
+            fields = header.split(',')
+            if fields[0].strip().isnumeric():
+                raise ValueError(f"Expected a storm header row in {fn}, found: {header.strip()}")
+
+            stormID = fields[0].strip()
+            name = fields[1].strip()
+            numPositions = int(fields[2])
+
+            # The header row is followed by numPositions position rows.
+            lines = list(islice(raw, numPositions))
+            if len(lines) < numPositions:
+                raise ValueError(f"{fn} ends partway through storm {stormID}")
+
+            positions = _parse_positions(lines)
+
+            yield StormRecord(stormID = stormID,
+                              name = name,
+                              numPositions = numPositions,
+                              year = int(stormID[4:9]),
+                              month_formed = pd.Timestamp(positions['date'][0]).month,
+                              positions = positions)
+
+
+# Assemble a list of StormRecords into positions and storms DataFrames laid
+# out like the _positions.csv and _storms.csv files.
+def records_to_frames(records):
+
+    storms = pd.DataFrame([record[:len(STORM_COLUMNS)] for record in records], columns = STORM_COLUMNS)
+
+    if len(records) == 0:
+        positions = pd.DataFrame(columns = POSITION_COLUMNS + ['name', 'stormID'])
+        return positions, storms
+
+    positions = pd.DataFrame({column: np.concatenate([record.positions[column] for record in records]) for column in POSITION_COLUMNS})
+    positions['name'] = np.repeat(storms['name'].to_numpy(), storms['numPositions'])
+    positions['stormID'] = np.repeat(storms['stormID'].to_numpy(), storms['numPositions'])
+
+    return positions, storms
+
+
+# Generator yielding (positions, storms) DataFrames for the raw HURDAT file
+# {fn}, with at most chunk_storms storms per chunk.
+def iter_chunks(fn, chunk_storms = 500):
+
+    records = []
+
+    for record in iter_storms(fn):
+        records.append(record)
+
+        if len(records) == chunk_storms:
+            yield records_to_frames(records)
+            records = []
+
+    if records:
+        yield records_to_frames(records)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import track_store as tst
+
+# Purpose of module: a compact, array-per-column copy of the positions table
+# that the frequency and plotting code can use in place of the DataFrame.
+
+# Every position takes up a few dozen bytes: latitude and longitude as int16
+# tenths of a degree (HURDAT gives them to a tenth of a degree, so this is
+# exact, where float32 would move some of them into a neighbouring cell on
+# fine grids), wind radii, maximum wind and pressure as int16 (keeping the
+# -999 sentinel, with a mask flagging positions missing any TS or HU radius),
+# status and record identifier as int8 codes into small tables, and the date
+# and time as one datetime64. Storms are stored one after another, with
+# offsets[i]:offsets[i + 1] the positions of the i-th storm.
+
+# column and columns give back any column of the positions table in the
+# DataFrame's units (and are also happy to be handed the DataFrame itself),
+# so code written against positions_df works on either.
+
+import weakref
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from src.d02_intermediate import hurdat_cache as hc
+
+
+TrackStore = namedtuple('TrackStore', ['stormIDs', 'names', 'offsets', 'index',
+                                       'when', 'status', 'statuses', 'record', 'records',
+                                       'lat', 'lon', 'max_wind', 'min_pressure',
+                                       'ext34', 'ext50', 'ext64', 'missing'])
+
+# The radii columns of the positions table for each radius, in quadrant
+# order (NE, SE, SW, NW).
+RADII = {'ext34': ['extNE34', 'extSE34', 'extSW34', 'extNW34'],
+         'ext50': ['extNE50', 'extSE50', 'extSW50', 'extNW50'],
+         'ext64': ['extNE64', 'extSE64', 'extSW64', 'extNW64']}
+
+# Other numeric columns stored as int16, by field.
+INTEGERS = {'max_wind': 'maxSustWind', 'min_pressure': 'minPressure'}
+
+MISSING = -999
+
+# Stores built by track_store, keyed by the id() of the positions DataFrame,
+# as with storm_tracks.storm_index.
+_STORES = {}
+
+
+# Integer codes into a table of the distinct values of a column.
+def _codes(values):
+    codes, uniques = pd.factorize(np.asarray(values, dtype = object))
+    return codes.astype(np.int8), np.asarray(uniques, dtype = object)
+
+
+def _int16(values):
+
+    values = np.asarray(values, dtype = float)
+    if (values != np.round(values)).any() or np.abs(values).max(initial = 0) > np.iinfo(np.int16).max:
+        raise ValueError("Values can't be stored exactly as int16")
+
+    return values.astype(np.int16)
+
+
+# Build (once per DataFrame) the track store for positions_df.
+def track_store(positions_df = None):
+    if positions_df is None:
+        positions_df = hc.positions()
+
+    key = id(positions_df)
+    if key in _STORES:
+        ref, length, store = _STORES[key]
+        if ref() is positions_df and length == len(positions_df):
+            return store
+
+    # Put each storm's positions together (they normally already are), in
+    # the order the storms first appear.
+    storm_codes, stormIDs = pd.factorize(positions_df['stormID'].astype('str').to_numpy())
+    order = np.argsort(storm_codes, kind = 'stable')
+    df = positions_df.iloc[order]
+
+    offsets = np.r_[0, np.cumsum(np.bincount(storm_codes, minlength = len(stormIDs)))]
+    stormIDs = np.asarray(stormIDs, dtype = object)
+    names = df['name'].astype('str').to_numpy()[offsets[:-1]] if len(df) else np.zeros(0, dtype = object)
+
+    hours = np.array([int(str(time).strip() or 0) for time in df['time'].to_numpy()])
+    when = pd.to_datetime(df['date']).to_numpy().astype('datetime64[m]') + ((hours // 100) * 60 + hours % 100).astype('timedelta64[m]')
+
+    status, statuses = _codes(df['status'].astype('str'))
+    record, records = _codes(df['recordID'].astype('str'))
+
+    radii = {field: _int16(df[columns].to_numpy()) for field, columns in RADII.items()}
+    missing = (radii['ext34'] == MISSING).any(axis = 1) | (radii['ext64'] == MISSING).any(axis = 1)
+
+    store = TrackStore(stormIDs, names, offsets,
+                       {stormID: slice(start, stop) for stormID, start, stop in zip(stormIDs, offsets[:-1], offsets[1:])},
+                       when, status, statuses, record, records,
+                       _int16(np.round(df['lat'].to_numpy() * 10)), _int16(np.round(df['lon'].to_numpy() * 10)),
+                       *[_int16(df[column].to_numpy()) for column in INTEGERS.values()],
+                       radii['ext34'], radii['ext50'], radii['ext64'], missing)
+
+    ref = weakref.ref(positions_df, lambda ref, key = key: _STORES.pop(key, None))
+    _STORES[key] = (ref, len(positions_df), store)
+
+    return store
+
+
+# Memory used by the store's arrays, in bytes.
+def nbytes(store):
+    return sum(value.nbytes for value in store if isinstance(value, np.ndarray))
+
+
+# Rows of the store belonging to stormID.
+def storm_rows(store, stormID):
+    return store.index.get(stormID, slice(0, 0))
+
+
+# The values of one column of the positions table (by its name in the
+# DataFrame, e.g. 'lat', 'extNE34' or 'status'), for rows of source (a
+# TrackStore or the positions DataFrame itself). Values come back as they
+# would from positions_df[name].to_numpy()[rows], except that numbers are
+# float64.
+def column(source, name, rows = slice(None)):
+
+    if not isinstance(source, TrackStore):
+        return source[name].to_numpy()[rows]
+
+    if name in ('lat', 'lon'):
+        return getattr(source, name)[rows] / 10
+    for field, columns in RADII.items():
+        if name in columns:
+            return getattr(source, field)[rows, columns.index(name)].astype(float)
+    for field, column_name in INTEGERS.items():
+        if name == column_name:
+            return getattr(source, field)[rows].astype(float)
+
+    if name == 'status':
+        return source.statuses[source.status[rows]]
+    if name == 'recordID':
+        return source.records[source.record[rows]]
+    if name == 'date':
+        return source.when[rows].astype('datetime64[D]').astype('datetime64[ns]')
+    if name == 'time':
+        minutes = (source.when[rows] - source.when[rows].astype('datetime64[D]')).astype(int)
+        return np.array([f" {minute // 60:02d}{minute % 60:02d}" for minute in minutes], dtype = object)
+    if name in ('stormID', 'name'):
+        owner = np.searchsorted(source.offsets, np.arange(len(source.lat))[rows], side = 'right') - 1
+        return (source.stormIDs if name == 'stormID' else source.names)[owner]
+
+    raise KeyError(name)
+
+
+# Whether each position in rows of source is missing any of its TS or HU
+# radii (-999), which a TrackStore has already worked out.
+def missing(source, rows = slice(None)):
+
+    if isinstance(source, TrackStore):
+        return source.missing[rows]
+
+    return (columns(source, RADII['ext34'], rows) == MISSING).any(axis = 1) | (columns(source, RADII['ext64'], rows) == MISSING).any(axis = 1)
+
+
+# Several numeric columns side by side as a float64 array, e.g. the four
+# quadrant radii.
+def columns(source, names, rows = slice(None)):
+
+    if not isinstance(source, TrackStore):
+        return source[names].to_numpy()[rows].astype(float)
+
+    for field, radii in RADII.items():
+        if list(names) == radii:
+            return getattr(source, field)[rows].astype(float)
+
+    return np.column_stack([column(source, name, rows) for name in names])
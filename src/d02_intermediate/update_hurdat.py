@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import update_hurdat as uph
+
+# Purpose of module: to bring the partitioned positions and storms tables up
+# to date with a new release of a HURDAT file without reprocessing every
+# storm since 1851.
+
+# NOAA republishes the whole file each year, but only the latest season's
+# storms (and the occasional reanalyzed older storm) actually change. Each
+# storm in the new raw file is compared with the stored tables by stormID and
+# by a hash of its contents; only storms that were added or revised are
+# turned into new rows, while every other storm keeps its stored rows.
+# frequency.patch_frequency then uses the result to update a frequency grid
+# by re-rasterizing only the storms that changed.
+
+import os
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from src.d02_intermediate import hurdat_cache as hc
+from src.d02_intermediate import stream_hurdat as sth
+from src.d02_intermediate import clean_hurdat as clh
+
+
+# Result of update_hurdat: the stormIDs that were added, revised or removed,
+# and the positions and storms tables from before and after the update.
+HurdatUpdate = namedtuple('HurdatUpdate', ['added', 'revised', 'removed', 'old_positions', 'old_storms', 'positions', 'storms'])
+
+
+# Hash of one storm's name and positions. columns maps each of
+# stream_hurdat.POSITION_COLUMNS to the storm's values. Values are put in a
+# fixed form first (dates as days, numbers as the float32 they're cached as,
+# strings joined together) so that a storm parsed from the raw file and the
+# same storm loaded from the stored tables hash the same.
+def storm_hash(name, columns):
+
+    digest = hashlib.blake2b(digest_size = 16)
+    digest.update(str(name).encode())
+
+    for column in sth.POSITION_COLUMNS:
+        values = np.asarray(columns[column])
+
+        if column == 'date':
+            values = values.astype('datetime64[D]').astype(np.int64)
+        elif column in ['time', 'recordID', 'status']:
+            values = "\x1f".join(str(value) for value in values).encode()
+        elif column in ['lat', 'lon']:
+            values = values.astype(np.float64)
+        else:
+            values = values.astype(np.float32)
+
+        digest.update(column.encode())
+        digest.update(values if isinstance(values, bytes) else np.ascontiguousarray(values).tobytes())
+
+    return digest.hexdigest()
+
+
+# Hash of every storm in a stored positions table, keyed by stormID.
+def stored_hashes(positions_df):
+
+    columns = {column: positions_df[column].to_numpy() for column in sth.POSITION_COLUMNS}
+    names = positions_df['name'].to_numpy()
+
+    hashes = {}
+    for stormID, rows in positions_df.groupby('stormID', sort = False, observed = True).indices.items():
+        hashes[stormID] = storm_hash(names[rows[0]], {column: values[rows] for column, values in columns.items()})
+
+    return hashes
+
+
+# Update the partitioned tables for the HURDAT file {fn} (e.g. "Atlantic.csv")
+# from a new download of it in the raw data directory. The new tables are
+# written in place of the old ones (unless write is False) exactly as
+# partition_hurdat would write them, and a HurdatUpdate is returned.
+def update_hurdat(fn, write = True):
+
+    fn_no_ext = os.path.splitext(fn)[0]
+
+    old_positions = hc.load_positions(fn_no_ext)
+    old_storms = hc.load_storms(fn_no_ext)
+    old_hashes = stored_hashes(old_positions)
+
+    # Stream through the new file, keeping the header of every storm but the
+    # positions of only the storms that were added or revised.
+    headers = []
+    changed = []
+    added, revised = [], []
+
+    for record in sth.iter_storms(fn):
+        headers.append(record[:len(sth.STORM_COLUMNS)])
+
+        old_hash = old_hashes.get(record.stormID)
+        if old_hash is not None and old_hash == storm_hash(record.name, record.positions):
+            continue
+
+        changed.append(record)
+        if old_hash is None:
+            added.append(record.stormID)
+        else:
+            revised.append(record.stormID)
+
+    storms = pd.DataFrame(headers, columns = sth.STORM_COLUMNS)
+    new_ids = set(storms['stormID'])
+    removed = [stormID for stormID in old_hashes if stormID not in new_ids]
+
+    # Positions of unchanged storms come straight from the old table; the
+    # new rows are then slotted in so storms stay in the order of the new
+    # file.
+    rank = pd.Series(np.arange(len(storms)), index = storms['stormID'])
+    changed_ids = set(added) | set(revised)
+
+    old_ids = old_positions['stormID'].astype('str').to_numpy()
+    kept = np.flatnonzero(~np.isin(old_ids, list(changed_ids | set(removed))))
+    # A single basin's table has no basin column, so only the categorical
+    # columns it does have are turned back into plain values.
+    kept_positions = old_positions.iloc[kept].astype({column: 'object' for column in hc.CATEGORICAL_COLUMNS if column in old_positions.columns})
+
+    if changed:
+        new_positions = sth.records_to_frames(changed)[0]
+        new_positions['date'] = new_positions['date'].astype(kept_positions['date'].dtype)
+        positions = pd.concat([kept_positions, new_positions[kept_positions.columns]], ignore_index = True)
+    else:
+        positions = kept_positions.reset_index(drop = True)
+
+    order = np.argsort(rank[positions['stormID']].to_numpy(), kind = 'stable')
+    positions = positions.iloc[order].reset_index(drop = True)
+
+    if write:
+        clh.write_partition(positions, storms, fn_no_ext)
+
+    print(f"Updated {fn}: {len(added)} added, {len(revised)} revised, {len(removed)} removed")
+
+    return HurdatUpdate(added, revised, removed, old_positions, old_storms, positions, storms)
@@ -7,124 +7,284 @@ Created on Mon Oct  5 22:41:10 2020
 """
 
 # Purpose of module: to produce numpy arrays containing frequencies with which
-# 1x1 degree grid spaces experience storm conditions.
+# grid spaces (1x1 degree and global unless another grids.GridSpec is given)
+# experience storm conditions.
 
 # Can be passed into the heatmap function in visualization or saved as a csv
 # for use in modeling.
 
 import os, sys
-import pandas as pd
+import tempfile
 
 root_dir = os.path.join(os.getcwd(), '..')
 sys.path.append(root_dir)
 
 import numpy as np
-import math as m
-import cartopy.crs as ccrs
+from src.d00_utils import instrument as ins
+from src.d02_intermediate import hurdat_cache as hc
+from src.d02_intermediate import track_store as tst
 from src.d07_visualization import storm_tracks as trk
+from src.d02_intermediate import stream_hurdat as sth
+from src.d03_processing import grids as grd
+from src.d03_processing import swath as sw
+from src.d03_processing import swath_interp as swi
+from src.d03_processing import swath_cache as swc
 
 
-RADIUS = 3440.1
+# POSITIONS and STORMS are loaded on first access instead of at import, so
+# workers that pass their own DataFrames never read the default data.
+def __getattr__(name):
+    if name == 'POSITIONS':
+        return hc.positions()
+    if name == 'STORMS':
+        return hc.storms()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-PROJECTION = ccrs.NearsidePerspective(central_longitude = -55, central_latitude = 30,  satellite_height = 10000000)
+# Wind extent columns for each quadrant (NE, SE, SW, NW).
+TS_COLUMNS = sw.TS_COLUMNS
+HU_COLUMNS = sw.HU_COLUMNS
 
-POSITIONS = pd.read_csv('../data/02_intermediate/Atlantic_positions.csv')
-STORMS = pd.read_csv('../data/02_intermediate/Atlantic_storms.csv')
 
-ne_brngs = np.linspace(0, 90, 31)
-se_brngs = np.linspace(90, 180, 31)
-sw_brngs = np.linspace(180, 270, 31)
-nw_brngs = np.linspace(270, 360, 31)
-brngs = [ne_brngs, se_brngs, sw_brngs, nw_brngs]
+# Build the table the rasterizer works from: one row per position with
+# columns lat, lon, the four quadrant extents to draw and a flag for whether
+# the position is drawn at all. Also returns the value drawn for each cell.
+# positions_df can also be a track_store.TrackStore.
+def _swath_table(positions_df, hu_only = False):
 
+    status = tst.column(positions_df, 'status')
+    ts_ext = tst.columns(positions_df, TS_COLUMNS)
+    hu_ext = tst.columns(positions_df, HU_COLUMNS)
 
-def wind_frequency(stormlist = STORMS['stormID'][STORMS['year'] >= 2004], positions_df = POSITIONS, hu_only = False):
-    
-    cumulative_winds = np.zeros((180, 360))
+    # Only hurricane winds are drawn (as 2) when hu_only is set, otherwise
+    # only tropical storm winds are drawn (as 1).
+    if hu_only:
+        extents, value = hu_ext, 2
+        draw = sw.drawable(status, ts_ext, hu_ext, sw.HU_STATUSES, tst.missing(positions_df))
+    else:
+        extents, value = ts_ext, 1
+        draw = sw.drawable(status, ts_ext, hu_ext, sw.TS_STATUSES, tst.missing(positions_df))
 
-    for storm in stormlist:
-        storm_lats = trk.track_lat(storm, positions_df = positions_df)
-        storm_lons = trk.track_lon(storm, positions_df = positions_df)
-        storm_winds = trk.winds(storm, positions_df = positions_df)
+    table = np.column_stack([tst.column(positions_df, 'lat').astype(float),
+                             tst.column(positions_df, 'lon').astype(float),
+                             extents,
+                             draw])
 
-        storm_history = np.zeros((180, 360))
+    return table, value
 
-        for x in range(len(storm_lats)):
-    
-            lat = storm_lats[x]
-            lon = storm_lons[x]
-            rlat = lat*(m.pi/180)
-            rlon = lon*(m.pi/180)
 
-            trext = [storm_winds[1][x], storm_winds[2][x], storm_winds[3][x], storm_winds[4][x]]
-            huext = [storm_winds[5][x], storm_winds[6][x], storm_winds[7][x], storm_winds[8][x]]
-    
-            if (-999) in trext:
-                continue
-            if (-999) in huext:
-                continue
+# Sum the rasterized wind extents of a set of storms on grid, given the swath
+# table and, for each storm, the rows of the table belonging to it. The sum
+# is returned as a grids.SparseGrid. engine and backend pick the rasterizer
+# (see wind_frequency).
+def _accumulate(table, storm_rows, value, grid = grd.GLOBAL, engine = 'columns', backend = 'numpy'):
 
-            if hu_only:
+    if len(storm_rows) == 0:
+        return grd.count_cells(np.zeros(0, dtype = np.int64), grid)
 
-                if storm_winds[0][x] == ' HU':
-    
-                    for quad in range(4):
-    
-                        dist = huext[quad] / RADIUS
-   
-                        for i in brngs[quad]:
-                            brng = i * (m.pi/180)
-                            dlat = m.asin(m.sin(rlat)*m.cos(dist) + m.cos(rlat)*m.sin(dist)*m.cos(brng))
-                            dlon = rlon + m.atan2(m.sin(brng)*m.sin(dist)*m.cos(rlat), m.cos(dist)-m.sin(rlat)*m.sin(dlat))
-    
-                            dlat *= (180/m.pi)
-                            dlon *= (180/m.pi)
-                            if dlon < -180:
-                                dlon += 360
-                            elif dlon > 180:
-                                dlon -= 360
-        
-                            if quad  in [0, 3]:
-                                for y in range((90 + m.floor(lat)), (90 + m.ceil(dlat))):
-                                    storm_history[y][180 + m.floor(dlon)] = 2
-                    
-                            elif quad in [1, 2]:
-                                for y in range((90 + m.floor(dlat)), (90 + m.ceil(lat))):
-                                    storm_history[y][180 + m.floor(dlon)] = 2
-
-            else:
-
-                if storm_winds[0][x] in [' TS', ' HU']:
-    
-                    for quad in range(4):
-    
-                        dist = trext[quad] / RADIUS
-   
-                        for i in brngs[quad]:
-                            brng = i * (m.pi/180)
-                            dlat = m.asin(m.sin(rlat)*m.cos(dist) + m.cos(rlat)*m.sin(dist)*m.cos(brng))
-                            dlon = rlon + m.atan2(m.sin(brng)*m.sin(dist)*m.cos(rlat), m.cos(dist)-m.sin(rlat)*m.sin(dlat))
+    lap = ins.laps("accumulate")
+
+    # Gather the positions of every storm into one array, keeping track of
+    # which storm each position belongs to.
+    pieces = [table[rows] for rows in storm_rows]
+    positions = np.concatenate(pieces)
+    owner = np.repeat(np.arange(len(pieces)), [len(piece) for piece in pieces])
+
+    # Counted for the lap: fixes that aren't drawn for any reason (status or
+    # extents), and fixes with -999 extents.
+    draw = positions[:, 6] == 1
+    if ins.ENABLED:
+        lap("gather", storms = len(pieces), fixes = len(positions), undrawn_fixes = int(len(draw) - draw.sum()),
+            missing_extent_fixes = int((positions[:, 2:6] == sw.MISSING).any(axis = 1).sum()))
+
+    # Rasterize every drawable position of every storm in one go, then work
+    # out which storm each cell belongs to.
+    if engine == 'interpolated':
+        if backend != 'numpy':
+            raise ValueError("Swath backends only apply to the 'columns' engine")
+        rows, cols, position = swi.swath_cells(positions[:, 0], positions[:, 1], positions[:, 2:6], draw, owner, grid)
+    elif engine == 'columns':
+        positions, owner = positions[draw], owner[draw]
+        rows, cols, position = sw.swath_cells(positions[:, 0], positions[:, 1], positions[:, 2:6], grid, backend)
+    else:
+        raise ValueError(f"Unknown swath engine: {engine}")
+    cells = sw.flat_cells(rows, cols, grid)
+    owner = owner[position]
+    lap("rasterize", cells_touched = len(cells))
+
+    cells = _storm_cells(cells, owner, grid)
+    lap("dedupe", storm_cells = len(cells))
+
+    frequencies = grd.count_cells(cells, grid, value)
+    lap("count", cells = len(frequencies.cells))
+
+    return frequencies
+
+
+# A storm counts once per cell however many times its winds cover it, so
+# drop repeats of the same cell within each storm's run of cells (owner is
+# in increasing order). Rather than sorting, each storm writes the position
+# of each of its cells into a scratch array; exactly one of the repeats of a
+# cell finds its own position there when it's read back.
+def _storm_cells(cells, owner, grid):
+
+    # Only the entries written for a storm are ever read back, so the scratch
+    # array doesn't need clearing (and pages never touched are never used).
+    scratch = np.empty(grid.size, dtype = np.int64)
+    order = np.arange(len(cells))
+
+    bounds = np.searchsorted(owner, np.arange(owner[-1] + 2)) if len(owner) else [0]
+    keep = np.zeros(len(cells), dtype = bool)
+
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if start == stop:
+            continue
+        scratch[cells[start:stop]] = order[start:stop]
+        keep[start:stop] = scratch[cells[start:stop]] == order[start:stop]
+
+    return cells[keep]
+
+
+# Worker side of the parallel mode: open the shared swath table and sum the
+# storms in this shard.
+def _accumulate_shard(table_path, storm_rows, value, grid, engine, backend = 'numpy'):
+
+    table = np.load(table_path, mmap_mode = 'r')
+
+    return _accumulate(table, storm_rows, value, grid, engine, backend)
+
+
+# A pool of worker processes for backend. Workers are forked, unless the
+# 'numba' backend is used or has already run in this process: numba's
+# threads don't survive a fork (depending on its threading layer, forked
+# workers crash or the parent hangs on exit), so workers are started fresh
+# instead.
+def _process_pool(workers, backend = 'numpy'):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    numba_started = backend == 'numba' or 'src.d03_processing.swath_numba' in sys.modules
+    context = multiprocessing.get_context('spawn') if numba_started else None
+
+    return ProcessPoolExecutor(max_workers = workers, mp_context = context)
+
+
+# Split the storms across a pool of worker processes. The swath table is
+# written once to a memory-mapped file that every worker opens, so only the
+# row ranges of each shard (and the sparse partial sums coming back) are
+# pickled.
+def _parallel_accumulate(table, storm_rows, value, workers, grid = grd.GLOBAL, engine = 'columns', backend = 'numpy'):
+
+    # Use a few shards per worker so that a shard full of long-lived storms
+    # doesn't hold up the whole run, dealing the storms out in turn so each
+    # shard gets a mix of seasons.
+    num_shards = min(len(storm_rows), workers * 4)
+    shards = [storm_rows[i::num_shards] for i in range(num_shards)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        table_path = os.path.join(tmp, "swath_table.npy")
+        np.save(table_path, table)
+
+        with _process_pool(workers, backend) as pool:
+            partials = list(pool.map(_accumulate_shard, [table_path] * num_shards, shards, [value] * num_shards, [grid] * num_shards, [engine] * num_shards, [backend] * num_shards))
+
+    return grd.combine(partials, grid)
+
+
+# By default, frequencies are for every storm since 2004 (the first season
+# with wind extents). Set workers to the number of processes to use to split
+# the storms across a process pool, or use_cache to build the grid from the
+# per-storm footprints kept by swath_cache (rasterizing only storms that
+# aren't cached yet). grid sets the resolution and extent of the result.
+# With sparse = True the result is a grids.SparseGrid of the nonzero cells
+# instead of a full array.
+# engine = 'interpolated' rasterizes with swath_interp, which also covers the
+# winds between consecutive fixes, instead of the fixes alone ('columns').
+# The footprint cache only holds footprints from the 'columns' engine.
+# backend picks the code rasterizing for the 'columns' engine ('numpy',
+# 'python' or 'numba'; see swath), which gives the same result either way.
+# basins (a basin's name or a list of basins) picks the data used when
+# stormlist or positions_df aren't given, so several basins can be counted in
+# one run on the same grid.
+# positions_df may be a track_store.TrackStore instead of the DataFrame.
+# With instrument enabled, the stages are reported as frequency.* and
+# accumulate.* (and swath.* within accumulate.rasterize); stages run in
+# worker processes aren't reported.
+def wind_frequency(stormlist = None, positions_df = None, hu_only = False, workers = 1, use_cache = False, grid = grd.GLOBAL, sparse = False, engine = 'columns', basins = None, backend = 'numpy'):
     
-                            dlat *= (180/m.pi)
-                            dlon *= (180/m.pi)
-                            if dlon < -180:
-                                dlon += 360
-                            elif dlon > 180:
-                                dlon -= 360
-            
-                            if quad in [0, 3]:
-                                for y in range((90 + m.floor(lat)), (90 + m.ceil(dlat))):
-                                    if (storm_history[y][180 + m.floor(dlon)] != 2):
-                                        storm_history[y][180 + m.floor(dlon)] = 1
-                                
-                            elif quad in [1, 2]:
-                                for y in range((90 + m.floor(dlat)), (90 + m.ceil(lat))):
-                                    if (storm_history[y][180 + m.floor(dlon)] != 2):
-                                        storm_history[y][180 + m.floor(dlon)] = 1
-                                            
-        
-        cumulative_winds += storm_history
-        
-    return(cumulative_winds)
+    lap = ins.laps("frequency")
+
+    if stormlist is None:
+        storms_df = hc.storms(basins)
+        stormlist = storms_df['stormID'][storms_df['year'] >= 2004]
+    if positions_df is None:
+        positions_df = hc.positions(basins)
+    lap("load")
+
+    if use_cache and engine != 'columns':
+        raise ValueError("use_cache is only available with the 'columns' engine")
+
+    if use_cache:
+        frequencies = swc.cached_frequency(stormlist, positions_df, hu_only = hu_only, grid = grid, sparse = True, backend = backend)
+        lap("cached")
+    else:
+        table, value = _swath_table(positions_df, hu_only = hu_only)
+        lap("table", fixes = len(table))
+        storm_rows = [trk.storm_rows(storm, positions_df) for storm in stormlist]
+        lap("lookup", storms = len(storm_rows))
+
+        if workers > 1 and len(storm_rows) > 1:
+            frequencies = _parallel_accumulate(table, storm_rows, value, workers, grid, engine, backend)
+        else:
+            frequencies = _accumulate(table, storm_rows, value, grid, engine, backend)
+        lap("accumulate")
+
+    if sparse:
+        return frequencies
+
+    frequencies = grd.dense(frequencies)
+    lap("dense")
+
+    return frequencies
+
+
+# Accumulate wind frequencies straight from a raw HURDAT file {fn} (in the raw
+# data directory), reading it a chunk of storms at a time rather than loading
+# the partitioned CSVs. Storms from seasons before min_year are left out.
+def wind_frequency_raw(fn, min_year = 2004, hu_only = False, chunk_storms = 500, grid = grd.GLOBAL, sparse = False, engine = 'columns'):
+
+    partials = []
+
+    for positions_df, storms_df in sth.iter_chunks(fn, chunk_storms = chunk_storms):
+        stormlist = storms_df['stormID'][storms_df['year'] >= min_year]
+        partials.append(wind_frequency(stormlist, positions_df = positions_df, hu_only = hu_only, grid = grid, sparse = True, engine = engine))
+
+    frequencies = grd.combine(partials, grid)
+
+    if sparse:
+        return frequencies
+
+    return grd.dense(frequencies)
+
+
+# Bring a frequency grid built by wind_frequency up to date after
+# update_hurdat.update_hurdat, given the HurdatUpdate it returned. The
+# footprints of storms that were revised or removed are subtracted and those
+# of storms that were added or revised are added back, so only the storms
+# that changed are rasterized. hu_only, grid, min_year and engine must match
+# how freq_array was built (by default, every storm since 2004).
+def patch_frequency(freq_array, update, hu_only = False, grid = grd.GLOBAL, min_year = 2004, use_cache = False, engine = 'columns'):
+
+    def since(storms_df, stormIDs):
+        storms_df = storms_df[storms_df['stormID'].astype('str').isin(stormIDs)]
+        return storms_df['stormID'][storms_df['year'] >= min_year].astype('str')
+
+    old = wind_frequency(since(update.old_storms, update.revised + update.removed), positions_df = update.old_positions,
+                         hu_only = hu_only, use_cache = use_cache, grid = grid, sparse = True, engine = engine)
+    new = wind_frequency(since(update.storms, update.added + update.revised), positions_df = update.positions,
+                         hu_only = hu_only, use_cache = use_cache, grid = grid, sparse = True, engine = engine)
 
+    patched = np.array(freq_array, dtype = float)
+    patched.flat[old.cells] -= old.counts
+    patched.flat[new.cells] += new.counts
 
+    return patched
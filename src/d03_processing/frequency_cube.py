@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import frequency_cube as fcb
+
+# Purpose of module: to produce frequency grids for every season (or every
+# month formed) at once, so trends can be looked at without a separate
+# wind_frequency run for each year, decade or month.
+
+# The cube has one slice per label (season year or month formed), each slice
+# being the frequency grid of the storms with that label, stored as uint16
+# counts of storms. Every storm is rasterized exactly once. The cube can be
+# kept in memory or written to a directory, one slice at a time, as a .npy
+# file that is opened memory-mapped afterwards; any run of labels can then be
+# summed by slicing, or in constant time per cell from the prefix sums.
+
+import os, sys
+import json
+import tempfile
+from collections import namedtuple
+
+root_dir = os.path.join(os.getcwd(), '..')
+sys.path.append(root_dir)
+
+import numpy as np
+from src.d02_intermediate import hurdat_cache as hc
+from src.d07_visualization import storm_tracks as trk
+from src.d03_processing import frequency as fq
+from src.d03_processing import grids as grd
+
+
+# counts has one slice per entry of labels (the values of the storms column
+# `by`); value is what each storm adds to a cell in wind_frequency (1, or 2
+# when hu_only). path is the directory the cube is stored in, if any.
+FrequencyCube = namedtuple('FrequencyCube', ['labels', 'counts', 'grid', 'by', 'value', 'path'])
+
+# Columns of the storms table a cube can be sliced by.
+SLICE_COLUMNS = ['year', 'month_formed']
+
+COUNTS_FILE = "counts.npy"
+PREFIX_FILE = "prefix.npy"
+META_FILE = "cube.json"
+
+
+# The labels of the slices: every year from the first to the last (so that
+# years with no storms still get a slice), or every month.
+def _labels(values, by):
+    if by == 'month_formed':
+        return np.arange(1, 13)
+    if len(values) == 0:
+        return np.zeros(0, dtype = int)
+    return np.arange(values.min(), values.max() + 1)
+
+
+# Write one slice's SparseGrid into the cube.
+def _fill_slice(counts, i, sparse):
+
+    if len(sparse.counts) and sparse.counts.max() > np.iinfo(np.uint16).max:
+        raise ValueError("More storms in one slice than a uint16 cube can count")
+
+    values = np.zeros(sparse.grid.size, dtype = np.uint16)
+    values[sparse.cells] = sparse.counts
+    counts[i] = values.reshape(sparse.grid.shape)
+
+
+# Build the cube of storm counts by season year (by = 'year') or by month
+# formed (by = 'month_formed') for storms from min_year on, with the same
+# hu_only, grid, engine and backend options as frequency.wind_frequency. Set
+# dest_dir to store the cube there (written a slice at a time, so the whole
+# cube is never held in memory) rather than keeping it in memory; workers
+# spreads the slices across a process pool. basins is as in wind_frequency.
+def frequency_cube(storms_df = None, positions_df = None, by = 'year', min_year = 2004, hu_only = False, grid = grd.GLOBAL, engine = 'columns', workers = 1, dest_dir = None, basins = None, backend = 'numpy'):
+    if storms_df is None:
+        storms_df = hc.storms(basins)
+    if positions_df is None:
+        positions_df = hc.positions(basins)
+
+    if by not in SLICE_COLUMNS:
+        raise ValueError(f"Can only slice by one of {SLICE_COLUMNS}, not {by}")
+
+    storms_df = storms_df[storms_df['year'] >= min_year]
+    stormIDs = storms_df['stormID'].astype('str').to_numpy()
+    slice_values = storms_df[by].to_numpy().astype(int)
+    labels = _labels(slice_values, by)
+
+    table, value = fq._swath_table(positions_df, hu_only = hu_only)
+
+    # The rows of the storms in each slice.
+    slice_rows = [[trk.storm_rows(storm, positions_df) for storm in stormIDs[slice_values == label]] for label in labels]
+
+    shape = (len(labels),) + grid.shape
+    if dest_dir is None:
+        counts = np.zeros(shape, dtype = np.uint16)
+    else:
+        os.makedirs(dest_dir, exist_ok = True)
+        counts = np.lib.format.open_memmap(os.path.join(dest_dir, COUNTS_FILE), mode = 'w+', dtype = np.uint16, shape = shape)
+
+    # Each slice is accumulated on its own (with a count of 1 per storm) and
+    # written straight into the cube.
+    if workers > 1 and len(labels) > 1:
+        with tempfile.TemporaryDirectory() as tmp:
+            table_path = os.path.join(tmp, "swath_table.npy")
+            np.save(table_path, table)
+
+            with fq._process_pool(workers, backend) as pool:
+                partials = pool.map(fq._accumulate_shard, [table_path] * len(labels), slice_rows, [1] * len(labels), [grid] * len(labels), [engine] * len(labels), [backend] * len(labels))
+                for i, sparse in enumerate(partials):
+                    _fill_slice(counts, i, sparse)
+    else:
+        for i, rows in enumerate(slice_rows):
+            _fill_slice(counts, i, fq._accumulate(table, rows, 1, grid, engine, backend))
+
+    if dest_dir is not None:
+        counts.flush()
+        with open(os.path.join(dest_dir, META_FILE), "w") as f:
+            json.dump({'labels': labels.tolist(), 'grid': list(grid), 'by': by, 'value': value}, f)
+        counts = np.load(os.path.join(dest_dir, COUNTS_FILE), mmap_mode = 'r')
+
+    return FrequencyCube(labels, counts, grid, by, value, dest_dir)
+
+
+# Open a cube written by frequency_cube, memory-mapped.
+def load_cube(dest_dir):
+
+    with open(os.path.join(dest_dir, META_FILE)) as f:
+        meta = json.load(f)
+
+    counts = np.load(os.path.join(dest_dir, COUNTS_FILE), mmap_mode = 'r')
+
+    return FrequencyCube(np.array(meta['labels']), counts, grd.GridSpec(*meta['grid']), meta['by'], meta['value'], dest_dir)
+
+
+# Running totals of the cube along its labels, with a slice of zeros in
+# front: prefix[j] - prefix[i] is the count for labels i to j - 1. Stored as
+# uint32 so totals over many seasons can't overflow. For a cube on disk the
+# prefix sums are written next to it (once) and opened memory-mapped.
+def cube_prefix(cube):
+
+    shape = (len(cube.labels) + 1,) + cube.grid.shape
+
+    if cube.path is None:
+        prefix = np.zeros(shape, dtype = np.uint32)
+        np.cumsum(cube.counts, axis = 0, dtype = np.uint32, out = prefix[1:])
+        return prefix
+
+    path = os.path.join(cube.path, PREFIX_FILE)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(os.path.join(cube.path, COUNTS_FILE)):
+        return np.load(path, mmap_mode = 'r')
+
+    # Built a slice at a time, like the cube itself.
+    prefix = np.lib.format.open_memmap(path, mode = 'w+', dtype = np.uint32, shape = shape)
+    prefix[0] = 0
+    for i in range(len(cube.labels)):
+        prefix[i + 1] = prefix[i] + cube.counts[i]
+    prefix.flush()
+    del prefix
+
+    return np.load(path, mmap_mode = 'r')
+
+
+# Position of label in the cube's labels.
+def _slice_index(cube, label):
+
+    i = int(np.searchsorted(cube.labels, label))
+    if i == len(cube.labels) or cube.labels[i] != label:
+        raise KeyError(f"No slice for {cube.by} {label}")
+
+    return i
+
+
+# The frequency grid for the storms with labels first to last (inclusive),
+# as wind_frequency would return it for those storms. Uses prefix (from
+# cube_prefix) if given, otherwise sums the slices.
+def cube_total(cube, first, last = None, prefix = None):
+    if last is None:
+        last = first
+
+    i, j = _slice_index(cube, first), _slice_index(cube, last) + 1
+
+    if prefix is not None:
+        counts = prefix[j].astype(np.int64) - prefix[i]
+    else:
+        counts = cube.counts[i:j].sum(axis = 0, dtype = np.int64)
+
+    return counts * float(cube.value)
+
+
+# Frequency grids for every run of window consecutive labels (e.g. rolling
+# decades, with window = 10), from the prefix sums. Returns the first label
+# of each window and an array with one grid per window.
+def rolling_totals(cube, window, prefix = None):
+    if prefix is None:
+        prefix = cube_prefix(cube)
+
+    starts = cube.labels[:max(len(cube.labels) - window + 1, 0)]
+    totals = np.asarray(prefix[window:], dtype = np.int64) - prefix[:len(starts)]
+
+    return starts, totals * float(cube.value)
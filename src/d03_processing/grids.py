@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import grids as grd
+
+# Purpose of module: to describe the grids that frequencies are accumulated
+# on. A GridSpec gives the size of the cells (in degrees) and the latitude
+# and longitude bounds of the grid, so a grid can be finer than 1x1 degree
+# and cover only the region of interest instead of the whole globe.
+
+# Rows of a grid run from lat_min northwards and columns from lon_min
+# eastwards. Longitudes may run past 180 (e.g. lon_min = 120, lon_max = 260)
+# for regions that cross the antimeridian.
+
+import os
+import json
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+class GridSpec(namedtuple('GridSpec', ['resolution', 'lat_min', 'lat_max', 'lon_min', 'lon_max'])):
+    __slots__ = ()
+
+    # Number of cells per degree. Positions are scaled by this (rather than
+    # divided by the resolution) so that, e.g., 20.3 degrees falls in cell
+    # 203 of a 0.1 degree grid instead of cell 202.
+    @property
+    def cells_per_degree(self):
+        return 1 / self.resolution
+
+    @property
+    def shape(self):
+        return (int(round((self.lat_max - self.lat_min) * self.cells_per_degree)),
+                int(round((self.lon_max - self.lon_min) * self.cells_per_degree)))
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    # Whether the grid goes all the way around the globe, in which case
+    # columns wrap around rather than falling off the edge.
+    @property
+    def wraps(self):
+        return self.shape[1] == int(round(360 * self.cells_per_degree))
+
+    # Row and column of the cell at the south-west corner of the grid, in a
+    # grid of this resolution anchored at 0 degrees latitude and longitude.
+    @property
+    def origin(self):
+        return (int(round(self.lat_min * self.cells_per_degree)),
+                int(round(self.lon_min * self.cells_per_degree)))
+
+    # Edges of the cells, e.g. for pcolormesh.
+    def lat_edges(self):
+        return np.linspace(self.lat_min, self.lat_max, self.shape[0] + 1)
+
+    def lon_edges(self):
+        return np.linspace(self.lon_min, self.lon_max, self.shape[1] + 1)
+
+    # A string identifying the grid, for cache keys and file names.
+    def key(self):
+        return f"{self.resolution:g}_{self.lat_min:g}_{self.lat_max:g}_{self.lon_min:g}_{self.lon_max:g}"
+
+
+# The 1x1 degree global grid everything used before grids were configurable.
+GLOBAL = GridSpec(1, -90, 90, -180, 180)
+
+
+# A grid of the given resolution covering only the given bounds.
+def regional(lat_min, lat_max, lon_min, lon_max, resolution = 1):
+    return GridSpec(resolution, lat_min, lat_max, lon_min, lon_max)
+
+
+# A grid stored sparsely: the flat indices of its nonzero cells (in
+# increasing order) and the value of each of those cells.
+SparseGrid = namedtuple('SparseGrid', ['cells', 'counts', 'grid'])
+
+
+# Count how many times each cell appears in cells (scaled by value) as a
+# SparseGrid.
+def count_cells(cells, grid = GLOBAL, value = 1):
+
+    cells, counts = np.unique(cells, return_counts = True)
+
+    return SparseGrid(cells, counts * value, grid)
+
+# Add several SparseGrids on the same grid together.
+def combine(sparse_grids, grid = GLOBAL):
+
+    sparse_grids = list(sparse_grids)
+    if len(sparse_grids) == 0:
+        return SparseGrid(np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), grid)
+
+    cells, inverse = np.unique(np.concatenate([sparse.cells for sparse in sparse_grids]), return_inverse = True)
+    counts = np.bincount(inverse, weights = np.concatenate([sparse.counts for sparse in sparse_grids]))
+
+    return SparseGrid(cells, counts.astype(np.int64), sparse_grids[0].grid)
+
+# The full 2-D array for a SparseGrid.
+def dense(sparse):
+
+    values = np.zeros(sparse.grid.size)
+    values[sparse.cells] = sparse.counts
+
+    return values.reshape(sparse.grid.shape)
+
+
+# Frequency grids saved as CSVs (like data/03_processed/2005frequency.csv)
+# are labelled with the latitude of the southern edge of each row and the
+# longitude of the western edge of each column, which is enough to recover
+# the GridSpec when they're read back in.
+def to_frame(freq_array, grid = GLOBAL):
+    return pd.DataFrame(freq_array, index = grid.lat_edges()[:-1], columns = grid.lon_edges()[:-1])
+
+def from_frame(freq_frame):
+
+    lats = freq_frame.index.to_numpy().astype(float)
+    lons = freq_frame.columns.to_numpy().astype(float)
+
+    resolution = float(lons[1] - lons[0]) if len(lons) > 1 else float(lats[1] - lats[0])
+    # Undo any rounding in the labels by snapping to a whole number of
+    # degrees, or to a whole number of cells per degree.
+    if resolution >= 1:
+        resolution = round(resolution)
+    else:
+        resolution = 1 / round(1 / resolution)
+
+    grid = GridSpec(resolution,
+                    float(round(lats[0], 6)), float(round(lats[-1] + resolution, 6)),
+                    float(round(lons[0], 6)), float(round(lons[-1] + resolution, 6)))
+
+    return freq_frame.to_numpy(), grid
+
+def save_frequency_csv(freq_array, fn, grid = GLOBAL):
+    to_frame(freq_array, grid).to_csv(f"../data/03_processed/{fn}")
+
+def read_frequency_csv(fn):
+    return from_frame(pd.read_csv(f"../data/03_processed/{fn}", index_col = 0))
+
+
+# Frequency grids can also be saved in binary, as compact integers in a .npy
+# file (e.g. data/03_processed/2005frequency.npy) with a JSON file beside it
+# giving the GridSpec and, for stacks of grids like the layers of a
+# frequency_cube, the label of each layer. The .npy file is opened
+# memory-mapped, so reading a window of a large grid only touches the rows
+# of the window rather than loading (and parsing) the whole file.
+PROCESSED_DIR = '../data/03_processed'
+
+def _grid_paths(fn):
+    path = os.path.join(PROCESSED_DIR, os.path.splitext(fn)[0])
+    return path + ".npy", path + ".json"
+
+# The smallest unsigned integer type holding every value, or a float type if
+# the values aren't whole numbers.
+def _compact_dtype(values):
+
+    if values.size == 0:
+        return np.dtype(np.uint8)
+
+    if np.all(values == np.round(values)) and values.min() >= 0:
+        for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+            if values.max() <= np.iinfo(dtype).max:
+                return np.dtype(dtype)
+
+    if np.array_equal(values.astype(np.float32), values):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+# Save freq_array (a 2-D grid or a SparseGrid, or a stack of grids with one
+# label per layer in labels) as {fn}.npy and {fn}.json in the processed data
+# directory. Returns the path of the .npy file.
+def save_frequency_grid(freq_array, fn, grid = GLOBAL, labels = None):
+
+    if isinstance(freq_array, SparseGrid):
+        freq_array, grid = dense(freq_array), freq_array.grid
+
+    values = np.asarray(freq_array)
+    if values.shape[-2:] != grid.shape:
+        raise ValueError(f"Grid of shape {values.shape[-2:]} doesn't match {grid}")
+
+    dtype = _compact_dtype(values)
+    data_path, meta_path = _grid_paths(fn)
+
+    np.save(data_path, values.astype(dtype))
+
+    meta = {'grid': {field: getattr(value, 'item', lambda: value)() for field, value in grid._asdict().items()}, 'dtype': dtype.name, 'shape': list(values.shape)}
+    if labels is not None:
+        meta['labels'] = [label.item() if hasattr(label, 'item') else label for label in labels]
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent = 1)
+
+    return data_path
+
+# The JSON description of a grid saved with save_frequency_grid, with the
+# GridSpec under 'grid'.
+def frequency_grid_info(fn):
+
+    with open(_grid_paths(fn)[1]) as f:
+        meta = json.load(f)
+    meta['grid'] = GridSpec(**meta['grid'])
+
+    return meta
+
+# The rows and columns of grid covering the window from lat_min to lat_max
+# and lon_min to lon_max (widened to whole cells and cut off at the edges of
+# the grid), and the GridSpec of just those cells.
+def window_of(grid, lat_min, lat_max, lon_min, lon_max):
+
+    scale = grid.cells_per_degree
+    num_rows, num_cols = grid.shape
+
+    r0 = int(np.clip(np.floor(round((lat_min - grid.lat_min) * scale, 6)), 0, num_rows))
+    r1 = int(np.clip(np.ceil(round((lat_max - grid.lat_min) * scale, 6)), r0, num_rows))
+    c0 = int(np.clip(np.floor(round((lon_min - grid.lon_min) * scale, 6)), 0, num_cols))
+    c1 = int(np.clip(np.ceil(round((lon_max - grid.lon_min) * scale, 6)), c0, num_cols))
+
+    window = GridSpec(grid.resolution,
+                      round(grid.lat_min + r0 / scale, 6), round(grid.lat_min + r1 / scale, 6),
+                      round(grid.lon_min + c0 / scale, 6), round(grid.lon_min + c1 / scale, 6))
+
+    return slice(r0, r1), slice(c0, c1), window
+
+# Read a grid saved with save_frequency_grid, returning the values (memory-
+# mapped) and their GridSpec. window = (lat_min, lat_max, lon_min, lon_max)
+# reads only that part of the grid, and layer picks one layer of a stack by
+# its label.
+def read_frequency_grid(fn, window = None, layer = None):
+
+    meta = frequency_grid_info(fn)
+    grid = meta['grid']
+    values = np.load(_grid_paths(fn)[0], mmap_mode = 'r')
+
+    if layer is not None:
+        values = values[meta['labels'].index(layer)]
+
+    if window is not None:
+        rows, cols, grid = window_of(grid, *window)
+        values = values[..., rows, cols]
+
+    return values, grid
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import return_periods as rtp
+
+# Purpose of module: to turn the storm counts of each season into per-cell
+# probabilities, return periods and confidence intervals for them, by
+# bootstrapping seasons.
+
+# The counts come from a frequency_cube by season year, so every storm is
+# rasterized once. Only cells some storm reached are kept, as a matrix of
+# seasons x cells. A bootstrap draw resamples the seasons with replacement,
+# which comes down to a row of weights (how many times each season was
+# drawn), so a whole batch of draws is a single product of the weight matrix
+# (draws x seasons) with the count matrix (seasons x cells). The cube is
+# read a block of grid rows at a time to find those cells, and the counts of
+# each chunk of cells are only read from the cube when the chunk is worked
+# on, so a cube on disk is never loaded whole. Chunks are sized to stay
+# within chunk_bytes and can be spread across processes.
+
+import os, sys
+from collections import namedtuple
+from concurrent.futures import wait, FIRST_COMPLETED
+
+root_dir = os.path.join(os.getcwd(), '..')
+sys.path.append(root_dir)
+
+import numpy as np
+from src.d00_utils import instrument as ins
+from src.d03_processing import frequency as fq
+from src.d03_processing import frequency_cube as fcb
+
+
+# Per-cell results as arrays shaped like grid (with a leading axis over
+# quantiles for the *_quantiles arrays):
+#  - rate: mean number of storms per season reaching the cell
+#  - exceedance: share of seasons with at least threshold storms reaching it
+#  - return_period: 1 / exceedance, in seasons (inf where it never happened)
+# and the bootstrap quantiles of each.
+ReturnPeriods = namedtuple('ReturnPeriods', ['grid', 'years', 'threshold', 'quantiles', 'num_draws',
+                                             'rate', 'rate_quantiles',
+                                             'exceedance', 'exceedance_quantiles',
+                                             'return_period', 'return_period_quantiles'])
+
+
+# The flat index of every cell of the cube that any storm reached, reading
+# the cube a block of grid rows (of about block_bytes) at a time.
+def season_cells(cube, block_bytes = 64 * 2**20):
+
+    num_rows, num_cols = cube.grid.shape
+    row_bytes = max(len(cube.labels), 1) * num_cols * cube.counts.dtype.itemsize
+    block = max(1, int(block_bytes // row_bytes))
+
+    cells = [np.flatnonzero(np.any(cube.counts[:, start:start + block], axis = 0)) + start * num_cols
+             for start in range(0, num_rows, block)]
+
+    return np.concatenate(cells) if cells else np.zeros(0, dtype = np.intp)
+
+
+# The counts of cells (flat indices) as a matrix of seasons x cells, read from
+# the cube.
+def season_counts(cube, cells):
+
+    num_rows, num_cols = cube.grid.shape
+
+    return np.asarray(cube.counts[:, cells // num_cols, cells % num_cols])
+
+
+# Weights of num_draws bootstrap draws of num_years seasons each: entry
+# (i, j) is how many times season j was picked in draw i.
+def draw_weights(num_years, num_draws, seed = 0):
+
+    rng = np.random.default_rng(seed)
+
+    return rng.multinomial(num_years, np.full(num_years, 1 / num_years), size = num_draws).astype(np.float64)
+
+
+# The rate and exceedance probability of a chunk of cells (columns of counts)
+# for the seasons as they happened, and the bootstrap quantiles of the rate,
+# exceedance probability and return period. The return period falls as the
+# exceedance probability rises, so its q quantile comes from the 1 - q
+# quantile of the exceedance probability.
+def _chunk_quantiles(counts, weights, threshold, quantiles):
+
+    num_years = weights[0].sum()
+    exceeded = (counts >= threshold).astype(np.float64)
+
+    rates = weights @ counts.astype(np.float64) / num_years
+    rate_q = np.quantile(rates, quantiles, axis = 0)
+    del rates
+
+    exceeds = weights @ exceeded / num_years
+    exceed_q = np.quantile(exceeds, quantiles, axis = 0)
+    with np.errstate(divide = 'ignore'):
+        return_period_q = 1 / np.quantile(exceeds, 1 - quantiles, axis = 0)
+
+    return counts.mean(axis = 0), exceeded.mean(axis = 0), rate_q, exceed_q, return_period_q
+
+
+def _to_grid(values, cells, grid, fill = 0.0):
+
+    full = np.full(values.shape[:-1] + (grid.size,), fill)
+    full[..., cells] = values
+
+    return full.reshape(values.shape[:-1] + grid.shape)
+
+
+# Bootstrap return periods from cube (a frequency_cube by season year, built
+# with cube_kwargs, e.g. hu_only or grid, if not given). num_draws sets of
+# seasons are drawn (seeded by seed) and the quantiles of each statistic
+# across the draws are returned alongside its value for the seasons as they
+# happened. threshold is the number of storms a season needs to bring to a
+# cell to count towards the exceedance probability. chunk_bytes bounds the
+# memory used per chunk of cells, and workers spreads the chunks across
+# processes.
+def bootstrap_return_periods(cube = None, num_draws = 1000, threshold = 1, quantiles = (0.05, 0.5, 0.95), seed = 0, chunk_bytes = 64 * 2**20, workers = 1, **cube_kwargs):
+    lap = ins.laps("return_periods")
+
+    if cube is None:
+        cube = fcb.frequency_cube(by = 'year', **cube_kwargs)
+        lap("cube", slices = len(cube.labels))
+
+    if cube.by != 'year':
+        raise ValueError("Return periods need a cube sliced by season year")
+
+    num_years = len(cube.labels)
+    quantiles = np.asarray(quantiles, dtype = float)
+
+    cells = season_cells(cube, chunk_bytes)
+    lap("cells", cells = len(cells))
+
+    weights = draw_weights(num_years, num_draws, seed)
+
+    # Each chunk holds its draws x chunk matrix of bootstrap rates (and then
+    # exceedance probabilities) plus the copy np.quantile sorts, alongside
+    # the seasons x chunk counts; the weights are shared by every chunk.
+    chunk = max(1, int(chunk_bytes // (8 * (2 * max(num_draws, 1) + 2 * max(num_years, 1)))))
+    chunks = [cells[start:start + chunk] for start in range(0, len(cells), chunk)]
+
+    if workers > 1 and len(chunks) > 1:
+        # Only a couple of chunks per worker are read from the cube ahead of
+        # being worked on.
+        results = [None] * len(chunks)
+        with fq._process_pool(workers) as pool:
+            pending = {}
+            for i, part in enumerate(chunks):
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when = FIRST_COMPLETED)
+                    for future in done:
+                        results[pending.pop(future)] = future.result()
+                pending[pool.submit(_chunk_quantiles, season_counts(cube, part), weights, threshold, quantiles)] = i
+            for future in pending:
+                results[pending[future]] = future.result()
+    else:
+        results = [_chunk_quantiles(season_counts(cube, part), weights, threshold, quantiles) for part in chunks]
+
+    if results:
+        rate, exceedance, rate_q, exceed_q, return_period_q = [np.concatenate([result[i] for result in results], axis = -1) for i in range(5)]
+    else:
+        rate = exceedance = np.zeros(0)
+        rate_q = exceed_q = return_period_q = np.zeros((len(quantiles), 0))
+    lap("bootstrap", draws = num_draws, cells = len(cells), chunks = len(chunks))
+
+    with np.errstate(divide = 'ignore'):
+        return_period = 1 / exceedance
+
+    grid = cube.grid
+
+    return ReturnPeriods(grid, cube.labels, threshold, quantiles, num_draws,
+                         _to_grid(rate, cells, grid), _to_grid(rate_q, cells, grid),
+                         _to_grid(exceedance, cells, grid), _to_grid(exceed_q, cells, grid),
+                         _to_grid(return_period, cells, grid, np.inf), _to_grid(return_period_q, cells, grid, np.inf))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import swath as sw
+
+# Purpose of module: to rasterize the tropical storm and hurricane wind
+# extents of storm positions onto the grids used by frequency and
+# wind_history, with all of the trigonometry done as numpy array operations.
+
+# For every position, the winds in each quadrant are traced out by finding
+# the destination point at the quadrant's wind extent along 31 bearings, then
+# filling the column of cells between the center and that destination point.
+# Doing this for every position of a storm (or of many storms) at once gives
+# exactly the same cells as stepping through the bearings one at a time.
+
+# The cells can be worked out by one of several backends, picked per call:
+#  - 'numpy': the array code in this module (the default)
+#  - 'python': the same steps one position, quadrant and bearing at a time
+#    with the math module, kept as the reference the others are checked
+#    against (see benchmarks/bench_backends.py)
+#  - 'numba': a compiled kernel doing the trigonometry, the skipping of
+#    missing extents and the filling of cells in one loop, spread over
+#    threads (swath_numba; needs numba to be installed)
+# The 'python' and 'numba' backends both use the C math library and give the
+# same cells in the same order. numpy's own trigonometry can differ from it
+# in the last bit, which only moves a cell where a destination point falls
+# exactly on a cell edge: this never happens on the 1 and 0.5 degree grids
+# for the bundled data, but does for a handful of cells on 0.1 degree grids.
+
+import math as m
+import numpy as np
+from src.d00_utils import instrument as ins
+from src.d03_processing import grids as grd
+
+
+# Radius of the Earth in nautical miles, the unit of the HURDAT wind extents.
+RADIUS = 3440.1
+
+# Bearings (in degrees) traced for each quadrant; one row per quadrant in the
+# HURDAT order NE, SE, SW, NW.
+BEARINGS = np.array([np.linspace(0, 90, 31),
+                     np.linspace(90, 180, 31),
+                     np.linspace(180, 270, 31),
+                     np.linspace(270, 360, 31)])
+
+# In the northern quadrants (NE, NW) cells are filled from the center up to
+# the destination point, in the southern quadrants from the destination point
+# up to the center.
+NORTHERN = np.array([True, False, False, True])
+
+# Wind extents of -999 mean the extent was not recorded.
+MISSING = -999
+
+# Wind extent columns of the positions table for each quadrant (NE, SE, SW,
+# NW), for tropical storm (34 kt) and hurricane (64 kt) winds.
+TS_COLUMNS = ['extNE34', 'extSE34', 'extSW34', 'extNW34']
+HU_COLUMNS = ['extNE64', 'extSE64', 'extSW64', 'extNW64']
+
+# Statuses for which tropical storm and hurricane winds are drawn.
+TS_STATUSES = [' TS', ' HU']
+HU_STATUSES = [' HU']
+
+BACKENDS = ['numpy', 'python', 'numba']
+
+# Where each backend's trigonometry comes from; backends with the same math
+# put the winds in the same cells.
+BACKEND_MATH = {'numpy': 'numpy', 'python': 'libm', 'numba': 'libm'}
+
+
+# Find the destination points for every position and bearing at once.
+# lats and lons have one entry per position and extents has one row per
+# position with the four quadrant extents (in nautical miles). Returns arrays
+# of destination latitudes and longitudes shaped (positions, 4, 31).
+def destination_points(lats, lons, extents):
+
+    # Line the arrays up as (position, quadrant, bearing) so that numpy
+    # broadcasts every combination.
+    rlat = np.asarray(lats, dtype = float)[:, None, None] * (m.pi/180)
+    rlon = np.asarray(lons, dtype = float)[:, None, None] * (m.pi/180)
+    dist = np.asarray(extents, dtype = float)[:, :, None] / RADIUS
+    brng = BEARINGS[None, :, :] * (m.pi/180)
+
+    # The terms are kept in the same order as the scalar formula so that the
+    # results (and therefore the cells they fall in) are identical.
+    dlat = np.arcsin(np.sin(rlat)*np.cos(dist) + np.cos(rlat)*np.sin(dist)*np.cos(brng))
+    dlon = rlon + np.arctan2(np.sin(brng)*np.sin(dist)*np.cos(rlat), np.cos(dist)-np.sin(rlat)*np.sin(dlat))
+
+    dlat *= (180/m.pi)
+    dlon *= (180/m.pi)
+
+    # Wrap longitudes back into [-180, 180].
+    dlon = np.where(dlon < -180, dlon + 360, dlon)
+    dlon = np.where(dlon > 180, dlon - 360, dlon)
+
+    return dlat, dlon
+
+
+# Turn the destination points into the cells of grid they cover. Returns the
+# row and column of every cell, along with the index of the position it came
+# from so that cells can be handed back to the storm they belong to. Cells
+# outside of the grid are left out, except that longitudes wrap around on
+# grids that cover the whole globe.
+def column_cells(lats, dlat, dlon, grid = grd.GLOBAL):
+
+    lat = np.asarray(lats, dtype = float)[:, None, None]
+    northern = NORTHERN[None, :, None]
+
+    scale = grid.cells_per_degree
+    row0, col0 = grid.origin
+    num_rows, num_cols = grid.shape
+
+    # First and last (exclusive) row of each column, clipped to the grid.
+    # On the 1 degree global grid these are exactly 90 + floor(lat) and
+    # 90 + ceil(dlat) (or the other way around for the southern quadrants).
+    start = np.where(northern, np.floor(lat*scale), np.floor(dlat*scale)).astype(np.intp) - row0
+    stop = np.where(northern, np.ceil(dlat*scale), np.ceil(lat*scale)).astype(np.intp) - row0
+    start = np.clip(start, 0, num_rows)
+    stop = np.clip(stop, 0, num_rows)
+
+    col = (np.floor(dlon*scale).astype(np.intp) - col0) % int(round(360*scale))
+    outside = col >= num_cols
+
+    # Expand every column into its individual cells.
+    lengths = np.where(outside, 0, np.clip(stop - start, 0, None)).ravel()
+    total = lengths.sum()
+    firsts = np.cumsum(lengths) - lengths
+    rows = np.repeat(start.ravel(), lengths) + (np.arange(total) - np.repeat(firsts, lengths))
+    cols = np.repeat(col.ravel(), lengths)
+
+    # Each position contributes 4 * 31 columns.
+    position = np.repeat(np.arange(len(lat)).repeat(BEARINGS.size), lengths)
+
+    return rows, cols, position
+
+
+# Convert rows and columns of grid to flat indices into the grid.
+def flat_cells(rows, cols, grid = grd.GLOBAL):
+    return rows * grid.shape[1] + cols
+
+
+# Flag the positions that should be drawn: the position must have a status in
+# statuses and must have all of its tropical storm and hurricane extents.
+# missing, if given, already flags the positions missing any extents (as
+# track_store.missing does).
+def drawable(status, ts_ext, hu_ext, statuses, missing = None):
+
+    if missing is None:
+        missing = (np.asarray(ts_ext) == MISSING).any(axis = 1) | (np.asarray(hu_ext) == MISSING).any(axis = 1)
+
+    return ~np.asarray(missing) & np.isin(np.asarray(status), statuses)
+
+
+# The 'python' backend: rows, columns and position index of the cells
+# covered by each position's extents, one bearing at a time, in the same
+# order as destination_points and column_cells produce them.
+def _python_cells(lats, lons, extents, grid = grd.GLOBAL):
+
+    scale = grid.cells_per_degree
+    row0, col0 = grid.origin
+    num_rows, num_cols = grid.shape
+    around = int(round(360*scale))
+
+    rows, cols, position = [], [], []
+
+    for x in range(len(lats)):
+
+        lat = float(lats[x])
+        rlat = lat*(m.pi/180)
+        rlon = float(lons[x])*(m.pi/180)
+
+        for quad in range(4):
+
+            dist = float(extents[x][quad]) / RADIUS
+
+            for i in BEARINGS[quad]:
+                brng = i * (m.pi/180)
+                dlat = m.asin(m.sin(rlat)*m.cos(dist) + m.cos(rlat)*m.sin(dist)*m.cos(brng))
+                dlon = rlon + m.atan2(m.sin(brng)*m.sin(dist)*m.cos(rlat), m.cos(dist)-m.sin(rlat)*m.sin(dlat))
+
+                dlat *= (180/m.pi)
+                dlon *= (180/m.pi)
+                if dlon < -180:
+                    dlon += 360
+                if dlon > 180:
+                    dlon -= 360
+
+                if NORTHERN[quad]:
+                    start, stop = m.floor(lat*scale), m.ceil(dlat*scale)
+                else:
+                    start, stop = m.floor(dlat*scale), m.ceil(lat*scale)
+                start = min(max(start - row0, 0), num_rows)
+                stop = min(max(stop - row0, 0), num_rows)
+
+                col = (m.floor(dlon*scale) - col0) % around
+                if col >= num_cols:
+                    continue
+
+                for y in range(start, stop):
+                    rows.append(y)
+                    cols.append(col)
+                    position.append(x)
+
+    return np.array(rows, dtype = np.intp), np.array(cols, dtype = np.intp), np.array(position, dtype = np.intp)
+
+
+# The function computing swath_cells' cells for backends other than 'numpy'.
+def _backend_cells(backend):
+
+    if backend == 'python':
+        return _python_cells
+    if backend == 'numba':
+        from src.d03_processing import swath_numba as swn
+        return swn.swath_cells
+
+    raise ValueError(f"Unknown swath backend: {backend}")
+
+
+# Rasterize the wind extents for a set of positions onto grid. Returns the
+# rows, columns and position index of every cell covered by the extents.
+# backend picks the code doing the work (see above).
+def swath_cells(lats, lons, extents, grid = grd.GLOBAL, backend = 'numpy'):
+
+    cells = None if backend == 'numpy' else _backend_cells(backend)
+
+    lats = np.asarray(lats, dtype = float)
+    lons = np.asarray(lons, dtype = float)
+    extents = np.asarray(extents, dtype = float).reshape(-1, 4)
+
+    # On regional grids, skip positions whose winds can't reach the grid's
+    # latitudes, so the cost follows the size of the region. reach is the
+    # largest extent in degrees of latitude, plus a cell to spare.
+    reach = extents.max(axis = 1, initial = 0) / RADIUS * (180/m.pi) + grid.resolution
+    near = np.flatnonzero((lats + reach >= grid.lat_min) & (lats - reach <= grid.lat_max))
+
+    if len(near) == 0:
+        empty = np.zeros(0, dtype = np.intp)
+        return empty, empty, empty
+
+    lap = ins.laps("swath")
+
+    if cells is None:
+        dlat, dlon = destination_points(lats[near], lons[near], extents[near])
+        lap("trigonometry", positions = len(near))
+        rows, cols, position = column_cells(lats[near], dlat, dlon, grid)
+        lap("fill", cells_touched = len(rows))
+    else:
+        rows, cols, position = cells(lats[near], lons[near], extents[near], grid)
+        lap(backend, positions = len(near), cells_touched = len(rows))
+
+    return rows, cols, near[position]
+
+
+# Rasterize a single storm onto a fresh grid, with 1 marking tropical storm
+# winds and 2 marking hurricane winds. Set ts or hu to False to leave out
+# either set of winds.
+def storm_grid(lats, lons, status, ts_ext, hu_ext, ts = True, hu = True, grid = grd.GLOBAL, backend = 'numpy'):
+
+    lats = np.asarray(lats, dtype = float)
+    lons = np.asarray(lons, dtype = float)
+    ts_ext = np.asarray(ts_ext, dtype = float).reshape(-1, 4)
+    hu_ext = np.asarray(hu_ext, dtype = float).reshape(-1, 4)
+
+    # The compiled kernel fills the grid itself, checking the extents as it
+    # goes.
+    if backend == 'numba':
+        from src.d03_processing import swath_numba as swn
+        return swn.storm_grid(lats, lons, np.isin(np.asarray(status), TS_STATUSES), np.isin(np.asarray(status), HU_STATUSES),
+                              ts_ext, hu_ext, ts, hu, grid)
+
+    history = np.zeros(grid.shape)
+
+    # Tropical storm winds go down first so that hurricane winds overwrite
+    # them, matching the cell-by-cell "only if not already 2" rule.
+    if ts:
+        draw = drawable(status, ts_ext, hu_ext, TS_STATUSES)
+        rows, cols, _ = swath_cells(lats[draw], lons[draw], ts_ext[draw], grid, backend)
+        history[rows, cols] = 1
+
+    if hu:
+        draw = drawable(status, ts_ext, hu_ext, HU_STATUSES)
+        rows, cols, _ = swath_cells(lats[draw], lons[draw], hu_ext[draw], grid, backend)
+        history[rows, cols] = 2
+
+    return history
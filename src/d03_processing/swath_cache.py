@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import swath_cache as swc
+
+# Purpose of module: to rasterize each storm's wind extents once and keep the
+# result, so that frequency grids over any subset of storms (by decade, by
+# month formed, TS or hurricane winds) are just sums of stored footprints.
+
+# A storm's footprint is the pair of sorted flat cell indices covered by its
+# tropical storm winds and by its hurricane winds. Footprints are kept in an
+# in-memory LRU and as small .npz files on disk, keyed by stormID plus a hash
+# of everything that goes into the rasterization (the storm's positions and
+# extents, the grid, the version of the rasterizer and the math its backend
+# uses). A revised storm, a different grid or a backend that can put cells
+# elsewhere therefore gets a new key instead of a stale footprint.
+
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+from src.d02_intermediate import hurdat_cache as hc
+from src.d02_intermediate import track_store as tst
+from src.d03_processing import grids as grd
+from src.d03_processing import swath as sw
+from src.d07_visualization import storm_tracks as trk
+
+
+CACHE_DIR = '../data/03_processed/swath_cache'
+
+# Increase this whenever a change to swath would move any cells, so that
+# footprints rasterized by older code are no longer found.
+ENGINE_VERSION = 1
+
+# Most footprints kept in memory and on disk; the least recently used are
+# dropped first.
+MEMORY_LIMIT = 5000
+DISK_LIMIT = 50000
+
+_MEMORY = OrderedDict()
+
+
+# Everything the rasterizer needs from positions_df, one row per position:
+# lat, lon, the four TS extents, the four HU extents and whether TS and HU
+# winds are drawn for the position. positions_df can also be a
+# track_store.TrackStore.
+def footprint_table(positions_df):
+
+    status = tst.column(positions_df, 'status')
+    ts_ext = tst.columns(positions_df, sw.TS_COLUMNS)
+    hu_ext = tst.columns(positions_df, sw.HU_COLUMNS)
+    missing = tst.missing(positions_df)
+
+    return np.column_stack([tst.column(positions_df, 'lat').astype(float),
+                            tst.column(positions_df, 'lon').astype(float),
+                            ts_ext,
+                            hu_ext,
+                            sw.drawable(status, ts_ext, hu_ext, sw.TS_STATUSES, missing),
+                            sw.drawable(status, ts_ext, hu_ext, sw.HU_STATUSES, missing)])
+
+
+# Cache key for a storm on grid, given its rows of the footprint table.
+# Backends share footprints only if they use the same math (see swath).
+def footprint_key(stormID, storm_table, grid = grd.GLOBAL, backend = 'numpy'):
+
+    if backend not in sw.BACKEND_MATH:
+        raise ValueError(f"Unknown swath backend: {backend}")
+
+    digest = hashlib.blake2b(digest_size = 12)
+    digest.update(f"{ENGINE_VERSION}:{grid.key()}:{sw.BACKEND_MATH[backend]}".encode())
+    digest.update(np.ascontiguousarray(storm_table).tobytes())
+
+    return f"{stormID}-{digest.hexdigest()}"
+
+
+# Rasterize the footprints of several storms on grid in one pass.
+# storm_tables is a list with the footprint table rows of each storm.
+def _rasterize(storm_tables, grid, backend = 'numpy'):
+
+    table = np.concatenate(storm_tables)
+    owner = np.repeat(np.arange(len(storm_tables)), [len(rows) for rows in storm_tables])
+
+    footprints = [[None, None] for i in range(len(storm_tables))]
+
+    # TS winds use extent columns 2-5 and flag 10, HU winds 6-9 and flag 11.
+    for which, extents, flag in [(0, slice(2, 6), 10), (1, slice(6, 10), 11)]:
+        draw = table[:, flag] == 1
+
+        rows, cols, position = sw.swath_cells(table[draw, 0], table[draw, 1], table[draw, extents], grid, backend)
+        cells = sw.flat_cells(rows, cols, grid)
+        cell_owner = owner[draw][position]
+
+        bounds = np.searchsorted(cell_owner, np.arange(len(storm_tables) + 1))
+
+        for i in range(len(storm_tables)):
+            footprints[i][which] = np.unique(cells[bounds[i]:bounds[i + 1]]).astype(np.uint32)
+
+    return [tuple(footprint) for footprint in footprints]
+
+
+def _disk_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.npz")
+
+def _read_disk(key):
+
+    path = _disk_path(key)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as stored:
+        footprint = (stored['ts'], stored['hu'])
+
+    # Touch the file so it counts as recently used.
+    os.utime(path)
+
+    return footprint
+
+def _write_disk(key, footprint):
+
+    os.makedirs(CACHE_DIR, exist_ok = True)
+
+    # Write under a temporary name of its own first so that another process
+    # never reads a half-written file, even if it's writing the same
+    # footprint at the same time.
+    fd, tmp_path = tempfile.mkstemp(suffix = ".tmp", dir = CACHE_DIR)
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            np.savez(tmp, ts = footprint[0], hu = footprint[1])
+        os.replace(tmp_path, _disk_path(key))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Remove the least recently used files once there are more than DISK_LIMIT.
+def _prune_disk():
+
+    entries = [entry for entry in os.scandir(CACHE_DIR) if entry.name.endswith(".npz")]
+    if len(entries) <= DISK_LIMIT:
+        return
+
+    entries.sort(key = lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - DISK_LIMIT]:
+        os.remove(entry.path)
+
+
+def _remember(key, footprint):
+
+    _MEMORY[key] = footprint
+    _MEMORY.move_to_end(key)
+
+    while len(_MEMORY) > MEMORY_LIMIT:
+        _MEMORY.popitem(last = False)
+
+
+# Footprints on grid for each storm in stormlist, as (ts_cells, hu_cells)
+# pairs.
+# Footprints are looked up in memory, then on disk (unless disk is False),
+# and any still missing are rasterized together and stored, by backend (see
+# swath). Backends using the same math share footprints; numpy's can put a
+# few cells elsewhere on fine grids, so its footprints are kept apart.
+def footprints(stormlist, positions_df = None, disk = True, grid = grd.GLOBAL, backend = 'numpy'):
+
+    if positions_df is None:
+        positions_df = hc.positions()
+
+    table = footprint_table(positions_df)
+
+    keys = []
+    found = {}
+    missing = OrderedDict()
+
+    for stormID in stormlist:
+        storm_table = table[trk.storm_rows(stormID, positions_df)]
+        key = footprint_key(stormID, storm_table, grid, backend)
+        keys.append(key)
+
+        if key in found or key in missing:
+            continue
+
+        if key in _MEMORY:
+            _MEMORY.move_to_end(key)
+            found[key] = _MEMORY[key]
+            continue
+
+        footprint = _read_disk(key) if disk else None
+        if footprint is None:
+            missing[key] = storm_table
+        else:
+            _remember(key, footprint)
+            found[key] = footprint
+
+    if missing:
+        for key, footprint in zip(missing, _rasterize(list(missing.values()), grid, backend)):
+            _remember(key, footprint)
+            found[key] = footprint
+            if disk:
+                _write_disk(key, footprint)
+        if disk:
+            _prune_disk()
+
+    return [found[key] for key in keys]
+
+
+# Frequency grid for the storms in stormlist built from their cached
+# footprints; the same as frequency.wind_frequency with the same arguments.
+# With sparse = True a grids.SparseGrid is returned instead of an array.
+def cached_frequency(stormlist, positions_df = None, hu_only = False, disk = True, grid = grd.GLOBAL, sparse = False, backend = 'numpy'):
+
+    which, value = (1, 2) if hu_only else (0, 1)
+
+    cells = [footprint[which] for footprint in footprints(stormlist, positions_df, disk = disk, grid = grid, backend = backend)]
+    cells = np.concatenate(cells) if cells else np.zeros(0, dtype = np.uint32)
+
+    frequencies = grd.count_cells(cells.astype(np.int64), grid, value)
+
+    if sparse:
+        return frequencies
+
+    return grd.dense(frequencies)
+
+
+# Wind history grid for one storm (1 for TS winds, 2 for hurricane winds)
+# built from its cached footprint.
+def cached_storm_grid(stormID, positions_df = None, disk = True, grid = grd.GLOBAL, backend = 'numpy'):
+
+    ts_cells, hu_cells = footprints([stormID], positions_df, disk = disk, grid = grid, backend = backend)[0]
+
+    history = np.zeros(grid.shape)
+    history.flat[ts_cells] = 1
+    history.flat[hu_cells] = 2
+
+    return history
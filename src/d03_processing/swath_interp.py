@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import swath_interp as swi
+
+# Purpose of module: a second way of rasterizing wind extents, which covers
+# the winds between the 6-hourly fixes as well as at them.
+
+# The rasterizer in swath only looks at the fixes themselves, filling a
+# column of cells along each of 31 bearings per quadrant. On fine grids this
+# leaves gaps between the bearings and between one fix and the next. Here the
+# winds at each fix are treated as a polygon (the destination points along
+# the bearings, joined up), and between two consecutive fixes the center and
+# the quadrant extents move linearly from one fix to the next, so each vertex
+# of the polygon moves along a straight line. The area swept out is then
+# filled row by row: in each row of cells it runs from the leftmost to the
+# rightmost point where the row's center line crosses the polygon at either
+# fix or the path of one of its vertices. A cell counts if its center is
+# inside, so the covered area tends to the true swept area as the grid gets
+# finer, and the work follows the number of rows and cells covered rather
+# than the number of bearings.
+
+import math as m
+import numpy as np
+from src.d03_processing import grids as grd
+from src.d03_processing import swath as sw
+
+
+# Destination points around each position as polygons, one row of vertices
+# per position going clockwise from north. Longitudes are unwrapped to within
+# 180 degrees of ref_lons (each position's own longitude by default) so that
+# polygons crossing the antimeridian stay in one piece.
+def wind_polygons(lats, lons, extents, ref_lons = None):
+
+    lons = np.asarray(lons, dtype = float)
+    if ref_lons is None:
+        ref_lons = lons
+
+    dlat, dlon = sw.destination_points(lats, lons, extents)
+    dlat = dlat.reshape(len(lons), -1)
+    dlon = dlon.reshape(len(lons), -1)
+
+    ref = np.asarray(ref_lons, dtype = float)[:, None]
+    dlon = ref + ((dlon - ref + 180) % 360 - 180)
+
+    return dlat, dlon
+
+
+# Scanline fill of shapes given as a set of line segments (edges) each, from
+# (y0, x0) to (y1, x1) in degrees of latitude and longitude, where shape says
+# which shape each edge belongs to. Each row of a shape is filled from the
+# leftmost to the rightmost crossing of its edges with the row's center line,
+# which is exact for shapes that are never more than one span wide (like the
+# wind polygons and the area they sweep out). Returns the row and column
+# (counted from 0 degrees, in cells of the grid's size) of every cell whose
+# center is inside a shape, and the shape it's in.
+def fill_outlines(y0, x0, y1, x1, shape, num_shapes, grid = grd.GLOBAL):
+
+    scale = grid.cells_per_degree
+
+    # Rows whose centers each edge crosses, counting an edge at its lower
+    # end but not its upper end.
+    first = np.ceil(np.minimum(y0, y1)*scale - 0.5).astype(np.intp)
+    stop = np.ceil(np.maximum(y0, y1)*scale - 0.5).astype(np.intp)
+    lengths = np.clip(stop - first, 0, None)
+
+    # Range of rows of each shape, giving every row of every shape a slot.
+    shape_first = np.full(num_shapes, np.iinfo(np.intp).max)
+    shape_stop = np.full(num_shapes, np.iinfo(np.intp).min)
+    np.minimum.at(shape_first, shape, first)
+    np.maximum.at(shape_stop, shape, stop)
+    shape_rows = np.clip(shape_stop - shape_first, 0, None)
+    offsets = np.cumsum(shape_rows) - shape_rows
+
+    # Where each edge crosses each row's center line.
+    edge = np.repeat(np.arange(len(y0)), lengths)
+    rows = np.repeat(first, lengths) + (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+    center = (rows + 0.5) / scale
+    x = x0[edge] + (center - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+
+    # Leftmost and rightmost crossing in each slot.
+    slot = offsets[shape[edge]] + rows - shape_first[shape[edge]]
+    left = np.full(shape_rows.sum(), np.inf)
+    right = np.full(shape_rows.sum(), -np.inf)
+    np.minimum.at(left, slot, x)
+    np.maximum.at(right, slot, x)
+
+    slot_rows = np.repeat(shape_first, shape_rows) + (np.arange(len(left)) - np.repeat(offsets, shape_rows))
+    slot_shape = np.repeat(np.arange(num_shapes), shape_rows)
+
+    crossed = np.isfinite(left)
+    slot_rows, slot_shape, left, right = slot_rows[crossed], slot_shape[crossed], left[crossed], right[crossed]
+
+    # Expand each span into its individual cells.
+    starts = np.ceil(left*scale - 0.5).astype(np.intp)
+    lengths = np.clip(np.ceil(right*scale - 0.5).astype(np.intp) - starts, 0, None)
+    cols = np.repeat(starts, lengths) + (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+
+    return np.repeat(slot_rows, lengths), cols, np.repeat(slot_shape, lengths)
+
+
+# The edges of each polygon (one row of vertices per polygon), as the
+# (y0, x0, y1, x1) arrays fill_outlines takes.
+def _polygon_edges(ys, xs):
+    return ys, xs, np.roll(ys, -1, axis = 1), np.roll(xs, -1, axis = 1)
+
+
+# Move rows and columns counted from 0 degrees onto grid, dropping those
+# outside it (longitudes wrap around on grids that cover the whole globe).
+def _on_grid(rows, cols, position, grid):
+
+    row0, col0 = grid.origin
+    num_rows, num_cols = grid.shape
+
+    rows = rows - row0
+    cols = (cols - col0) % int(round(360*grid.cells_per_degree))
+    inside = (rows >= 0) & (rows < num_rows) & (cols < num_cols)
+
+    return rows[inside], cols[inside], position[inside]
+
+
+# Rasterize the wind extents of a set of positions onto grid, interpolating
+# between consecutive fixes. draw flags the positions to draw (see
+# swath.drawable) and owner says which storm each position belongs to;
+# positions of a storm must be consecutive and in time order. The winds are
+# interpolated between two fixes only when both are drawn. Returns the rows,
+# columns and position index of every cell covered, ordered by position (for
+# the winds between two fixes, the index of the first).
+def swath_cells(lats, lons, extents, draw, owner, grid = grd.GLOBAL):
+
+    lats = np.asarray(lats, dtype = float)
+    lons = np.asarray(lons, dtype = float)
+    extents = np.asarray(extents, dtype = float).reshape(-1, 4)
+    draw = np.asarray(draw, dtype = bool)
+    owner = np.asarray(owner)
+
+    # As in swath.swath_cells, skip positions whose winds can't reach the
+    # grid's latitudes.
+    reach = extents.max(axis = 1, initial = 0) / sw.RADIUS * (180/m.pi) + grid.resolution
+    near = draw & (lats + reach >= grid.lat_min) & (lats - reach <= grid.lat_max)
+
+    pieces = []
+
+    # Winds are interpolated between two consecutive drawn fixes of a storm;
+    # a drawn fix with neither neighbour drawn is filled on its own.
+    starts = np.flatnonzero(draw[:-1] & draw[1:] & (owner[:-1] == owner[1:]) & (near[:-1] | near[1:]))
+    paired = np.zeros(len(draw), dtype = bool)
+    paired[starts] = True
+    paired[starts + 1] = True
+
+    # Fixes on their own.
+    alone = np.flatnonzero(near & ~paired)
+    if len(alone):
+        ys, xs = wind_polygons(lats[alone], lons[alone], extents[alone])
+        shape = np.repeat(np.arange(len(alone)), ys.shape[1])
+        rows, cols, filled = fill_outlines(*[edges.ravel() for edges in _polygon_edges(ys, xs)], shape, len(alone), grid)
+        pieces.append((rows, cols, alone[filled]))
+
+    # The area swept between each pair of fixes is outlined by the polygon
+    # at each fix and the straight path of each vertex from one to the other.
+    if len(starts):
+        ys0, xs0 = wind_polygons(lats[starts], lons[starts], extents[starts])
+        ys1, xs1 = wind_polygons(lats[starts + 1], lons[starts + 1], extents[starts + 1], ref_lons = lons[starts])
+
+        outline = [np.concatenate(parts, axis = 1).ravel() for parts in zip(_polygon_edges(ys0, xs0), _polygon_edges(ys1, xs1), (ys0, xs0, ys1, xs1))]
+        shape = np.repeat(np.arange(len(starts)), 3 * ys0.shape[1])
+
+        rows, cols, filled = fill_outlines(*outline, shape, len(starts), grid)
+        pieces.append((rows, cols, starts[filled]))
+
+    if not pieces:
+        empty = np.zeros(0, dtype = np.intp)
+        return empty, empty, empty
+
+    rows, cols, position = [np.concatenate(parts) for parts in zip(*pieces)]
+    rows, cols, position = _on_grid(rows, cols, position, grid)
+
+    order = np.argsort(position, kind = 'stable')
+
+    return rows[order], cols[order], position[order]
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import swath_numba as swn
+
+# Purpose of module: the 'numba' backend of swath, rasterizing wind extents
+# with kernels compiled by numba instead of with whole-array numpy
+# operations. Only imported when that backend is asked for, so numba is
+# only needed by code that uses it.
+
+# Each position's destination points are worked out and turned into columns
+# of cells in one loop, without the (positions, 4, 31) intermediate arrays,
+# and the positions are shared out between threads. swath_cells makes two
+# passes, one to size each column and one to write its cells, so the cells
+# come out in the same order as from the numpy backend. storm_grid also
+# skips positions with missing extents and fills the grid in the kernel,
+# tropical storm winds first and then hurricane winds over them.
+
+# The arithmetic follows swath.destination_points and swath.column_cells
+# term for term so that every backend puts the winds in the same cells.
+
+import math as m
+import numpy as np
+from numba import njit, prange
+from src.d03_processing import swath as sw
+from src.d03_processing import grids as grd
+
+
+RADIUS = sw.RADIUS
+MISSING = sw.MISSING
+
+
+# The first row (clipped to the grid), number of rows and column of the
+# cells between lat and the destination point at dist (in radians) along
+# brng (in degrees) from lat, lon. The number of rows is 0 if the column is
+# off the grid.
+@njit(cache = True)
+def _column(lat, lon, dist, brng, northern, scale, row0, col0, num_rows, num_cols, around):
+
+    rlat = lat*(m.pi/180)
+    rlon = lon*(m.pi/180)
+    brng = brng*(m.pi/180)
+
+    dlat = m.asin(m.sin(rlat)*m.cos(dist) + m.cos(rlat)*m.sin(dist)*m.cos(brng))
+    dlon = rlon + m.atan2(m.sin(brng)*m.sin(dist)*m.cos(rlat), m.cos(dist)-m.sin(rlat)*m.sin(dlat))
+
+    dlat *= (180/m.pi)
+    dlon *= (180/m.pi)
+    if dlon < -180:
+        dlon += 360
+    if dlon > 180:
+        dlon -= 360
+
+    if northern:
+        start, stop = int(m.floor(lat*scale)), int(m.ceil(dlat*scale))
+    else:
+        start, stop = int(m.floor(dlat*scale)), int(m.ceil(lat*scale))
+    start = min(max(start - row0, 0), num_rows)
+    stop = min(max(stop - row0, 0), num_rows)
+
+    col = (int(m.floor(dlon*scale)) - col0) % around
+    if col >= num_cols:
+        return start, 0, col
+
+    return start, max(stop - start, 0), col
+
+
+# First pass: the first row, number of rows and column of every column of
+# every position, shaped (positions, 4, 31).
+@njit(parallel = True, cache = True)
+def _columns(lats, lons, extents, bearings, northern, scale, row0, col0, num_rows, num_cols, around):
+
+    n, num_bearings = len(lats), bearings.shape[1]
+    starts = np.zeros((n, 4, num_bearings), dtype = np.intp)
+    lengths = np.zeros((n, 4, num_bearings), dtype = np.intp)
+    cols = np.zeros((n, 4, num_bearings), dtype = np.intp)
+
+    for x in prange(n):
+        for quad in range(4):
+            dist = extents[x, quad] / RADIUS
+            for i in range(num_bearings):
+                start, length, col = _column(lats[x], lons[x], dist, bearings[quad, i], northern[quad],
+                                             scale, row0, col0, num_rows, num_cols, around)
+                starts[x, quad, i] = start
+                lengths[x, quad, i] = length
+                cols[x, quad, i] = col
+
+    return starts, lengths, cols
+
+
+# Second pass: write out the cells of every column, the cells of the column
+# starting at firsts (the running total of lengths).
+@njit(parallel = True, cache = True)
+def _fill(starts, lengths, cols, firsts, total):
+
+    rows = np.empty(total, dtype = np.intp)
+    cell_cols = np.empty(total, dtype = np.intp)
+    position = np.empty(total, dtype = np.intp)
+
+    n, num_bearings = starts.shape[0], starts.shape[2]
+    for x in prange(n):
+        for quad in range(4):
+            for i in range(num_bearings):
+                first = firsts[x, quad, i]
+                for y in range(lengths[x, quad, i]):
+                    rows[first + y] = starts[x, quad, i] + y
+                    cell_cols[first + y] = cols[x, quad, i]
+                    position[first + y] = x
+
+    return rows, cell_cols, position
+
+
+# Fill one kind of winds into history with value, for the positions flagged
+# by draw that have all of their TS and HU extents.
+@njit(parallel = True, cache = True)
+def _fill_grid(history, lats, lons, draw, extents, ts_ext, hu_ext, value, bearings, northern, scale, row0, col0, num_rows, num_cols, around):
+
+    num_bearings = bearings.shape[1]
+
+    for x in prange(len(lats)):
+        if not draw[x]:
+            continue
+
+        missing = False
+        for quad in range(4):
+            if ts_ext[x, quad] == MISSING or hu_ext[x, quad] == MISSING:
+                missing = True
+        if missing:
+            continue
+
+        for quad in range(4):
+            dist = extents[x, quad] / RADIUS
+            for i in range(num_bearings):
+                start, length, col = _column(lats[x], lons[x], dist, bearings[quad, i], northern[quad],
+                                             scale, row0, col0, num_rows, num_cols, around)
+                # Every thread writes the same value, so cells shared by
+                # positions end up the same whichever thread writes last.
+                for y in range(start, start + length):
+                    history[y, col] = value
+
+
+def _grid_args(grid):
+
+    row0, col0 = grid.origin
+    num_rows, num_cols = grid.shape
+
+    return (sw.BEARINGS, sw.NORTHERN, float(grid.cells_per_degree), row0, col0, num_rows, num_cols, int(round(360*grid.cells_per_degree)))
+
+
+# Same as swath's numpy backend: the rows, columns and position index of
+# every cell covered by the extents of the positions.
+def swath_cells(lats, lons, extents, grid = grd.GLOBAL):
+
+    lats = np.ascontiguousarray(lats, dtype = float)
+    lons = np.ascontiguousarray(lons, dtype = float)
+    extents = np.ascontiguousarray(extents, dtype = float).reshape(-1, 4)
+
+    starts, lengths, cols = _columns(lats, lons, extents, *_grid_args(grid))
+
+    firsts = np.cumsum(lengths.ravel()).reshape(lengths.shape) - lengths
+    total = int(lengths.sum())
+
+    return _fill(starts, lengths, cols, firsts, total)
+
+
+# Same as swath.storm_grid, given the flags for whether each position's
+# status has TS and HU winds drawn.
+def storm_grid(lats, lons, ts_status, hu_status, ts_ext, hu_ext, ts = True, hu = True, grid = grd.GLOBAL):
+
+    history = np.zeros(grid.shape)
+
+    lats = np.ascontiguousarray(lats, dtype = float)
+    lons = np.ascontiguousarray(lons, dtype = float)
+    ts_ext = np.ascontiguousarray(ts_ext, dtype = float).reshape(-1, 4)
+    hu_ext = np.ascontiguousarray(hu_ext, dtype = float).reshape(-1, 4)
+
+    if ts:
+        _fill_grid(history, lats, lons, np.asarray(ts_status, dtype = np.bool_), ts_ext, ts_ext, hu_ext, 1.0, *_grid_args(grid))
+    if hu:
+        _fill_grid(history, lats, lons, np.asarray(hu_status, dtype = np.bool_), hu_ext, ts_ext, hu_ext, 2.0, *_grid_args(grid))
+
+    return history
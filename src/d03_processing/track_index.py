@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import track_index as tix
+
+# Purpose of module: to answer "which storms brought tropical storm or
+# hurricane winds to this place, and when?" without rasterizing any storms.
+
+# The fixes whose winds are drawn by frequency.wind_frequency (see
+# swath.drawable) are put in a table of buckets of bucket_size x
+# bucket_size degrees. Each fix goes in every bucket its tropical storm
+# winds could reach, so a query only has to look at the fixes listed under
+# the buckets it touches. Those candidates are then checked exactly against
+# the wind extent of the quadrant facing the point, as on the maps.
+
+import weakref
+from collections import namedtuple
+
+import math as m
+import numpy as np
+import pandas as pd
+from src.d02_intermediate import hurdat_cache as hc
+from src.d02_intermediate import track_store as tst
+from src.d03_processing import swath as sw
+
+
+# The bucket table: fixes lists the row of positions_df of every fix in
+# bucket order, with the fixes of bucket b at fixes[starts[b]:starts[b + 1]].
+# Buckets are numbered row by row from -90 latitude and -180 longitude.
+TrackIndex = namedtuple('TrackIndex', ['bucket_size', 'starts', 'fixes', 'lat', 'lon', 'ts_ext', 'hu_ext', 'ts_draw', 'hu_draw'])
+
+# Indices built by track_index, keyed by the id() of the positions DataFrame
+# and the bucket size, as with storm_tracks.storm_index.
+_INDICES = {}
+
+# Wind categories, in increasing order.
+CATEGORIES = ['TS', 'HU']
+
+
+def _nm_to_degrees(distance):
+    return np.asarray(distance) / sw.RADIUS * (180/m.pi)
+
+
+# Bucket rows and columns covering latitudes lat_low to lat_high and the
+# longitudes within lon_reach of lon, for arrays of each.
+def _bucket_ranges(lat_low, lat_high, lon, lon_reach, bucket_size):
+
+    num_rows, num_cols = int(round(180 / bucket_size)), int(round(360 / bucket_size))
+
+    row0 = np.clip(np.floor((lat_low + 90) / bucket_size), 0, num_rows - 1).astype(np.intp)
+    row1 = np.clip(np.floor((lat_high + 90) / bucket_size), 0, num_rows - 1).astype(np.intp)
+
+    # Reaching all the way around the globe covers every column.
+    lon_reach = np.minimum(lon_reach, 180)
+    col0 = np.floor((lon - lon_reach + 180) / bucket_size).astype(np.intp)
+    col1 = np.floor((lon + lon_reach + 180) / bucket_size).astype(np.intp)
+    col1 = np.minimum(col1, col0 + num_cols - 1)
+
+    return row0, row1, col0, col1
+
+
+# Expand bucket ranges into the bucket numbers they cover, along with the
+# index of the range each came from.
+def _expand_buckets(row0, row1, col0, col1, bucket_size):
+
+    num_cols = int(round(360 / bucket_size))
+
+    heights = row1 - row0 + 1
+    widths = col1 - col0 + 1
+    counts = heights * widths
+
+    owner = np.repeat(np.arange(len(counts)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = row0[owner] + k // widths[owner]
+    cols = (col0[owner] + k % widths[owner]) % num_cols
+
+    return rows * num_cols + cols, owner
+
+
+# Build (once per DataFrame and bucket size) the bucket table for
+# positions_df, which can also be a track_store.TrackStore.
+def track_index(positions_df = None, bucket_size = 5):
+    if positions_df is None:
+        positions_df = hc.positions()
+
+    store = isinstance(positions_df, tst.TrackStore)
+    length = len(positions_df.lat) if store else len(positions_df)
+
+    key = (id(positions_df), bucket_size)
+    if key in _INDICES:
+        ref, cached_length, index = _INDICES[key]
+        if ref() is positions_df and cached_length == length:
+            return index
+
+    status = tst.column(positions_df, 'status')
+    lat = tst.column(positions_df, 'lat').astype(float)
+    lon = tst.column(positions_df, 'lon').astype(float)
+    ts_ext = tst.columns(positions_df, sw.TS_COLUMNS)
+    hu_ext = tst.columns(positions_df, sw.HU_COLUMNS)
+    missing = tst.missing(positions_df)
+    ts_draw = sw.drawable(status, ts_ext, hu_ext, sw.TS_STATUSES, missing)
+    hu_draw = sw.drawable(status, ts_ext, hu_ext, sw.HU_STATUSES, missing)
+
+    # Tropical storm winds always reach at least as far as hurricane winds,
+    # so each fix is filed under the buckets its TS winds could reach.
+    drawn = np.flatnonzero(ts_draw)
+    reach = _nm_to_degrees(ts_ext[drawn].max(axis = 1))
+    lat_low, lat_high = lat[drawn] - reach, lat[drawn] + reach
+    widest = np.maximum(np.abs(lat_low), np.abs(lat_high))
+    with np.errstate(divide = 'ignore'):
+        lon_reach = np.where(widest < 89, reach / np.cos(np.radians(np.minimum(widest, 89))), 180)
+
+    buckets, owner = _expand_buckets(*_bucket_ranges(lat_low, lat_high, lon[drawn], lon_reach, bucket_size), bucket_size)
+
+    order = np.argsort(buckets, kind = 'stable')
+    num_buckets = int(round(180 / bucket_size)) * int(round(360 / bucket_size))
+    starts = np.searchsorted(buckets[order], np.arange(num_buckets + 1))
+
+    index = TrackIndex(bucket_size, starts, drawn[owner[order]], lat, lon, ts_ext, hu_ext, ts_draw, hu_draw)
+
+    # Stores (being tuples) can't be referred to weakly, so they're held on
+    # to, as track_store already holds on to them.
+    if store:
+        ref = lambda source = positions_df: source
+    else:
+        ref = weakref.ref(positions_df, lambda ref, key = key: _INDICES.pop(key, None))
+    _INDICES[key] = (ref, length, index)
+
+    return index
+
+
+# Rows of every fix filed under the buckets covering the given latitudes and
+# longitudes (lon to lon + width).
+def _candidates(index, lat_low, lat_high, lon_low, lon_high):
+
+    lat_low, lat_high = max(lat_low, -90), min(lat_high, 90)
+    middle = (lon_low + lon_high) / 2
+
+    ranges = _bucket_ranges(np.array([lat_low]), np.array([lat_high]), np.array([middle]), np.array([(lon_high - lon_low) / 2]), index.bucket_size)
+    buckets, _ = _expand_buckets(*ranges, index.bucket_size)
+
+    pieces = [index.fixes[index.starts[bucket]:index.starts[bucket + 1]] for bucket in buckets]
+    if not pieces:
+        return np.zeros(0, dtype = np.intp)
+
+    return np.unique(np.concatenate(pieces))
+
+
+# Great circle distance (in nautical miles) and initial bearing (in degrees)
+# from each fix to the point lat, lon.
+def _distance_bearing(fix_lat, fix_lon, lat, lon):
+
+    rlat1, rlat2 = np.radians(fix_lat), np.radians(lat)
+    dlon = np.radians(lon - fix_lon)
+
+    a = np.sin((rlat2 - rlat1)/2)**2 + np.cos(rlat1)*np.cos(rlat2)*np.sin(dlon/2)**2
+    distance = 2 * sw.RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    bearing = np.degrees(np.arctan2(np.sin(dlon)*np.cos(rlat2), np.cos(rlat1)*np.sin(rlat2) - np.sin(rlat1)*np.cos(rlat2)*np.cos(dlon)))
+
+    return distance, bearing % 360
+
+
+# For the fixes in rows, whether the point lat, lon is inside their tropical
+# storm and hurricane winds (the extent of the quadrant the point is in, plus
+# buffer nautical miles), and how far it is from the center.
+def _winds_at(index, rows, lat, lon, buffer = 0):
+
+    distance, bearing = _distance_bearing(index.lat[rows], index.lon[rows], lat, lon)
+    quadrant = np.minimum((bearing // 90).astype(np.intp), 3)
+
+    ts = index.ts_draw[rows] & (distance <= index.ts_ext[rows, quadrant] + buffer)
+    hu = index.hu_draw[rows] & (distance <= index.hu_ext[rows, quadrant] + buffer)
+
+    return ts, hu, distance
+
+
+# One row per fix in rows with the storm, the time of the fix and the
+# strongest winds (TS or HU) that reached the place asked about.
+def _hits(positions_df, rows, hu, distance = None):
+
+    # Strings are taken from the distinct values of each column rather than
+    # converted row by row.
+    def strings(column):
+        codes, uniques = pd.factorize(tst.column(positions_df, column, rows))
+        return np.asarray([str(value).strip() for value in uniques], dtype = object)[codes]
+
+    # Times are HHMM; not every fix is on the hour (landfalls, peaks).
+    hhmm = np.array([int(time or 0) for time in strings('time')], dtype = np.int64)
+    minutes = ((hhmm // 100) * 60 + hhmm % 100).astype('timedelta64[m]')
+
+    hits = pd.DataFrame({'stormID': strings('stormID'),
+                         'name': strings('name'),
+                         'time': tst.column(positions_df, 'date', rows).astype('datetime64[ns]') + minutes,
+                         'status': strings('status'),
+                         'category': np.where(hu, 'HU', 'TS')})
+    if distance is not None:
+        hits['distance'] = distance
+
+    return hits.sort_values(['time', 'stormID'], kind = 'stable').reset_index(drop = True)
+
+
+# Every fix that brought tropical storm or hurricane winds to the point lat,
+# lon, or within buffer nautical miles of it (e.g. to cover a whole city).
+# Returns a DataFrame with the stormID, name and time of each fix, its
+# status, the category of winds (TS or HU) at the point and the distance
+# from the storm's center in nautical miles. positions_df can also be a
+# track_store.TrackStore.
+def point_query(lat, lon, buffer = 0, positions_df = None, bucket_size = 5):
+    if positions_df is None:
+        positions_df = hc.positions()
+
+    index = track_index(positions_df, bucket_size)
+
+    # Look in the buckets around the point, widened by the buffer.
+    pad = float(_nm_to_degrees(buffer))
+    lon_pad = pad / max(m.cos(m.radians(min(abs(lat) + pad, 89))), 1e-6)
+    rows = _candidates(index, lat - pad, lat + pad, lon - lon_pad, lon + lon_pad)
+
+    ts, hu, distance = _winds_at(index, rows, lat, lon, buffer)
+
+    return _hits(positions_df, rows[ts], hu[ts], distance[ts])
+
+
+# Every fix that brought tropical storm or hurricane winds to some part of
+# the box from lat_min to lat_max and lon_min to lon_max (lon_max may be past
+# 180 for boxes crossing the antimeridian). Returns the same columns as
+# point_query, without the distance.
+def box_query(lat_min, lat_max, lon_min, lon_max, positions_df = None, bucket_size = 5):
+    if positions_df is None:
+        positions_df = hc.positions()
+
+    index = track_index(positions_df, bucket_size)
+    rows = _candidates(index, lat_min, lat_max, lon_min, lon_max)
+
+    def in_box(lats, lons):
+        return (lats >= lat_min) & (lats <= lat_max) & ((lons - lon_min) % 360 <= lon_max - lon_min)
+
+    # The point of the box nearest each center (in degrees), which is where
+    # winds reaching in from outside the box would get to first.
+    width = lon_max - lon_min
+    offset = (index.lon[rows] - lon_min) % 360
+    offset = np.where(offset <= width, offset, np.where(offset - width < 360 - offset, width, 0))
+    nearest = [(np.clip(index.lat[rows], lat_min, lat_max), lon_min + offset)]
+    corners = [(lat_min, lon_min), (lat_min, lon_max), (lat_max, lon_min), (lat_max, lon_max)]
+
+    # The winds reach the box if the center is in it, if any point on the
+    # edge of the winds is in it, or if the nearest point or a corner of the
+    # box is in the winds.
+    def reaches(extents, draw):
+        inside = in_box(index.lat[rows], index.lon[rows])
+        for point_lat, point_lon in nearest + corners:
+            distance, bearing = _distance_bearing(index.lat[rows], index.lon[rows], point_lat, point_lon)
+            quadrant = np.minimum((bearing // 90).astype(np.intp), 3)
+            inside |= distance <= extents[rows, quadrant]
+        
+        # The destination points are only needed for the fixes still in doubt.
+        doubtful = np.flatnonzero(~inside & draw[rows])
+        dlat, dlon = sw.destination_points(index.lat[rows[doubtful]], index.lon[rows[doubtful]], extents[rows[doubtful]])
+        inside[doubtful] = in_box(dlat, dlon).any(axis = (1, 2))
+        
+        return inside & draw[rows]
+
+    ts = reaches(index.ts_ext, index.ts_draw)
+    hu = reaches(index.hu_ext, index.hu_draw)
+
+    return _hits(positions_df, rows[ts], hu[ts])
+
+
+# Summarize the fixes from point_query or box_query by storm: the first and
+# last time its winds were there and the strongest category of winds.
+def storms_affecting(hits):
+
+    strongest = hits['category'].map(CATEGORIES.index)
+
+    summary = hits.assign(strength = strongest).groupby('stormID', sort = False).agg(name = ('name', 'first'),
+                                                                                       first = ('time', 'min'),
+                                                                                       last = ('time', 'max'),
+                                                                                       fixes = ('time', 'size'),
+                                                                                       strength = ('strength', 'max'))
+    summary['category'] = [CATEGORIES[strength] for strength in summary['strength']]
+
+    return summary.drop(columns = 'strength').reset_index()
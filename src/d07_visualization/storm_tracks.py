@@ -10,80 +10,308 @@ Created on Fri Sep 11 10:30:12 2020
 
 
 import os, sys
-import cartopy
-import matplotlib.pyplot as plt
+import weakref
+from functools import lru_cache
 
 root_dir = os.path.join(os.getcwd(), "..")
 sys.path.append(root_dir)
 
-import pandas as pd
+import numpy as np
+from src.d02_intermediate import hurdat_cache as hc
+from src.d02_intermediate import track_store as tst
 
-PROJECTION = cartopy.crs.NearsidePerspective(central_longitude = -55, central_latitude = 30,  satellite_height = 10000000)
+# Map projection used for all of the plots. cartopy is only imported (and
+# the projection only built) when something is actually plotted.
+@lru_cache(maxsize = None)
+def projection():
+    import cartopy.crs as ccrs
+    return ccrs.NearsidePerspective(central_longitude = -55, central_latitude = 30,  satellite_height = 10000000)
 
-POSITIONS = pd.read_csv('../data/02_intermediate/Atlantic_positions.csv')
-STORMS = pd.read_csv('../data/02_intermediate/Atlantic_storms.csv')
+# POSITIONS, STORMS and PROJECTION used to be built at import time; they're
+# now looked up on first use, so importing the lookup functions alone never
+# loads the data or imports cartopy.
+def __getattr__(name):
+    if name == 'POSITIONS':
+        return hc.positions()
+    if name == 'STORMS':
+        return hc.storms()
+    if name == 'PROJECTION':
+        return projection()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def track_lat(stormID, positions_df = POSITIONS):
-    return(positions_df['lat'][positions_df['stormID'] == stormID].tolist())
+# Storm indices built by storm_index, keyed by the id() of the positions
+# DataFrame they were built from.
+_STORM_INDICES = {}
 
-def track_lon(stormID, positions_df = POSITIONS):
-    return(positions_df['lon'][positions_df['stormID'] == stormID].tolist())
+# Build (once per DataFrame) an index of which rows of positions_df belong to
+# each storm. The partitioned HURDAT data keeps each storm's positions
+# together, so this is normally just the first and last row of each storm,
+# stored as a slice; if a storm's rows are scattered, its row numbers are
+# stored instead. A track_store.TrackStore carries its own index.
+def storm_index(positions_df = None):
+    if positions_df is None:
+        positions_df = hc.positions()
+    if isinstance(positions_df, tst.TrackStore):
+        return positions_df.index
+    
+    key = id(positions_df)
+    
+    if key in _STORM_INDICES:
+        ref, length, index = _STORM_INDICES[key]
+        # Make sure the cached index belongs to this DataFrame and that rows
+        # haven't been added or removed since it was built.
+        if ref() is positions_df and length == len(positions_df):
+            return index
+    
+    ids = positions_df['stormID'].to_numpy()
+    
+    # Rows where a new storm begins.
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.zeros(0, dtype = int)
+    stops = np.r_[starts[1:], len(ids)]
+    
+    if len(set(ids[starts])) == len(starts):
+        index = {stormID: slice(start, stop) for stormID, start, stop in zip(ids[starts], starts, stops)}
+    else:
+        index = positions_df.groupby('stormID', sort = False, observed = True).indices
+    
+    # Drop the index when the DataFrame is garbage collected.
+    ref = weakref.ref(positions_df, lambda ref, key = key: _STORM_INDICES.pop(key, None))
+    _STORM_INDICES[key] = (ref, len(positions_df), index)
+    
+    return index
+
+# Rows of positions_df belonging to stormID, as a slice where possible.
+def storm_rows(stormID, positions_df = None):
+    if positions_df is None:
+        positions_df = hc.positions()
+    return storm_index(positions_df).get(stormID, slice(0, 0))
 
-def winds(stormID, positions_df = POSITIONS):
-    ts_ne = positions_df['extNE34'][positions_df['stormID'] == stormID].tolist()
-    ts_se = positions_df['extSE34'][positions_df['stormID'] == stormID].tolist()
-    ts_sw = positions_df['extSW34'][positions_df['stormID'] == stormID].tolist()
-    ts_nw = positions_df['extNW34'][positions_df['stormID'] == stormID].tolist()
+# Values of one column of positions_df (or a track_store.TrackStore) for
+# stormID. When the storm's rows are contiguous in a DataFrame this is a numpy
+# view, so no data is copied.
+def storm_column(stormID, column, positions_df = None):
+    if positions_df is None:
+        positions_df = hc.positions()
+    return tst.column(positions_df, column, storm_rows(stormID, positions_df))
+
+def track_lat(stormID, positions_df = None):
+    return(storm_column(stormID, 'lat', positions_df).tolist())
+
+def track_lon(stormID, positions_df = None):
+    return(storm_column(stormID, 'lon', positions_df).tolist())
+
+def winds(stormID, positions_df = None):
+    if positions_df is None:
+        positions_df = hc.positions()
+    rows = storm_rows(stormID, positions_df)
+    
+    ts_ne = tst.column(positions_df, 'extNE34', rows).tolist()
+    ts_se = tst.column(positions_df, 'extSE34', rows).tolist()
+    ts_sw = tst.column(positions_df, 'extSW34', rows).tolist()
+    ts_nw = tst.column(positions_df, 'extNW34', rows).tolist()
     
-    hu_ne = positions_df['extNE64'][positions_df['stormID'] == stormID].tolist()
-    hu_se = positions_df['extSE64'][positions_df['stormID'] == stormID].tolist()
-    hu_sw = positions_df['extSW64'][positions_df['stormID'] == stormID].tolist()
-    hu_nw = positions_df['extNW64'][positions_df['stormID'] == stormID].tolist()
+    hu_ne = tst.column(positions_df, 'extNE64', rows).tolist()
+    hu_se = tst.column(positions_df, 'extSE64', rows).tolist()
+    hu_sw = tst.column(positions_df, 'extSW64', rows).tolist()
+    hu_nw = tst.column(positions_df, 'extNW64', rows).tolist()
     
-    status = positions_df['status'][positions_df['stormID'] == stormID].tolist()
+    status = tst.column(positions_df, 'status', rows).tolist()
     
     return([status, ts_ne, ts_se, ts_sw, ts_nw, hu_ne, hu_se, hu_sw, hu_nw])
 
-def plot_season_summary(year, positions_df = POSITIONS, storms_df = STORMS, export = False, fullcolor = False):
+# Line segments for the tracks of the storms in stormIDs, one (lon, lat) array
+# per storm, for drawing as a LineCollection.
+def track_segments(stormIDs, positions_df = None):
+    if positions_df is None:
+        positions_df = hc.positions()
+    
+    lats = tst.column(positions_df, 'lat')
+    lons = tst.column(positions_df, 'lon')
+    index = storm_index(positions_df)
+    
+    return [np.column_stack([lons[rows], lats[rows]]) for rows in (index.get(stormID, slice(0, 0)) for stormID in stormIDs)]
+
+# Figure and map axes with the coastlines (and the stock image, with
+# fullcolor) drawn in, ready for tracks to be added.
+def _basemap(global_view = True, fullcolor = False):
+    import matplotlib.pyplot as plt
+    
     fig = plt.figure(figsize=(10,10))
-    ax = plt.axes(projection = PROJECTION)
-    ax.set_global()
+    ax = plt.axes(projection = projection())
+    if global_view:
+        ax.set_global()
     ax.coastlines(color = "black")
-    if fullcolor:    
+    if fullcolor:
         ax.stock_img()
-    plt.title(f"{year} Atlantic Hurricane Season Summary", fontsize = 20)
+    
+    return fig, ax
+
+# All of the tracks of the year's storms as a single LineCollection.
+def _season_tracks(year, positions_df, storms_df):
+    import cartopy
+    from matplotlib.collections import LineCollection
+    
+    stormIDs = storms_df['stormID'][storms_df['year'] == year].astype('str')
+    
+    return LineCollection(track_segments(stormIDs, positions_df), colors = "red", transform = cartopy.crs.PlateCarree())
+
+# The title names the basins the year's storms are from.
+def _season_title(year, storms_df):
+    stormIDs = storms_df['stormID'][storms_df['year'] == year]
+    basins = [basin for basin in hc.BASINS if basin in hc.basin_of(stormIDs)]
+    if not basins:
+        basins = [hc.DEFAULT_BASIN] if isinstance(hc.DEFAULT_BASIN, str) else list(hc.DEFAULT_BASIN)
+    return f"{year} {' and '.join(basins)} Hurricane Season Summary"
 
-    for stormID in storms_df['stormID'][storms_df['year'] == year]:
-        lat, lon = track_lat(stormID, positions_df), track_lon(stormID, positions_df)
-        ax.plot(lon, lat, transform = cartopy.crs.PlateCarree(), c = "red")
+def _track_title(stormID, storms_df):
+    storm = storms_df[storms_df['stormID']== stormID]
+    name = storm['name'].astype('str').to_string(index = False).strip()
+    year = storm['year'].to_string(index = False).strip()
+    return name, year
+
+# basins (a basin's name or a list of basins) picks the data used when
+# positions_df or storms_df aren't given.
+def plot_season_summary(year, positions_df = None, storms_df = None, export = False, fullcolor = False, basins = None):
+    import matplotlib.pyplot as plt
+    if positions_df is None:
+        positions_df = hc.positions(basins)
+    if storms_df is None:
+        storms_df = hc.storms(basins)
+    
+    fig, ax = _basemap(global_view = True, fullcolor = fullcolor)
+    plt.title(_season_title(year, storms_df), fontsize = 20)
+
+    ax.add_collection(_season_tracks(year, positions_df, storms_df))
         
     if export:
         fig.savefig(f"../results/images/{year}summary.jpg")
         
-def plot_storm_track(stormID, positions_df = POSITIONS, storms_df = STORMS, global_view = False, export = False, fullcolor = False):
+def plot_storm_track(stormID, positions_df = None, storms_df = None, global_view = False, export = False, fullcolor = False):
     if stormID == None:
         return
     
-    storm = storms_df[storms_df['stormID']== stormID]
-    name = storm['name'].to_string(index = False).strip()
-    year = storm['year'].to_string(index = False).strip()
+    import cartopy
+    import matplotlib.pyplot as plt
+    if positions_df is None:
+        positions_df = hc.positions()
+    if storms_df is None:
+        storms_df = hc.storms()
     
-    fig = plt.figure(figsize=(10,10))
-    ax = plt.axes(projection = PROJECTION)
-    if global_view:
-        ax.set_global()
-    ax.coastlines()
-    if fullcolor:
-        ax.stock_img()
+    name, year = _track_title(stormID, storms_df)
+    
+    fig, ax = _basemap(global_view = global_view, fullcolor = fullcolor)
     plt.title(f"Track for {name} ({year})", fontsize = 20)
     
     ax.plot(track_lon(stormID, positions_df), track_lat(stormID, positions_df), transform = cartopy.crs.PlateCarree(), c = "red")
     
     if export:
         fig.savefig(f"../results/images/{name}{year}track.jpg")
+
+
+# Batch rendering: the figure, map axes and coastlines are set up once and
+# reused for every image, with only the tracks and the title swapped out
+# between images. Images are written to dest_dir with the same names the
+# plot functions export to, and the list of files written is returned. With
+# workers > 1 the images are split across that many processes, each setting
+# up its own figure once.
+def _in_processes(render, items, workers, *args):
+    from concurrent.futures import ProcessPoolExecutor
+    
+    num_shards = min(workers, len(items))
+    shards = [items[i::num_shards] for i in range(num_shards)]
+    
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        written = list(pool.map(render, shards, *[[arg] * num_shards for arg in args]))
+    
+    # Put the files back in the order they were asked for.
+    paths = [None] * len(items)
+    for i, shard_paths in enumerate(written):
+        paths[i::num_shards] = shard_paths
+    
+    return paths
+
+def render_season_summaries(years, positions_df = None, storms_df = None, fullcolor = False, workers = 1, dest_dir = "../results/images", basins = None):
+    import matplotlib.pyplot as plt
+    years = list(years)
+    if workers > 1 and len(years) > 1:
+        return _in_processes(render_season_summaries, years, workers, positions_df, storms_df, fullcolor, 1, dest_dir, basins)
+    
+    if positions_df is None:
+        positions_df = hc.positions(basins)
+    if storms_df is None:
+        storms_df = hc.storms(basins)
+    os.makedirs(dest_dir, exist_ok = True)
+    
+    fig, ax = _basemap(global_view = True, fullcolor = fullcolor)
+    title = ax.set_title("", fontsize = 20)
+    
+    written = []
+    for year in years:
+        tracks = ax.add_collection(_season_tracks(year, positions_df, storms_df))
+        title.set_text(_season_title(year, storms_df))
+        
+        path = os.path.join(dest_dir, f"{year}summary.jpg")
+        fig.savefig(path)
+        written.append(path)
+        
+        tracks.remove()
+    
+    plt.close(fig)
+    return written
+
+def render_storm_tracks(stormIDs, positions_df = None, storms_df = None, global_view = False, fullcolor = False, workers = 1, dest_dir = "../results/images"):
+    import cartopy
+    import matplotlib.pyplot as plt
+    stormIDs = list(stormIDs)
+    if workers > 1 and len(stormIDs) > 1:
+        return _in_processes(render_storm_tracks, stormIDs, workers, positions_df, storms_df, global_view, fullcolor, 1, dest_dir)
+    
+    if positions_df is None:
+        positions_df = hc.positions()
+    if storms_df is None:
+        storms_df = hc.storms()
+    os.makedirs(dest_dir, exist_ok = True)
+    
+    fig, ax = _basemap(global_view = global_view, fullcolor = fullcolor)
+    title = ax.set_title("", fontsize = 20)
+    
+    lats = tst.column(positions_df, 'lat')
+    lons = tst.column(positions_df, 'lon')
+    index = storm_index(positions_df)
+    
+    # The view the map starts with, which is what a track with nothing
+    # visible (e.g. on the far side of the globe) is shown in.
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    
+    written = []
+    for stormID in stormIDs:
+        # Put the view back as it was on a fresh map, so that each storm's
+        # view is fitted to that storm alone.
+        if not global_view:
+            ax.relim()
+            ax.set_xlim(xlim)
+            ax.set_ylim(ylim)
+            ax.set_autoscale_on(True)
+        
+        rows = index.get(stormID, slice(0, 0))
+        track, = ax.plot(lons[rows], lats[rows], transform = cartopy.crs.PlateCarree(), c = "red")
+        
+        name, year = _track_title(stormID, storms_df)
+        title.set_text(f"Track for {name} ({year})")
+        
+        path = os.path.join(dest_dir, f"{name}{year}track.jpg")
+        fig.savefig(path)
+        written.append(path)
+        
+        track.remove()
+    
+    plt.close(fig)
+    return written
         
         
-def stormID(name, year, storms_df = STORMS):
+def stormID(name, year, storms_df = None):
+    if storms_df is None:
+        storms_df = hc.storms()
     name = name.upper()
     match = storms_df[(storms_df['name'] == name) & (storms_df['year'] == year)]
     
@@ -95,5 +323,5 @@ def stormID(name, year, storms_df = STORMS):
         print(match['stormID'])
         return None
     
-    stormID = match['stormID'].to_string(index = False).strip()
+    stormID = match['stormID'].astype('str').to_string(index = False).strip()
     return stormID
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# import tile_server as tls
+
+# Purpose of module: a small local HTTP service for the dashboard, serving
+# the frequency grids as map tiles and answering point and box queries as
+# JSON, instead of re-running the notebooks for every view. Only the
+# standard library is used for the server itself (asyncio), so it runs
+# anywhere the rest of the code does:
+#
+#     python ../src/d07_visualization/tile_server.py [port]
+#
+# from the notebooks directory (or tls.run() from a notebook), then e.g.
+#
+#     http://127.0.0.1:8765/tiles/2/1/1.png?first=2010&last=2019&hu_only=1
+#     http://127.0.0.1:8765/point?lat=25.8&lon=-80.2&buffer=20&basin=Atlantic
+#     http://127.0.0.1:8765/box?lat_min=20&lat_max=30&lon_min=-100&lon_max=-80
+#     http://127.0.0.1:8765/frequency?lat=25.8&lon=-80.2&first=2004
+#
+# Every request can be filtered by season (first and last year, inclusive),
+# hu_only and basin (a basin's name, or several separated by commas).
+
+# Tiles are 256 pixel squares in the usual web map (Web Mercator, z/x/y)
+# layout, colored with the same colormap as wind_history.heatmap and scaled
+# to the whole grid, so neighbouring tiles match. Zero cells are left
+# transparent.
+
+# For each hu_only and set of basins, every storm is rasterized once into a
+# frequency_cube by season; the grid for any run of seasons is then a
+# difference of its prefix sums. Building a cube is the CPU-heavy part and
+# runs in a pool of worker processes (threads with workers = 0); tiles and
+# queries run in a thread pool, so the event loop only ever reads requests
+# and writes responses. Cubes, grids and rendered tiles are kept in LRU
+# caches, and requests for something already being computed wait for it
+# rather than computing it again, so concurrent users looking at the same
+# views are served from memory.
+
+import os, sys
+import json
+import asyncio
+import multiprocessing
+import math as m
+from io import BytesIO
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+root_dir = os.path.join(os.getcwd(), '..')
+sys.path.append(root_dir)
+
+import numpy as np
+from src.d02_intermediate import hurdat_cache as hc
+from src.d03_processing import frequency_cube as fcb
+from src.d03_processing import grids as grd
+from src.d03_processing import track_index as tix
+
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+TILE_SIZE = 256
+
+# Most entries kept in each cache; the least recently used are dropped first.
+CUBE_CACHE_SIZE = 8
+GRID_CACHE_SIZE = 64
+TILE_CACHE_SIZE = 2048
+
+# Filters shared by every request. basins is a tuple of basin names, or None
+# for the default basin.
+Filters = namedtuple('Filters', ['first', 'last', 'hu_only', 'basins'])
+
+# The state of a running service: the grid and first season frequencies are
+# computed for, the two executor pools, the LRU caches and the computations
+# in progress.
+Service = namedtuple('Service', ['grid', 'min_year', 'compute', 'render', 'caches', 'pending'])
+
+
+class BadRequest(ValueError):
+    pass
+
+
+# Look key up in the cache called name, or compute it with function(*args)
+# in pool (and keep it). Requests for a key that's already being computed
+# wait for that computation.
+async def _cached(service, name, key, pool, function, *args):
+
+    cache, size = service.caches[name]
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    pending = service.pending.get((name, key))
+    if pending is None:
+        pending = asyncio.get_running_loop().run_in_executor(pool, function, *args)
+        service.pending[(name, key)] = pending
+        pending.add_done_callback(lambda future: _store(service, name, key, future))
+
+    # A request going away doesn't cancel the computation others wait for.
+    return await asyncio.shield(pending)
+
+
+def _store(service, name, key, future):
+
+    service.pending.pop((name, key), None)
+    if future.cancelled() or future.exception() is not None:
+        return
+
+    cache, size = service.caches[name]
+    cache[key] = future.result()
+    while len(cache) > size:
+        cache.popitem(last = False)
+
+
+# The frequency cube by season for hu_only and basins, along with its prefix
+# sums. Runs in a worker process.
+def _build_cube(hu_only, basins, min_year, grid):
+
+    cube = fcb.frequency_cube(by = 'year', min_year = min_year, hu_only = hu_only, grid = grid, basins = basins)
+
+    return cube, fcb.cube_prefix(cube)
+
+
+async def _cube(service, filters):
+    return await _cached(service, 'cubes', (filters.hu_only, filters.basins), service.compute,
+                         _build_cube, filters.hu_only, filters.basins, service.min_year, service.grid)
+
+
+# The frequency grid for the seasons first to last of the cube (clipped to
+# the seasons it has), along with the largest value in it.
+def _grid_total(cube, prefix, first, last):
+
+    if len(cube.labels) == 0:
+        return np.zeros(cube.grid.shape), 0.0
+
+    first, last = max(first, cube.labels[0]), min(last, cube.labels[-1])
+    if first > last:
+        return np.zeros(cube.grid.shape), 0.0
+
+    grid = fcb.cube_total(cube, first, last, prefix = prefix)
+
+    return grid, float(grid.max())
+
+
+async def _grid(service, filters):
+
+    cube, prefix = await _cube(service, filters)
+
+    return await _cached(service, 'grids', filters, service.render, _grid_total, cube, prefix, filters.first, filters.last)
+
+
+# Latitude and longitude of the pixel centers of tile x, y at zoom z.
+def tile_coordinates(z, x, y, tile_size = TILE_SIZE):
+
+    n = 2**z
+    pixels = (np.arange(tile_size) + 0.5) / tile_size
+
+    lons = (x + pixels) / n * 360 - 180
+    lats = np.degrees(np.arctan(np.sinh(m.pi * (1 - 2 * (y + pixels) / n))))
+
+    return lats, lons
+
+
+# Values of freq_array (on grid) at each pixel of tile x, y at zoom z, with
+# NaN for pixels off the grid. Rows run from north to south, as in an image.
+def tile_values(freq_array, z, x, y, grid = grd.GLOBAL, tile_size = TILE_SIZE):
+
+    lats, lons = tile_coordinates(z, x, y, tile_size)
+
+    rows = np.floor((lats - grid.lat_min) * grid.cells_per_degree).astype(int)
+    cols = np.floor(((lons - grid.lon_min) % 360) * grid.cells_per_degree).astype(int)
+    if grid.wraps:
+        cols %= grid.shape[1]
+
+    row_ok = (rows >= 0) & (rows < grid.shape[0])
+    col_ok = (cols >= 0) & (cols < grid.shape[1])
+
+    values = np.full((tile_size, tile_size), np.nan)
+    values[np.ix_(row_ok, col_ok)] = freq_array[np.ix_(rows[row_ok], cols[col_ok])]
+
+    return values
+
+
+# Tile x, y at zoom z of freq_array as a PNG, colored from 0 to vmax.
+def render_tile(freq_array, vmax, z, x, y, grid = grd.GLOBAL, tile_size = TILE_SIZE):
+    import matplotlib
+    import matplotlib.image
+
+    values = tile_values(freq_array, z, x, y, grid, tile_size)
+
+    colors = matplotlib.colormaps['viridis'](values / vmax if vmax > 0 else values * 0)
+    colors[~(values > 0), 3] = 0
+
+    png = BytesIO()
+    matplotlib.image.imsave(png, colors, format = 'png')
+
+    return png.getvalue()
+
+
+async def _tile(service, filters, z, x, y):
+
+    freq_array, vmax = await _grid(service, filters)
+
+    return await _cached(service, 'tiles', (filters, z, x, y), service.render, render_tile, freq_array, vmax, z, x, y, service.grid)
+
+
+# Keep the hits (from track_index) of storms matching filters: seasons
+# first to last and, with hu_only, hurricane winds only.
+def _filter_hits(hits, filters):
+
+    storms_df = hc.storms(filters.basins)
+    years = dict(zip(storms_df['stormID'].astype('str').str.strip(), storms_df['year']))
+
+    year = hits['stormID'].map(years)
+    keep = (year >= filters.first) & (year <= filters.last)
+    if filters.hu_only:
+        keep &= hits['category'] == 'HU'
+
+    return hits[keep].reset_index(drop = True)
+
+
+def _hits_json(hits):
+
+    storms = tix.storms_affecting(hits)
+
+    return {'fixes': len(hits),
+            'storms': [{'stormID': row.stormID, 'name': row.name, 'category': row.category, 'fixes': int(row.fixes),
+                        'first': row.first.isoformat(), 'last': row.last.isoformat()}
+                       for row in storms.itertuples(index = False)]}
+
+
+def point_json(lat, lon, buffer, filters):
+
+    hits = tix.point_query(lat, lon, buffer, positions_df = hc.positions(filters.basins))
+
+    return dict(_hits_json(_filter_hits(hits, filters)), lat = lat, lon = lon, buffer = buffer)
+
+
+def box_json(lat_min, lat_max, lon_min, lon_max, filters):
+
+    hits = tix.box_query(lat_min, lat_max, lon_min, lon_max, positions_df = hc.positions(filters.basins))
+
+    return dict(_hits_json(_filter_hits(hits, filters)), lat_min = lat_min, lat_max = lat_max, lon_min = lon_min, lon_max = lon_max)
+
+
+# The value of freq_array (on grid) in the cell containing lat, lon.
+def cell_value(freq_array, lat, lon, grid = grd.GLOBAL):
+
+    row = int(m.floor((lat - grid.lat_min) * grid.cells_per_degree))
+    col = int(m.floor(((lon - grid.lon_min) % 360) * grid.cells_per_degree))
+    if grid.wraps:
+        col %= grid.shape[1]
+
+    if not (0 <= row < grid.shape[0] and 0 <= col < grid.shape[1]):
+        raise BadRequest(f"{lat}, {lon} is off the grid")
+
+    return float(freq_array[row, col])
+
+
+def _number(query, name, kind = float, default = None):
+
+    if name not in query:
+        if default is None:
+            raise BadRequest(f"Missing parameter {name}")
+        return default
+    try:
+        return kind(query[name][-1])
+    except ValueError:
+        raise BadRequest(f"Bad value for {name}: {query[name][-1]}")
+
+
+def _filters(query):
+
+    basins = None
+    if 'basin' in query:
+        basins = tuple(basin for value in query['basin'] for basin in value.split(',') if basin)
+        unknown = [basin for basin in basins if basin not in hc.BASINS]
+        if unknown:
+            raise BadRequest(f"Unknown basin {', '.join(unknown)}")
+        basins = basins[0] if len(basins) == 1 else basins
+
+    hu_only = query.get('hu_only', ['0'])[-1].lower() in ('1', 'true', 'yes')
+
+    return Filters(_number(query, 'first', int, -10**6), _number(query, 'last', int, 10**6), hu_only, basins)
+
+
+# The status, content type and body answering a GET of target.
+async def respond(service, target):
+
+    url = urlsplit(target)
+    query = parse_qs(url.query)
+    parts = [part for part in url.path.split('/') if part]
+
+    try:
+        filters = _filters(query)
+
+        if len(parts) == 4 and parts[0] == 'tiles' and parts[3].endswith('.png'):
+            try:
+                z, x, y = int(parts[1]), int(parts[2]), int(parts[3][:-4])
+            except ValueError:
+                raise BadRequest(f"Bad tile {url.path}")
+            if not (0 <= z <= 20 and 0 <= x < 2**z and 0 <= y < 2**z):
+                raise BadRequest(f"No tile {z}/{x}/{y}")
+            return 200, 'image/png', await _tile(service, filters, z, x, y)
+
+        loop = asyncio.get_running_loop()
+
+        if parts == ['point']:
+            result = await loop.run_in_executor(service.render, point_json,
+                                                _number(query, 'lat'), _number(query, 'lon'), _number(query, 'buffer', float, 0.0), filters)
+        elif parts == ['box']:
+            result = await loop.run_in_executor(service.render, box_json,
+                                                _number(query, 'lat_min'), _number(query, 'lat_max'),
+                                                _number(query, 'lon_min'), _number(query, 'lon_max'), filters)
+        elif parts == ['frequency']:
+            lat, lon = _number(query, 'lat'), _number(query, 'lon')
+            freq_array, vmax = await _grid(service, filters)
+            result = {'lat': lat, 'lon': lon, 'frequency': cell_value(freq_array, lat, lon, service.grid), 'max': vmax}
+        else:
+            return 404, 'application/json', json.dumps({'error': f"Nothing at {url.path}"}).encode()
+
+    except BadRequest as error:
+        return 400, 'application/json', json.dumps({'error': str(error)}).encode()
+
+    return 200, 'application/json', json.dumps(result).encode()
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+# Answer the requests on one connection (several, if the client keeps it
+# alive).
+async def _connection(service, reader, writer):
+
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                method, target, version = request_line.decode('latin-1').split()
+            except ValueError:
+                break
+
+            if method != 'GET':
+                status, content_type, body = 405, 'application/json', json.dumps({'error': "Only GET is supported"}).encode()
+            else:
+                try:
+                    status, content_type, body = await respond(service, target)
+                except Exception as error:
+                    status, content_type, body = 500, 'application/json', json.dumps({'error': repr(error)}).encode()
+
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+            writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                          f"Content-Type: {content_type}\r\n"
+                          f"Content-Length: {len(body)}\r\n"
+                          f"Access-Control-Allow-Origin: *\r\n"
+                          f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+# A service computing frequencies on grid for seasons from min_year on, with
+# workers processes building cubes (or threads, with workers = 0) and
+# threads threads rendering tiles and answering queries.
+def service(grid = grd.GLOBAL, min_year = 2004, workers = 1, threads = 4):
+
+    render = ThreadPoolExecutor(max_workers = threads)
+    # Worker processes are started fresh rather than forked: a fork of the
+    # server would copy its event loop, sockets and threads mid-flight.
+    compute = ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context('spawn')) if workers > 0 else render
+
+    caches = {'cubes': (OrderedDict(), CUBE_CACHE_SIZE),
+              'grids': (OrderedDict(), GRID_CACHE_SIZE),
+              'tiles': (OrderedDict(), TILE_CACHE_SIZE)}
+
+    return Service(grid, min_year, compute, render, caches, {})
+
+
+# Start serving on host:port. Returns the asyncio server and the service
+# (whose pools are shut down by close_service).
+async def start(host = HOST, port = PORT, **service_kwargs):
+
+    state = service(**service_kwargs)
+    server = await asyncio.start_server(lambda reader, writer: _connection(state, reader, writer), host, port)
+
+    return server, state
+
+
+def close_service(state):
+
+    state.render.shutdown()
+    if state.compute is not state.render:
+        state.compute.shutdown()
+
+
+# Serve until interrupted.
+def run(host = HOST, port = PORT, **service_kwargs):
+
+    async def main():
+        server, state = await start(host, port, **service_kwargs)
+        print(f"Serving on http://{host}:{port}/")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            close_service(state)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run(port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT)
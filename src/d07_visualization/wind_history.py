@@ -7,163 +7,206 @@ Created on Mon Oct  5 21:16:29 2020
 """
 
 import os, sys
+from functools import lru_cache
 import pandas as pd
 
 root_dir = os.path.join(os.getcwd(), '..')
 sys.path.append(root_dir)
 
 import numpy as np
-import math as m
-import cartopy.crs as ccrs
-import matplotlib.pyplot as plt
+from src.d00_utils import instrument as ins
+from src.d02_intermediate import hurdat_cache as hc
 from src.d07_visualization import storm_tracks as trk
+from src.d03_processing import grids as grd
+from src.d03_processing import swath as sw
+from src.d03_processing import swath_cache as swc
+
+
+# Lazily provide the old module-level datasets and projection.
+def __getattr__(name):
+    if name == 'POSITIONS':
+        return hc.positions()
+    if name == 'STORMS':
+        return hc.storms()
+    if name == 'PROJECTION':
+        return trk.projection()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# The corners of every cell of grid projected into map coordinates, computed
+# once per projection and grid rather than on every draw. Corners on the far
+# side of the globe can't be projected; valid flags the cells whose four
+# corners can.
+@lru_cache(maxsize = 8)
+def projected_mesh(grid = grd.GLOBAL):
+    import cartopy.crs as ccrs
+    
+    Lon, Lat = np.meshgrid(grid.lon_edges(), grid.lat_edges())
+    points = trk.projection().transform_points(ccrs.PlateCarree(), Lon, Lat)
+    X, Y = points[..., 0], points[..., 1]
+    
+    finite = np.isfinite(X) & np.isfinite(Y)
+    valid = finite[1:, 1:] & finite[:-1, :-1] & finite[1:, :-1] & finite[:-1, 1:]
+    
+    # pcolormesh needs finite corners; cells using the placeholder corners
+    # are masked so they're never drawn.
+    X = np.where(finite, X, 0)
+    Y = np.where(finite, Y, 0)
+    
+    return X, Y, valid
 
+# Draw values (on grid) onto ax, leaving zero cells transparent. Only the
+# block of cells containing visible nonzero values is handed to pcolormesh,
+# already in map coordinates, so nothing has to be reprojected at draw time.
+def _draw_cells(ax, values, grid = grd.GLOBAL, **kwargs):
+    import matplotlib.axes
+    
+    X, Y, valid = projected_mesh(grid)
+    
+    values = np.ma.masked_equal(values, 0)
+    visible = valid & ~np.ma.getmaskarray(values)
+    
+    # Colors are scaled to all of the values, as they would be if the whole
+    # grid were drawn.
+    if values.count():
+        kwargs.setdefault('vmin', values.min())
+        kwargs.setdefault('vmax', values.max())
+    
+    if visible.any():
+        rows = np.flatnonzero(visible.any(axis = 1))
+        cols = np.flatnonzero(visible.any(axis = 0))
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    else:
+        r0, r1, c0, c1 = 0, 1, 0, 1
+    
+    cropped = np.ma.masked_where(~visible[r0:r1, c0:c1], values[r0:r1, c0:c1])
+    
+    # Call matplotlib's pcolormesh directly: the coordinates are already
+    # projected, so cartopy's reprojection and wrapping checks aren't needed.
+    return matplotlib.axes.Axes.pcolormesh(ax, X[r0:r1 + 1, c0:c1 + 1], Y[r0:r1 + 1, c0:c1 + 1], cropped, **kwargs)
 
-RADIUS = 3440.1
-
-PROJECTION = ccrs.NearsidePerspective(central_longitude = -55, central_latitude = 30,  satellite_height = 10000000)
-
-POSITIONS = pd.read_csv('../data/02_intermediate/Atlantic_positions.csv')
-STORMS = pd.read_csv('../data/02_intermediate/Atlantic_storms.csv')
-
-def wind_history(stormID, positions_df = POSITIONS, storms_df = STORMS):
-    # Get the list of all of our coordinates, as well as the lists of wind extents
-    storm_lats = trk.track_lat(stormID)
-    storm_lons = trk.track_lon(stormID)
-    storm_winds = trk.winds(stormID, positions_df)
-    
-    # Create empty matrix
-    wind_history = np.zeros((180, 360))
-
-    # Construct list of bearings
-    ne_brngs = np.linspace(0, 90, 31)
-    se_brngs = np.linspace(90, 180, 31)
-    sw_brngs = np.linspace(180, 270, 31)
-    nw_brngs = np.linspace(270, 360, 31)
-    brngs = [ne_brngs, se_brngs, sw_brngs, nw_brngs]
-    
-    # For each pair of coordinates in the storm's history
-    for x in range(len(storm_lats)):
-        
-        # Get and convert to radians from the center coordinates.
-        lat = storm_lats[x]
-        lon = storm_lons[x]
-        rlat = lat*(m.pi/180)
-        rlon = lon*(m.pi/180)
-        # Pull out the correct wind values
-        trext = [storm_winds[1][x], storm_winds[2][x], storm_winds[3][x], storm_winds[4][x]]
-        huext = [storm_winds[5][x], storm_winds[6][x], storm_winds[7][x], storm_winds[8][x]]
-        # If wind extents are missing for this row, skip to the next row.
-        if -999 in trext:
-            continue
-        if -999 in huext:
-            continue
-        
-        # If the storm is at least a tropical storm
-        if storm_winds[0][x] in [' TS', ' HU']:
-            # Implement the formula for the tropical storm wind extents
-            for quad in range(4):
-                
-                dist = trext[quad] / RADIUS
-                
-                for i in brngs[quad]:
-                    brng = i * (m.pi/180)
-                    dlat = m.asin(m.sin(rlat)*m.cos(dist) + m.cos(rlat)*m.sin(dist)*m.cos(brng))
-                    dlon = rlon + m.atan2(m.sin(brng)*m.sin(dist)*m.cos(rlat), m.cos(dist)-m.sin(rlat)*m.sin(dlat))
-    
-                    dlat *= (180/m.pi)
-                    dlon *= (180/m.pi)
-                    if dlon < -180:
-                        dlon += 360
-                    elif dlon > 180:
-                        dlon -= 360
-            
-                    if quad in [0, 3]:
-                        for y in range((90 + m.floor(lat)), (90 + m.ceil(dlat))):
-                            # ONLY if the cell was not previously set to 2
-                            if (wind_history[y][180 + m.floor(dlon)] != 2):
-                                wind_history[y][180 + m.floor(dlon)] = 1
-
-                    elif quad in [1, 2]:
-                        for y in range((90 + m.floor(dlat)), (90 + m.ceil(lat))):
-                            # ONLY if the cell was not previously set to 2
-                            if (wind_history[y][180 + m.floor(dlon)] != 2):
-                                wind_history[y][180 + m.floor(dlon)] = 1
-                            
-        # If the storm is a hurricane
-        if storm_winds[0][x] == ' HU':
-            # Implement the formula again for the hurricane wind extents
-            for quad in range(4):
-    
-                dist = huext[quad] / RADIUS
-                
-                for i in brngs[quad]:
-                    brng = i * (m.pi/180)
-                    dlat = m.asin(m.sin(rlat)*m.cos(dist) + m.cos(rlat)*m.sin(dist)*m.cos(brng))
-                    dlon = rlon + m.atan2(m.sin(brng)*m.sin(dist)*m.cos(rlat), m.cos(dist)-m.sin(rlat)*m.sin(dlat))
-                    
-                    dlat *= (180/m.pi)
-                    dlon *= (180/m.pi)
-                    if dlon < -180:
-                        dlon += 360
-                    elif dlon > 180:
-                        dlon -= 360
-        
-                    if quad  in [0, 3]:
-                        for y in range((90 + m.floor(lat)), (90 + m.ceil(dlat))):
-                            wind_history[y][180 + m.floor(dlon)] = 2
-                    
-                    elif quad in [1, 2]:
-                        for y in range((90 + m.floor(dlat)), (90 + m.ceil(lat))):
-                            wind_history[y][180 + m.floor(dlon)] = 2
-
-    # Mask the zero values            
-    wind_history_transparent = np.ma.masked_equal(wind_history, 0)
-
-    # And plot the result
-    projection = ccrs.NearsidePerspective(central_longitude = -55, central_latitude = 30,  satellite_height = 10000000)
-    lon = np.linspace(-180, 180, 361) # changed from 179
-    lat = np.linspace(-90, 90, 181) # changed from 89
-    Lon, Lat = np.meshgrid(lon, lat)
-
+# A global map with coastlines to draw heatmaps on.
+def _basemap():
+    import matplotlib.pyplot as plt
+    
     fig = plt.figure(figsize=(10,10))
-    ax = plt.axes(projection = projection)
+    ax = plt.axes(projection = trk.projection())
     ax.set_global()
     ax.coastlines()
-    ax.pcolormesh(Lon, Lat, wind_history_transparent, transform = ccrs.PlateCarree())
+    
+    return fig, ax
+
+# With use_cache the storm's grid is built from its footprint in swath_cache,
+# which is kept on disk, as with wind_frequency's use_cache. backend picks
+# the code rasterizing the storm's winds (see swath).
+def wind_history(stormID, positions_df = None, storms_df = None, use_cache = False, grid = grd.GLOBAL, backend = 'numpy'):
+    import matplotlib.pyplot as plt
+    if positions_df is None:
+        positions_df = hc.positions()
+    if storms_df is None:
+        storms_df = hc.storms()
+    
+    lap = ins.laps("wind_history")
+    
+    # Rasterize the tropical storm (1) and hurricane (2) wind extents for
+    # every position in the storm's history, or reuse the storm's footprint
+    # from swath_cache if asked to.
+    if use_cache:
+        wind_history = swc.cached_storm_grid(stormID, positions_df, grid = grid, backend = backend)
+    else:
+        storm_winds = trk.winds(stormID, positions_df)
+        wind_history = sw.storm_grid(trk.track_lat(stormID, positions_df),
+                                     trk.track_lon(stormID, positions_df),
+                                     storm_winds[0],
+                                     list(zip(*storm_winds[1:5])),
+                                     list(zip(*storm_winds[5:9])),
+                                     grid = grid,
+                                     backend = backend)
+    lap("rasterize")
+
+    # And plot the result, with the zero values left transparent
+    fig, ax = _basemap()
+    lap("basemap")
+    _draw_cells(ax, wind_history, grid)
+    lap("draw")
     
     storm = storms_df[storms_df['stormID']== stormID]
-    name = storm['name'].to_string(index = False).strip()
+    name = storm['name'].astype('str').to_string(index = False).strip()
     year = storm['year'].to_string(index = False).strip()
     plt.title(f"Wind History for {name} ({year})", fontsize = 20)
 
     # Note: Tropical Storm Winds in Purple, Hurricane in Yellow
 
-def heatmap(freq_array, export = False, dest_fn = "wind_history_heatmap", is_hu_only = False, subtitle = None):
-    
+def _heatmap_title(is_hu_only, subtitle):
     if subtitle == None:
         subtitle = ""
+    if is_hu_only:
+        return f"Number of Cyclones Producing Hurricane-Force Winds /n {subtitle}"
+    return f"Number of Cyclones Producing TS-Force Winds \n {subtitle}"
+
+# freq_array is drawn on grid; a DataFrame labelled with its cell edges (as
+# written by grids.save_frequency_csv) carries its own grid.
+def heatmap(freq_array, export = False, dest_fn = "wind_history_heatmap", is_hu_only = False, subtitle = None, grid = grd.GLOBAL):
+    import matplotlib.pyplot as plt
     
-    freq_array_transparent = np.ma.masked_equal(freq_array, 0)
+    lap = ins.laps("heatmap")
     
-    projection = ccrs.NearsidePerspective(central_longitude = -55, central_latitude = 30,  satellite_height = 10000000)
-    lon = np.linspace(-180, 180, 361) # changed from 179
-    lat = np.linspace(-90, 90, 181) # changed from 89
-    Lon, Lat = np.meshgrid(lon, lat)
-
-    fig = plt.figure(figsize=(10,10))
-    ax = plt.axes(projection = projection)
-    ax.set_global()
-    ax.coastlines()
-    mesh = ax.pcolormesh(Lon, Lat, freq_array_transparent, transform = ccrs.PlateCarree())
+    if isinstance(freq_array, pd.DataFrame):
+        freq_array, grid = grd.from_frame(freq_array)
+    
+    fig, ax = _basemap()
+    lap("basemap")
+    mesh = _draw_cells(ax, freq_array, grid)
     plt.colorbar(mesh)
-    if is_hu_only:
-        plt.title(f"Number of Cyclones Producing Hurricane-Force Winds /n {subtitle}", fontsize = 20)
-    else:
-        plt.title(f"Number of Cyclones Producing TS-Force Winds \n {subtitle}", fontsize = 20)
+    plt.title(_heatmap_title(is_hu_only, subtitle), fontsize = 20)
+    if ins.ENABLED:
+        lap("draw", cells = int(np.count_nonzero(freq_array)))
     
     if export:
         fig.savefig(f"../results/images/{dest_fn}.jpg")
+        lap("save")
     
     return
+
+# Render several heatmaps (e.g. one per decade, as frames of an animation) to
+# ../results/images/{dest_fn}.jpg for each of dest_fns, on one figure: the
+# map and coastlines are set up once and only the cells, colorbar and title
+# change between frames. subtitles, if given, has one entry per heatmap.
+# Returns the list of files written.
+def render_heatmaps(freq_arrays, dest_fns, is_hu_only = False, subtitles = None, grid = grd.GLOBAL):
+    import matplotlib.pyplot as plt
+    
+    freq_arrays = list(freq_arrays)
+    if subtitles is None:
+        subtitles = [None] * len(freq_arrays)
+    
+    lap = ins.laps("render_heatmaps")
+    
+    fig, ax = _basemap()
+    title = ax.set_title("", fontsize = 20)
+    colorbar = None
+    lap("basemap")
+    
+    written = []
+    for freq_array, dest_fn, subtitle in zip(freq_arrays, dest_fns, subtitles):
+        frame_grid = grid
+        if isinstance(freq_array, pd.DataFrame):
+            freq_array, frame_grid = grd.from_frame(freq_array)
+        
+        mesh = _draw_cells(ax, freq_array, frame_grid)
+        if colorbar is None:
+            colorbar = plt.colorbar(mesh)
+        else:
+            colorbar.update_normal(mesh)
+        title.set_text(_heatmap_title(is_hu_only, subtitle))
+        if ins.ENABLED:
+            lap("draw", cells = int(np.count_nonzero(freq_array)))
+        
+        path = f"../results/images/{dest_fn}.jpg"
+        fig.savefig(path)
+        written.append(path)
+        lap("save")
+        
+        mesh.remove()
     
+    plt.close(fig)
+    return written